@@ -0,0 +1,32 @@
+"""Add oauthstate table so BNet login state is shared across workers.
+
+Revision ID: b4c5d6e7f8a9
+Revises: a3b4c5d6e7f8
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "b4c5d6e7f8a9"
+down_revision: Union[str, None] = "a3b4c5d6e7f8"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "oauthstate",
+        sa.Column("state", sa.String(), nullable=False),
+        sa.Column("next_url", sa.String(), nullable=True),
+        sa.Column("expires_at", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("state"),
+    )
+    op.create_index("ix_oauthstate_expires_at", "oauthstate", ["expires_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_oauthstate_expires_at", table_name="oauthstate")
+    op.drop_table("oauthstate")
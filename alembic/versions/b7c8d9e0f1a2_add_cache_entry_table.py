@@ -0,0 +1,35 @@
+"""Add cacheentry table for the shared cache backend.
+
+Revision ID: b7c8d9e0f1a2
+Revises: f6a7b8c9d0e1
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "b7c8d9e0f1a2"
+down_revision: Union[str, None] = "f6a7b8c9d0e1"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "cacheentry",
+        sa.Column("namespace", sa.String(), nullable=False),
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("value", sa.String(), nullable=True),
+        sa.Column("fresh_until", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("expires_at", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("lease_until", sa.Float(), nullable=False, server_default="0"),
+        sa.PrimaryKeyConstraint("namespace", "key"),
+    )
+    op.create_index("ix_cacheentry_expires_at", "cacheentry", ["expires_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_cacheentry_expires_at", table_name="cacheentry")
+    op.drop_table("cacheentry")
@@ -0,0 +1,36 @@
+"""Allow one queued/running job per kind, so enqueue dedupes atomically.
+
+Revision ID: c5d6e7f8a9b0
+Revises: b4c5d6e7f8a9
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "c5d6e7f8a9b0"
+down_revision: Union[str, None] = "b4c5d6e7f8a9"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_ACTIVE = sa.text("status IN ('queued', 'running')")
+
+
+def upgrade() -> None:
+    # Duplicates the old check-then-insert may have let through: keep the newest
+    op.execute(
+        "UPDATE job SET status = 'failed', error = 'duplicate of a newer job' "
+        "WHERE status IN ('queued', 'running') AND created_at < "
+        "(SELECT MAX(j2.created_at) FROM job j2 "
+        "WHERE j2.kind = job.kind AND j2.status IN ('queued', 'running'))"
+    )
+    op.create_index(
+        "ux_job_active_kind", "job", ["kind"], unique=True,
+        sqlite_where=_ACTIVE, postgresql_where=_ACTIVE,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ux_job_active_kind", table_name="job")
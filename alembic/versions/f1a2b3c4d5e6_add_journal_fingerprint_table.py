@@ -0,0 +1,30 @@
+"""Add journalfingerprint table for incremental instance seeding.
+
+Revision ID: f1a2b3c4d5e6
+Revises: e0f1a2b3c4d5
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "f1a2b3c4d5e6"
+down_revision: Union[str, None] = "e0f1a2b3c4d5"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "journalfingerprint",
+        sa.Column("path", sa.String(), nullable=False),
+        sa.Column("fingerprint", sa.String(), nullable=False),
+        sa.Column("updated_at", sa.Float(), nullable=False, server_default="0"),
+        sa.PrimaryKeyConstraint("path"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("journalfingerprint")
@@ -0,0 +1,30 @@
+"""Unique (instance_id, blizzard_id) on encounter, for upsert-based seeding.
+
+Revision ID: f2a3b4c5d6e7
+Revises: f1a2b3c4d5e6
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "f2a3b4c5d6e7"
+down_revision: Union[str, None] = "f1a2b3c4d5e6"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Drop duplicates a wipe-and-reload seed may have left, keeping the first row
+    op.execute(
+        "DELETE FROM encounter WHERE id NOT IN "
+        "(SELECT MIN(id) FROM encounter GROUP BY instance_id, blizzard_id)"
+    )
+    op.create_index(
+        "ix_encounter_instance_blizzard", "encounter", ["instance_id", "blizzard_id"], unique=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_encounter_instance_blizzard", table_name="encounter")
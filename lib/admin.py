@@ -20,7 +20,7 @@ class AdminAuth(AuthenticationBackend):
         username = form.get("username", "")
         password = form.get("password", "")
         with Session(db.engine) as session:
-            user = security.authenticate_user(username, password, session)
+            user = await security.aauthenticate_user(username, password, session)
             if not user or user.role not in ("owner", "administrator"):
                 return False
         request.session["admin_user"] = username
@@ -46,10 +46,20 @@ class UserAdmin(ModelView, model=db.User):
     column_searchable_list = [db.User.username]
     column_sortable_list = [db.User.username, db.User.role, db.User.created_at]
     column_default_sort = [(db.User.created_at, True)]
-    form_excluded_columns = [db.User.password, db.User.created_at]
+    form_excluded_columns = [db.User.password, db.User.token_version, db.User.created_at]
     can_create = False  # use POST /api/users
     can_delete = False  # sensitive — use API
 
+    async def on_model_change(self, data, model, is_created, request) -> None:
+        security.invalidate_principal(model.username)  # name before the edit
+        if not is_created and data.get("role", model.role) != model.role:
+            # Tokens embed the role, so the old ones must stop working
+            data["token_version"] = model.token_version + 1
+
+    async def after_model_change(self, data, model, is_created, request) -> None:
+        security.invalidate_principal(model.username)
+        security.invalidate_revocations()
+
 
 class GuildMemberAdmin(ModelView, model=db.GuildMember):
     name = "Guild Member"
@@ -1,44 +1,54 @@
+import asyncio
+import logging
 import os
+import threading
 import time
+from typing import Optional
 
 import dotenv
-import requests
-from sqlalchemy.dialects.postgresql import insert
 from sqlmodel import Session, select
 
+import lib.blizzard as blizzard
 import lib.db as db
 
 dotenv.load_dotenv()
 
-TOKEN_URL = "https://oauth.battle.net/token"
+logger = logging.getLogger(__name__)
 
+TOKEN_URL = f"{blizzard.OAUTH_BASE}/token"
 
-def get_access_token() -> str:
+# Refresh this many seconds before the token actually expires
+REFRESH_MARGIN_SECONDS = int(os.getenv("BLIZZARD_TOKEN_REFRESH_MARGIN", "300"))
+
+
+def _load_stored_token() -> Optional[tuple[str, float]]:
     with Session(db.engine) as session:
-        # 1) Try to load the single token row
         statement = select(db.OAuthToken).where(db.OAuthToken.id == 1)
         result = session.exec(statement).first()
+        if result is None:
+            return None
+        return result.access_token, result.expires_at
 
-        if result and result.expires_at > time.time():
-            return result.access_token
-
-        # 2) Otherwise fetch a new token
-        resp = requests.post(
-            TOKEN_URL,
-            data={
-                "grant_type": "client_credentials",
-                "client_id": os.getenv("CLIENT_ID"),
-                "client_secret": os.getenv("CLIENT_SECRET"),
-            },
-        )
-        resp.raise_for_status()
-        j = resp.json()
-        token = j["access_token"]
-        expires = time.time() + j.get("expires_in", 3600) - 10
 
-        # 3) Upsert into DB (handles concurrent requests gracefully)
+def _fetch_new_token() -> tuple[str, float]:
+    resp = blizzard.request(
+        "POST",
+        TOKEN_URL,
+        data={
+            "grant_type": "client_credentials",
+            "client_id": os.getenv("CLIENT_ID"),
+            "client_secret": os.getenv("CLIENT_SECRET"),
+        },
+    )
+    resp.raise_for_status()
+    j = resp.json()
+    token = j["access_token"]
+    expires = time.time() + j.get("expires_in", 3600) - 10
+
+    # Upsert into DB so other workers can reuse it (handles concurrent writers)
+    with Session(db.engine) as session:
         stmt = (
-            insert(db.OAuthToken)
+            db.dialect_insert(db.OAuthToken, session)
             .values(id=1, access_token=token, expires_at=expires)
             .on_conflict_do_update(
                 index_elements=["id"],
@@ -47,4 +57,97 @@ def get_access_token() -> str:
         )
         session.execute(stmt)
         session.commit()
+    return token, expires
+
+
+class _TokenHolder:
+    """Process-wide copy of the client-credentials token.
+
+    Reads are lock-free while the token is comfortably valid. Inside the
+    refresh margin a single thread refreshes (checking the DB row first, since
+    another worker may already have done it) while the others keep using the
+    still-valid token; only a missing or expired token makes callers wait.
+    """
+
+    def __init__(self, refresh_margin: float = REFRESH_MARGIN_SECONDS):
+        self.refresh_margin = refresh_margin
+        # (token, expires_at) swapped as one tuple so lock-free readers never see a mix
+        self._current: Optional[tuple[str, float]] = None
+        self._rejected: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        stored = _load_stored_token()
+        if (
+            stored
+            and stored[0] != self._rejected
+            and time.time() < stored[1] - self.refresh_margin
+        ):
+            self._current = stored
+            return
+        self._current = _fetch_new_token()
+
+    def get(self) -> str:
+        current = self._current
+        now = time.time()
+        if current and now < current[1] - self.refresh_margin:
+            return current[0]
+
+        if current and now < current[1]:
+            # Still valid: refresh early without stalling everyone else
+            if not self._lock.acquire(blocking=False):
+                return current[0]
+            try:
+                if self._current is current:
+                    self._refresh()
+            except Exception as e:
+                logger.warning("Proactive Blizzard token refresh failed: %s", e)
+            finally:
+                self._lock.release()
+            return (self._current or current)[0]
+
+        with self._lock:
+            if self._current is None or time.time() >= self._current[1]:
+                self._refresh()
+            return self._current[0]  # type: ignore[index]
+
+    def peek(self) -> Optional[str]:
+        """Return the token if it needs no refresh, without blocking."""
+        current = self._current
+        if current and time.time() < current[1] - self.refresh_margin:
+            return current[0]
+        return None
+
+    def invalidate(self, token: Optional[str] = None) -> None:
+        """Forget the token, e.g. after Blizzard rejects it.
+
+        The rejected value is remembered so the next refresh fetches a new one
+        instead of re-reading the same token from the DB row. With ``token``,
+        nothing happens if the holder has already moved on to another one (so
+        concurrent rejections of the same token cause one refresh).
+        """
+        with self._lock:
+            if self._current is None or (token is not None and self._current[0] != token):
+                return
+            self._rejected = self._current[0]
+            self._current = None
+
+
+_holder = _TokenHolder()
+
+
+def get_access_token() -> str:
+    return _holder.get()
+
+
+async def aget_access_token() -> str:
+    """Async variant: served from memory, refreshing in a thread only when needed."""
+    token = _holder.peek()
+    if token is not None:
         return token
+    return await asyncio.to_thread(_holder.get)
+
+
+def invalidate_access_token(token: Optional[str] = None) -> None:
+    """Drop the client-credentials token (``token``, if given) after a 401."""
+    _holder.invalidate(token)
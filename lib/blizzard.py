@@ -0,0 +1,645 @@
+"""Shared HTTP client for every Blizzard call (Game Data API, OAuth, profile).
+
+All modules talking to Blizzard go through one pooled, keep-alive
+``httpx.Client`` so TCP+TLS handshakes are paid once per connection instead of
+once per request. Timeouts are always set; HTTP/2 can be enabled with
+``BLIZZARD_HTTP2=true`` when the optional ``h2`` package is installed.
+
+Fan-out paths (roster lookups, journal crawls) use the asyncio twins
+(``arequest``, ``aapi_get``, ...) backed by one ``httpx.AsyncClient`` per event
+loop, with at most ``BLIZZARD_ASYNC_CONCURRENCY`` requests in flight per loop.
+
+Every request, sync or async, first takes a token from one process-wide
+``RateLimiter`` sized to Blizzard's quotas (per second and per hour). The
+budgets are per process, so with several workers divide them accordingly.
+
+Transient failures (429, 5xx, timeouts, dropped connections) are retried by a
+``RetryPolicy``: exponential backoff with full jitter, ``Retry-After`` honoured,
+and a per-call budget on both attempts and total time spent waiting.
+
+Each upstream host (API, OAuth) has a ``CircuitBreaker``: after repeated 5xx or
+transport failures calls fail fast with ``CircuitOpenError`` until a probe
+request succeeds, so an outage does not pin worker threads on timeouts.
+
+``api_get_json(..., conditional=True)`` revalidates against the last stored
+copy of a resource (``blizzardresponse`` table) with ``If-None-Match`` /
+``If-Modified-Since``; unchanged documents come back as an empty 304.
+
+Identical JSON GETs that overlap in time are coalesced (``flights``): one
+request goes upstream and every concurrent caller gets its decoded body.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import email.utils
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+import dotenv
+import httpx
+from sqlmodel import Session, update
+
+import lib.db as db
+
+from lib.circuit import CircuitBreaker, CircuitOpenError  # noqa: F401 (re-exported)
+from lib.ratelimit import RateLimiter, TokenBucket
+from lib.singleflight import SingleFlight
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REGION = os.getenv("REGION", "eu")
+LOCALE = os.getenv("LOCALE", "en_US")
+API_BASE = f"https://{REGION}.api.blizzard.com"
+OAUTH_BASE = "https://oauth.battle.net"
+
+TIMEOUT = httpx.Timeout(
+    float(os.getenv("BLIZZARD_TIMEOUT", "10")),
+    connect=float(os.getenv("BLIZZARD_CONNECT_TIMEOUT", "5")),
+)
+LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("BLIZZARD_MAX_CONNECTIONS", "50")),
+    max_keepalive_connections=int(os.getenv("BLIZZARD_MAX_KEEPALIVE", "20")),
+    keepalive_expiry=float(os.getenv("BLIZZARD_KEEPALIVE_EXPIRY", "60")),
+)
+ASYNC_CONCURRENCY = int(os.getenv("BLIZZARD_ASYNC_CONCURRENCY", "20"))
+RATE_PER_SECOND = float(os.getenv("BLIZZARD_RATE_PER_SECOND", "100"))
+RATE_PER_HOUR = float(os.getenv("BLIZZARD_RATE_PER_HOUR", "36000"))
+RETRY_ATTEMPTS = int(os.getenv("BLIZZARD_RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("BLIZZARD_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("BLIZZARD_RETRY_MAX_DELAY", "10"))
+RETRY_BUDGET = float(os.getenv("BLIZZARD_RETRY_BUDGET", "30"))
+
+CIRCUIT_FAILURES = int(os.getenv("BLIZZARD_CIRCUIT_FAILURES", "5"))
+CIRCUIT_RESET = float(os.getenv("BLIZZARD_CIRCUIT_RESET", "30"))
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+T = TypeVar("T")
+
+
+def _http2_enabled() -> bool:
+    if os.getenv("BLIZZARD_HTTP2", "false").lower() not in ("1", "true", "yes"):
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("BLIZZARD_HTTP2 is set but the 'h2' package is not installed; using HTTP/1.1.")
+        return False
+    return True
+
+
+def static_namespace() -> str:
+    return f"static-{REGION}"
+
+
+def dynamic_namespace() -> str:
+    return f"dynamic-{REGION}"
+
+
+def profile_namespace() -> str:
+    return f"profile-{REGION}"
+
+
+# ---------------------------------------------------------------------------
+# Rate limiting
+# ---------------------------------------------------------------------------
+
+limiter = RateLimiter(
+    {
+        "second": TokenBucket(rate=RATE_PER_SECOND, capacity=RATE_PER_SECOND),
+        "hour": TokenBucket(rate=RATE_PER_HOUR / 3600, capacity=RATE_PER_HOUR),
+    }
+)
+
+
+def rate_limit_status() -> dict:
+    """Remaining request budget, for the admin status endpoint."""
+    return limiter.snapshot()
+
+
+# ---------------------------------------------------------------------------
+# Retries
+# ---------------------------------------------------------------------------
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    """Parse a ``Retry-After`` header (delta-seconds or HTTP-date)."""
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class RetryPolicy:
+    """Backoff schedule and per-call retry budget.
+
+    A call is retried at most ``attempts`` times and gives up early once the
+    next wait would push the total time slept past ``budget`` seconds.
+    """
+
+    def __init__(
+        self,
+        attempts: int = RETRY_ATTEMPTS,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY,
+        budget: float = RETRY_BUDGET,
+    ):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.retries = 0
+        self.exhausted = 0
+
+    def next_delay(
+        self, retry: int, waited: float, resp: Optional[httpx.Response] = None
+    ) -> Optional[float]:
+        """Seconds to wait before retry number ``retry``, or None to give up."""
+        if retry >= self.attempts:
+            if self.attempts:
+                self.exhausted += 1
+            return None
+        delay = _retry_after(resp) if resp is not None else None
+        if delay is None:
+            # Full jitter: spreads out callers that failed at the same moment
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+        if waited + delay > self.budget:
+            self.exhausted += 1
+            return None
+        self.retries += 1
+        return delay
+
+    def stats(self) -> dict:
+        return {"retries": self.retries, "exhausted": self.exhausted}
+
+
+DEFAULT_RETRY = RetryPolicy()
+# For non-idempotent calls such as exchanging a single-use OAuth code
+NO_RETRY = RetryPolicy(attempts=0)
+
+
+# ---------------------------------------------------------------------------
+# Circuit breakers
+# ---------------------------------------------------------------------------
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(url: str) -> CircuitBreaker:
+    """The circuit breaker guarding ``url``'s host."""
+    host = httpx.URL(url).host
+    breaker = _breakers.get(host)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(
+                host, CircuitBreaker(host, CIRCUIT_FAILURES, CIRCUIT_RESET)
+            )
+    return breaker
+
+
+def _record(breaker: CircuitBreaker, resp: httpx.Response) -> None:
+    # 4xx (including 429) means the upstream is up and answering
+    if resp.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def status() -> dict:
+    """Rate-limit budget, retry counters and circuit states, for the admin status endpoint."""
+    return {
+        "rate_limit": rate_limit_status(),
+        "retry": DEFAULT_RETRY.stats(),
+        "circuits": {host: b.snapshot() for host, b in sorted(_breakers.items())},
+        "conditional": dict(_conditional_counts),
+        "coalesced": flights.coalesced,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Client lifecycle
+# ---------------------------------------------------------------------------
+
+_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> httpx.Client:
+    """Return the process-wide pooled client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(
+                    timeout=TIMEOUT,
+                    limits=LIMITS,
+                    http2=_http2_enabled(),
+                    headers={"Accept": "application/json"},
+                )
+    return _client
+
+
+def close() -> None:
+    """Close pooled connections (called on application shutdown)."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+# ---------------------------------------------------------------------------
+# Requests
+# ---------------------------------------------------------------------------
+
+def request(
+    method: str, url: str, *, retry: Optional[RetryPolicy] = None, **kwargs: Any
+) -> httpx.Response:
+    """Send a request through the shared client.
+
+    Waits for rate-limit budget before every attempt and retries transient
+    failures per ``retry`` (default ``DEFAULT_RETRY``). When retries run out
+    the last response is returned, or the last transport error re-raised.
+    Raises ``CircuitOpenError`` without sending while the host's circuit is open.
+    """
+    policy = retry or DEFAULT_RETRY
+    breaker = breaker_for(url)
+    attempt = 0
+    waited = 0.0
+    while True:
+        breaker.allow()
+        limiter.acquire()
+        try:
+            resp = get_client().request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            breaker.record_failure()
+            delay = policy.next_delay(attempt, waited)
+            if delay is None:
+                raise
+            logger.warning("Blizzard %s %s failed (%s); retrying in %.1fs", method, url, e, delay)
+        else:
+            _record(breaker, resp)
+            if resp.status_code not in RETRY_STATUSES:
+                return resp
+            delay = policy.next_delay(attempt, waited, resp)
+            if delay is None:
+                return resp
+            logger.warning(
+                "Blizzard %s %s returned %s; retrying in %.1fs", method, url, resp.status_code, delay
+            )
+        time.sleep(delay)
+        waited += delay
+        attempt += 1
+
+
+def api_get(
+    path: str,
+    namespace: str,
+    locale: Optional[str] = None,
+    params: Optional[dict] = None,
+    access_token: Optional[str] = None,
+    headers: Optional[dict] = None,
+) -> httpx.Response:
+    """GET a Game Data / Profile API path (e.g. ``/data/wow/token/``).
+
+    Authenticates with the client-credentials token unless ``access_token``
+    (a user token) is given.
+    """
+    def send(token: str) -> httpx.Response:
+        return request(
+            "GET",
+            API_BASE + path,
+            params={"namespace": namespace, "locale": locale or LOCALE, **(params or {})},
+            headers={"Authorization": f"Bearer {token}", **(headers or {})},
+        )
+
+    if access_token is not None:
+        return send(access_token)
+
+    from lib.auth import get_access_token, invalidate_access_token
+
+    token = get_access_token()
+    resp = send(token)
+    if resp.status_code == 401:
+        # Our client token was revoked or rotated early: get a new one, retry once
+        invalidate_access_token(token)
+        resp = send(get_access_token())
+    return resp
+
+
+def api_get_json(
+    path: str,
+    namespace: str,
+    locale: Optional[str] = None,
+    params: Optional[dict] = None,
+    access_token: Optional[str] = None,
+    conditional: bool = False,
+) -> dict:
+    """Like ``api_get`` but raises on HTTP errors and returns the decoded body.
+
+    With ``conditional`` the stored copy is revalidated instead of downloaded
+    again; use it for static data that rarely changes. Concurrent identical
+    calls share one request, so treat the returned document as read-only.
+    """
+    return flights.do(
+        _flight_key(path, namespace, locale, params, access_token, conditional),
+        _api_get_json, path, namespace, locale, params, access_token, conditional,
+    )
+
+
+def _api_get_json(
+    path: str,
+    namespace: str,
+    locale: Optional[str],
+    params: Optional[dict],
+    access_token: Optional[str],
+    conditional: bool,
+) -> dict:
+    if not conditional:
+        resp = api_get(path, namespace, locale, params, access_token)
+        resp.raise_for_status()
+        return resp.json()
+
+    key = _store_key(path, namespace, locale, params)
+    stored = _load_response(key)
+    resp = api_get(path, namespace, locale, params, access_token, _validators(stored))
+    if resp.status_code == 304 and stored is None:
+        resp = api_get(path, namespace, locale, params, access_token)
+    return _conditional_result(key, stored, resp)
+
+
+# ---------------------------------------------------------------------------
+# Request coalescing
+# ---------------------------------------------------------------------------
+
+# Shared by the sync and async helpers, so a thread and a coroutine asking for
+# the same document at the same time also share the request.
+flights = SingleFlight()
+
+
+def _flight_key(
+    path: str,
+    namespace: str,
+    locale: Optional[str],
+    params: Optional[dict],
+    access_token: Optional[str],
+    conditional: bool,
+) -> tuple:
+    # A user token is part of the identity: different users see different data
+    return (*_store_key(path, namespace, locale, params), access_token, conditional)
+
+
+# ---------------------------------------------------------------------------
+# Conditional requests (response store)
+# ---------------------------------------------------------------------------
+
+_conditional_counts = {"not_modified": 0, "modified": 0}
+
+
+def _store_key(
+    path: str, namespace: str, locale: Optional[str], params: Optional[dict]
+) -> tuple[str, str, str]:
+    url = API_BASE + path
+    if params:
+        url += "?" + str(httpx.QueryParams(sorted(params.items())))
+    return url, namespace, locale or LOCALE
+
+
+def _load_response(key: tuple[str, str, str]) -> Optional[db.BlizzardResponse]:
+    with Session(db.engine) as session:
+        return session.get(db.BlizzardResponse, key)
+
+
+def _validators(stored: Optional[db.BlizzardResponse]) -> dict:
+    if stored is None:
+        return {}
+    headers = {}
+    if stored.etag:
+        headers["If-None-Match"] = stored.etag
+    if stored.last_modified:
+        headers["If-Modified-Since"] = stored.last_modified
+    return headers
+
+
+def _save_response(key: tuple[str, str, str], resp: httpx.Response) -> None:
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    if not etag and not last_modified:
+        return  # nothing to revalidate with next time
+    url, namespace, locale = key
+    values = {
+        "etag": etag,
+        "last_modified": last_modified,
+        "body": resp.text,
+        "fetched_at": time.time(),
+    }
+    with Session(db.engine) as session:
+        session.execute(
+            db.dialect_insert(db.BlizzardResponse, session)
+            .values(url=url, namespace=namespace, locale=locale, **values)
+            .on_conflict_do_update(index_elements=["url", "namespace", "locale"], set_=values)
+        )
+        session.commit()
+
+
+def _touch_response(key: tuple[str, str, str]) -> None:
+    """Record that the stored copy was just revalidated (304)."""
+    url, namespace, locale = key
+    with Session(db.engine) as session:
+        session.execute(
+            update(db.BlizzardResponse)
+            .where(
+                db.BlizzardResponse.url == url,
+                db.BlizzardResponse.namespace == namespace,
+                db.BlizzardResponse.locale == locale,
+            )
+            .values(fetched_at=time.time())
+        )
+        session.commit()
+
+
+def _conditional_result(
+    key: tuple[str, str, str], stored: Optional[db.BlizzardResponse], resp: httpx.Response
+) -> dict:
+    """Body for a conditional GET: the stored copy on 304, else the (saved) new one."""
+    if resp.status_code == 304 and stored is not None:
+        _conditional_counts["not_modified"] += 1
+        _touch_response(key)
+        return json.loads(stored.body)
+    resp.raise_for_status()
+    _conditional_counts["modified"] += 1
+    _save_response(key, resp)
+    return resp.json()
+
+
+# ---------------------------------------------------------------------------
+# Async client
+# ---------------------------------------------------------------------------
+
+# httpx.AsyncClient connections are bound to the loop that opened them, so keep
+# one client (and one concurrency gate) per running loop.
+_async_clients: dict[asyncio.AbstractEventLoop, tuple[httpx.AsyncClient, asyncio.Semaphore]] = {}
+
+
+def _async_slot() -> tuple[httpx.AsyncClient, asyncio.Semaphore]:
+    loop = asyncio.get_running_loop()
+    slot = _async_clients.get(loop)
+    if slot is None or slot[0].is_closed:
+        slot = (
+            httpx.AsyncClient(
+                timeout=TIMEOUT,
+                limits=LIMITS,
+                http2=_http2_enabled(),
+                headers={"Accept": "application/json"},
+            ),
+            asyncio.Semaphore(ASYNC_CONCURRENCY),
+        )
+        _async_clients[loop] = slot
+    return slot
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the pooled async client for the running event loop."""
+    return _async_slot()[0]
+
+
+async def aclose() -> None:
+    """Close the running loop's async client (called on application shutdown)."""
+    slot = _async_clients.pop(asyncio.get_running_loop(), None)
+    if slot is not None:
+        await slot[0].aclose()
+
+
+def run(coro_fn: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+    """Run an async Blizzard pipeline to completion from sync code.
+
+    Intended for worker threads and scripts that have no event loop of their
+    own; the loop's client is closed before returning.
+    """
+
+    async def _main() -> T:
+        try:
+            return await coro_fn(*args, **kwargs)
+        finally:
+            await aclose()
+
+    return asyncio.run(_main())
+
+
+async def arequest(
+    method: str, url: str, *, retry: Optional[RetryPolicy] = None, **kwargs: Any
+) -> httpx.Response:
+    """Async ``request``, bounded by ASYNC_CONCURRENCY in-flight requests per loop."""
+    client, gate = _async_slot()
+    policy = retry or DEFAULT_RETRY
+    breaker = breaker_for(url)
+    attempt = 0
+    waited = 0.0
+    while True:
+        breaker.allow()
+        await limiter.aacquire()
+        try:
+            async with gate:
+                resp = await client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            breaker.record_failure()
+            delay = policy.next_delay(attempt, waited)
+            if delay is None:
+                raise
+            logger.warning("Blizzard %s %s failed (%s); retrying in %.1fs", method, url, e, delay)
+        else:
+            _record(breaker, resp)
+            if resp.status_code not in RETRY_STATUSES:
+                return resp
+            delay = policy.next_delay(attempt, waited, resp)
+            if delay is None:
+                return resp
+            logger.warning(
+                "Blizzard %s %s returned %s; retrying in %.1fs", method, url, resp.status_code, delay
+            )
+        await asyncio.sleep(delay)
+        waited += delay
+        attempt += 1
+
+
+async def aapi_get(
+    path: str,
+    namespace: str,
+    locale: Optional[str] = None,
+    params: Optional[dict] = None,
+    access_token: Optional[str] = None,
+    headers: Optional[dict] = None,
+) -> httpx.Response:
+    """Async ``api_get``."""
+    async def send(token: str) -> httpx.Response:
+        return await arequest(
+            "GET",
+            API_BASE + path,
+            params={"namespace": namespace, "locale": locale or LOCALE, **(params or {})},
+            headers={"Authorization": f"Bearer {token}", **(headers or {})},
+        )
+
+    if access_token is not None:
+        return await send(access_token)
+
+    from lib.auth import aget_access_token, invalidate_access_token
+
+    token = await aget_access_token()
+    resp = await send(token)
+    if resp.status_code == 401:
+        await asyncio.to_thread(invalidate_access_token, token)
+        resp = await send(await aget_access_token())
+    return resp
+
+
+async def aapi_get_json(
+    path: str,
+    namespace: str,
+    locale: Optional[str] = None,
+    params: Optional[dict] = None,
+    access_token: Optional[str] = None,
+    conditional: bool = False,
+) -> dict:
+    """Async ``api_get_json``."""
+    return await flights.ado(
+        _flight_key(path, namespace, locale, params, access_token, conditional),
+        _aapi_get_json, path, namespace, locale, params, access_token, conditional,
+    )
+
+
+async def _aapi_get_json(
+    path: str,
+    namespace: str,
+    locale: Optional[str],
+    params: Optional[dict],
+    access_token: Optional[str],
+    conditional: bool,
+) -> dict:
+    if not conditional:
+        resp = await aapi_get(path, namespace, locale, params, access_token)
+        resp.raise_for_status()
+        return resp.json()
+
+    key = _store_key(path, namespace, locale, params)
+    stored = await asyncio.to_thread(_load_response, key)
+    resp = await aapi_get(path, namespace, locale, params, access_token, _validators(stored))
+    if resp.status_code == 304 and stored is None:
+        resp = await aapi_get(path, namespace, locale, params, access_token)
+    # Both outcomes write to the response store (save or touch): keep it off the loop
+    return await asyncio.to_thread(_conditional_result, key, stored, resp)
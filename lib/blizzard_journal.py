@@ -1,32 +1,33 @@
 """
 Blizzard Journal API helpers — used by the /admin/instances/seed endpoint.
 
-Uses lib/auth.py (DB-backed token) for authentication.
+Requests go through the shared pooled client in lib/blizzard.py, which
+authenticates with the lib/auth.py token and applies the global rate limit.
 The standalone generate_instances_yaml.py script has its own auth and is kept
 separate for CLI use.
 """
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import json
 import logging
-import os
-import threading
 import time
-from collections import deque
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Callable
 
-import requests
 import yaml
+from sqlmodel import Session, select
 
-from lib.auth import get_access_token
+import lib.blizzard as blizzard
+import lib.db as db
+import lib.instances as instances
 
 logger = logging.getLogger(__name__)
 
-REGION = os.getenv("REGION", "eu")
-GLOBAL_NS = f"static-{REGION}"
-DYNAMIC_NS = f"dynamic-{REGION}"
-GLOBAL_LO = os.getenv("LOCALE", "en_US")
-API_BASE = f"https://{REGION}.api.blizzard.com"
+GLOBAL_NS = blizzard.static_namespace()
+DYNAMIC_NS = blizzard.dynamic_namespace()
+GLOBAL_LO = blizzard.LOCALE
 
 DATA_DIR = Path("data/instances")
 
@@ -41,120 +42,192 @@ CURRENT_SEASON_RAID_IDS: set[int] = {
 }
 
 
-# ——————————————————————————————————————————————
-# RATE LIMITER & HTTP
-# ——————————————————————————————————————————————
-class _RateLimiter:
-    def __init__(self, max_calls: int, period: float):
-        self.max_calls = max_calls
-        self.period = period
-        self.calls: deque = deque()
-        self.lock = threading.Lock()
-
-    def acquire(self):
-        with self.lock:
-            now = time.monotonic()
-            while self.calls and now - self.calls[0] > self.period:
-                self.calls.popleft()
-            if len(self.calls) >= self.max_calls:
-                time.sleep(self.period - (now - self.calls[0]))
-            self.calls.append(time.monotonic())
-
-
-_rate_limiter = _RateLimiter(100, 1.0)
-_session = requests.Session()
 _media_cache: dict = {}
 
 
 # ——————————————————————————————————————————————
 # API HELPERS
 # ——————————————————————————————————————————————
-def _blizz_get(path: str, namespace: str, locale: str, **params) -> dict:
-    token = get_access_token()
-    _rate_limiter.acquire()
-    resp = _session.get(
-        API_BASE + path,
-        params={"namespace": namespace, "locale": locale, **params},
-        headers={"Authorization": f"Bearer {token}"},
-    )
-    if resp.status_code != 200:
-        logger.error("Blizzard API error %s: %s", resp.status_code, resp.url)
-        return {}
-    return resp.json()
+async def _blizz_get(path: str, namespace: str, locale: str, **params) -> dict:
+    """GET a journal path; raises ``httpx.HTTPError`` once retries are exhausted.
+
+    Journal documents rarely change, so they are revalidated against the
+    stored copy and unchanged ones cost a 304 instead of a full download.
+    """
+    return await blizzard.aapi_get_json(path, namespace, locale, params, conditional=True)
 
 
-def _fetch_media(path: str, namespace: str) -> dict:
+async def _fetch_media(path: str, namespace: str) -> dict:
+    # Concurrent misses for the same media are coalesced by blizzard.flights,
+    # so racing encounters share one upstream request
     key = (path, namespace)
     if key not in _media_cache:
-        _media_cache[key] = _blizz_get(path, namespace, GLOBAL_LO)
+        _media_cache[key] = await _blizz_get(path, namespace, GLOBAL_LO)
     return _media_cache[key]
 
 
 # ——————————————————————————————————————————————
 # RAID FETCHING
 # ——————————————————————————————————————————————
-def fetch_raid_instance(inst_id: int) -> dict:
-    """Fetch a raid instance and all its encounters. Encounters are in API order."""
-    inst_detail = _blizz_get(f"/data/wow/journal-instance/{inst_id}", GLOBAL_NS, GLOBAL_LO)
-    media = _fetch_media(f"/data/wow/media/journal-instance/{inst_id}", GLOBAL_NS)
+async def fetch_raid_instance(inst_id: int, inst_detail: dict | None = None) -> dict:
+    """Fetch a raid instance and all its encounters. Encounters are in API order.
+
+    The instance document and its media are fetched together, then every
+    encounter (detail followed by its creature media) concurrently, so a raid
+    costs two round-trips of latency rather than one per boss; the shared
+    client's rate limiter still paces the requests. Pass ``inst_detail`` if
+    the instance document was already fetched.
+    """
+    media_path = f"/data/wow/media/journal-instance/{inst_id}"
+    if inst_detail is None:
+        inst_detail, media = await asyncio.gather(
+            _blizz_get(f"/data/wow/journal-instance/{inst_id}", GLOBAL_NS, GLOBAL_LO),
+            _fetch_media(media_path, GLOBAL_NS),
+        )
+    else:
+        media = await _fetch_media(media_path, GLOBAL_NS)
+    # gather keeps input order, so encounters stay in API order
+    encounters = await asyncio.gather(
+        *(_fetch_encounter(enc_ref) for enc_ref in inst_detail.get("encounters", []))
+    )
 
-    raid_rec: dict = {
+    return {
         "blizzard-id": inst_id,
         "name": inst_detail.get("name"),
         "description": inst_detail.get("description"),
         "img": next(
             (a["value"] for a in media.get("assets", []) if a["key"] == "tile"), None
         ),
-        "encounters": [],
+        "encounters": list(encounters),
     }
 
-    for enc_ref in inst_detail.get("encounters", []):
-        eid = enc_ref["id"]
-        enc_detail = _blizz_get(f"/data/wow/journal-encounter/{eid}", GLOBAL_NS, GLOBAL_LO)
-        creatures = enc_detail.get("creatures", [])
-        disp = creatures[0].get("creature_display", {}).get("id") if creatures else None
-        cimg = None
-        if disp:
-            cm = _fetch_media(f"/data/wow/media/creature-display/{disp}", GLOBAL_NS)
-            cimg = next(
-                (a["value"] for a in cm.get("assets", []) if a["key"] == "zoom"), None
-            )
-        raid_rec["encounters"].append({
-            "blizzard-id": eid,
-            "name": enc_ref["name"],
-            "description": enc_detail.get("description"),
-            "creature_display_id": disp,
-            "img": cimg,
-        })
 
-    return raid_rec
+async def _fetch_encounter(enc_ref: dict) -> dict:
+    eid = enc_ref["id"]
+    enc_detail = await _blizz_get(f"/data/wow/journal-encounter/{eid}", GLOBAL_NS, GLOBAL_LO)
+    creatures = enc_detail.get("creatures", [])
+    disp = creatures[0].get("creature_display", {}).get("id") if creatures else None
+    cimg = None
+    if disp:
+        cm = await _fetch_media(f"/data/wow/media/creature-display/{disp}", GLOBAL_NS)
+        cimg = next(
+            (a["value"] for a in cm.get("assets", []) if a["key"] == "zoom"), None
+        )
+    return {
+        "blizzard-id": eid,
+        "name": enc_ref["name"],
+        "description": enc_detail.get("description"),
+        "creature_display_id": disp,
+        "img": cimg,
+    }
 
 
 # ——————————————————————————————————————————————
 # GENERATION
 # ——————————————————————————————————————————————
-def generate_raids(
+def _fingerprint(doc: dict) -> str:
+    """Hash of a journal document's content.
+
+    Links are left out: every ``href`` embeds the static namespace version,
+    which changes with each game patch even when the content does not.
+    """
+
+    def _strip(value):
+        if isinstance(value, dict):
+            return {k: _strip(v) for k, v in value.items() if k not in ("_links", "key")}
+        if isinstance(value, list):
+            return [_strip(v) for v in value]
+        return value
+
+    return hashlib.sha256(json.dumps(_strip(doc), sort_keys=True).encode()).hexdigest()
+
+
+def _load_previous() -> tuple[dict[str, str], dict[int, tuple[str, dict]]]:
+    """Stored fingerprints and raids from the last seed."""
+    with Session(db.engine) as session:
+        fingerprints = {
+            row.path: row.fingerprint for row in session.exec(select(db.JournalFingerprint))
+        }
+        return fingerprints, instances.stored_raids(session)
+
+
+def save_fingerprints(fingerprints: dict[str, str]) -> None:
+    """Record document fingerprints once their data has been seeded."""
+    if not fingerprints:
+        return
+    now = time.time()
+    with Session(db.engine) as session:
+        stmt = db.dialect_insert(db.JournalFingerprint, session)
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["path"],
+                set_={"fingerprint": stmt.excluded.fingerprint, "updated_at": now},
+            ),
+            [{"path": p, "fingerprint": fp, "updated_at": now} for p, fp in fingerprints.items()],
+        )
+        session.commit()
+
+
+async def generate_raids(
     expansion_id: int | None = None,
     include_current_season: bool = True,
-) -> dict[str, dict[int, dict]]:
+    on_progress: Callable[[int, int], None] | None = None,
+    incremental: bool = False,
+    changes: dict | None = None,
+) -> tuple[dict[str, dict[int, dict]], list[dict]]:
     """
     Fetch raid instances from the Blizzard journal API.
 
+    Instances are fetched concurrently on the event loop; in-flight requests
+    are bounded by the shared async client (BLIZZARD_ASYNC_CONCURRENCY).
+
+    An expansion or instance that still fails after the client's retries is
+    left out of the result and reported instead, so the caller can keep its
+    previous data rather than discard the whole run. Failure of the expansion
+    index itself is raised.
+
+    In incremental mode each expansion and instance document is compared with
+    the fingerprint recorded at the last seed. An unchanged expansion whose
+    raids are all stored is taken from the DB without fetching its instances,
+    and an unchanged instance without fetching its encounters and media, so a
+    routine reseed costs one call per expansion plus whatever actually changed.
+
     Args:
         expansion_id: If given, only fetch this expansion. Otherwise fetch all.
         include_current_season: Whether to build a "Current Season" bucket.
+        on_progress: Called with (instances_done, instances_total) as each
+            instance finishes, for job progress reporting.
+        incremental: Reuse stored raids whose documents have not changed.
+        changes: If given, filled with the blizzard_ids "added", "changed" and
+            "removed" relative to the stored raids, the "unchanged" count, the
+            "expansions" fetched in full (the scope of "removed") and the
+            document "fingerprints" to pass to ``save_fingerprints`` once the
+            result has been seeded.
 
     Returns:
-        Mapping of expansion_name -> {inst_id -> raid_record}
+        (raids, failures): raids maps expansion_name -> {inst_id -> raid_record};
+        failures is a list of {"kind": "expansion"|"instance", "id", "name", "error"}.
     """
     _media_cache.clear()
     result: dict[str, dict[int, dict]] = {}
+    failures: list[dict] = []
+    fingerprints: dict[str, str] = {}
+    reused: dict[int, dict] = {}
+
+    if incremental or changes is not None:
+        stored_fps, stored = await asyncio.to_thread(_load_previous)
+    else:
+        stored_fps, stored = {}, {}
+
+    def _unchanged(path: str, doc: dict) -> bool:
+        fingerprints[path] = fp = _fingerprint(doc)
+        return incremental and stored_fps.get(path) == fp
 
     if include_current_season:
         result["Current Season"] = {}
 
     # Resolve which expansions to process
-    exp_index = _blizz_get("/data/wow/journal-expansion/index", GLOBAL_NS, GLOBAL_LO)
+    exp_index = await _blizz_get("/data/wow/journal-expansion/index", GLOBAL_NS, GLOBAL_LO)
     exp_refs = [
         e for e in exp_index.get("tiers", [])
         if not expansion_id or e["id"] == expansion_id
@@ -162,49 +235,129 @@ def generate_raids(
 
     if expansion_id and not exp_refs:
         logger.error("Expansion ID %s not found in journal index.", expansion_id)
-        return result
+        failures.append({
+            "kind": "expansion",
+            "id": expansion_id,
+            "name": None,
+            "error": "not found in the journal index",
+        })
+        if changes is not None:
+            changes.update(_diff(result, stored, set()), fingerprints={}, expansions=[])
+        return result, failures
 
     # Collect all raid tasks: (exp_name, inst_id)
     raid_tasks: list[tuple[str, int]] = []
-    for exp_ref in exp_refs:
-        exp_detail = _blizz_get(
-            f"/data/wow/journal-expansion/{exp_ref['id']}", GLOBAL_NS, GLOBAL_LO
-        )
+    exp_paths: dict[int, str] = {}  # inst_id -> its expansion's document path
+    # Buckets this run fetched in full; only their stored raids can be "removed"
+    scope: set[str] = {"Current Season"} if include_current_season and not expansion_id else set()
+    exp_details = await asyncio.gather(
+        *(
+            _blizz_get(f"/data/wow/journal-expansion/{exp_ref['id']}", GLOBAL_NS, GLOBAL_LO)
+            for exp_ref in exp_refs
+        ),
+        return_exceptions=True,
+    )
+    for exp_ref, exp_detail in zip(exp_refs, exp_details):
+        if isinstance(exp_detail, Exception):
+            logger.error("Error fetching expansion %s: %s", exp_ref["id"], exp_detail)
+            failures.append({
+                "kind": "expansion",
+                "id": exp_ref["id"],
+                "name": exp_ref.get("name"),
+                "error": str(exp_detail),
+            })
+            continue
         exp_name = exp_detail.get("name")
         if not exp_name or exp_name == "Current Season":
             continue
         result.setdefault(exp_name, {})
-        for raid_ref in exp_detail.get("raids", []):
-            raid_tasks.append((exp_name, raid_ref["id"]))
+        scope.add(exp_name)
+        raid_ids = [raid_ref["id"] for raid_ref in exp_detail.get("raids", [])]
+        path = f"/data/wow/journal-expansion/{exp_ref['id']}"
+        if _unchanged(path, exp_detail) and all(iid in stored for iid in raid_ids):
+            for iid in raid_ids:
+                result[exp_name][iid] = reused[iid] = stored[iid][1]
+            continue
+        raid_tasks.extend((exp_name, iid) for iid in raid_ids)
+        exp_paths.update(dict.fromkeys(raid_ids, path))
 
     # Current-season-only mode: fetch only the configured raid IDs directly
     if include_current_season and not expansion_id:
-        cs_tasks = [(None, iid) for iid in CURRENT_SEASON_RAID_IDS]
+        cs_tasks = [(None, iid) for iid in CURRENT_SEASON_RAID_IDS if iid not in reused]
+        for iid in CURRENT_SEASON_RAID_IDS & reused.keys():
+            result["Current Season"][iid] = reused[iid]
     else:
         cs_tasks = []
 
     all_tasks = raid_tasks + cs_tasks
+    done = 0
 
-    def _fetch(exp_name: str | None, inst_id: int):
+    async def _fetch(exp_name: str | None, inst_id: int):
+        nonlocal done
+        path = f"/data/wow/journal-instance/{inst_id}"
         try:
-            return exp_name, inst_id, fetch_raid_instance(inst_id)
+            inst_detail = await _blizz_get(path, GLOBAL_NS, GLOBAL_LO)
+            if _unchanged(path, inst_detail) and inst_id in stored:
+                reused[inst_id] = stored[inst_id][1]
+                return exp_name, inst_id, reused[inst_id]
+            return exp_name, inst_id, await fetch_raid_instance(inst_id, inst_detail)
         except Exception as e:
             logger.error("Error fetching raid instance %s: %s", inst_id, e)
+            # Not seeded from fresh data, so neither document may count as synced
+            fingerprints.pop(path, None)
+            fingerprints.pop(exp_paths.get(inst_id, ""), None)
+            failures.append({"kind": "instance", "id": inst_id, "name": None, "error": str(e)})
             return None
+        finally:
+            done += 1
+            if on_progress is not None:
+                on_progress(done, len(all_tasks))
 
-    with ThreadPoolExecutor(max_workers=10) as pool:
-        futures = {pool.submit(_fetch, *t): t for t in all_tasks}
-        for fut in as_completed(futures):
-            res = fut.result()
-            if not res:
-                continue
-            exp_name, inst_id, raid_rec = res
-            if exp_name:
-                result[exp_name][inst_id] = raid_rec
-            if include_current_season and inst_id in CURRENT_SEASON_RAID_IDS:
-                result["Current Season"][inst_id] = raid_rec
-
-    return result
+    for res in await asyncio.gather(*(_fetch(*t) for t in all_tasks)):
+        if not res:
+            continue
+        exp_name, inst_id, raid_rec = res
+        if exp_name:
+            result[exp_name][inst_id] = raid_rec
+        if include_current_season and inst_id in CURRENT_SEASON_RAID_IDS:
+            result["Current Season"][inst_id] = raid_rec
+
+    if changes is not None:
+        failed = {f["id"] for f in failures if f["kind"] == "instance"}
+        changes.update(
+            _diff(result, stored, scope, failed),
+            fingerprints=fingerprints,
+            expansions=sorted(scope),
+        )
+    return result, failures
+
+
+def _diff(
+    raids: dict[str, dict[int, dict]],
+    stored: dict[int, tuple[str, dict]],
+    scope: set[str],
+    failed_instances: set[int] = frozenset(),
+) -> dict:
+    """What a seed of ``raids`` changes relative to the stored raids.
+
+    Only stored raids of the expansions in ``scope`` (those fetched in full)
+    can count as removed.
+    """
+    fetched = {iid: rec for bucket in raids.values() for iid, rec in bucket.items()}
+    return {
+        "added": sorted(iid for iid in fetched if iid not in stored),
+        "changed": sorted(
+            iid for iid, rec in fetched.items()
+            if iid in stored and rec != stored[iid][1]
+        ),
+        "removed": sorted(
+            iid for iid, (exp_name, _) in stored.items()
+            if exp_name in scope and iid not in fetched and iid not in failed_instances
+        ),
+        "unchanged": sum(
+            1 for iid, rec in fetched.items() if iid in stored and rec == stored[iid][1]
+        ),
+    }
 
 
 # ——————————————————————————————————————————————
@@ -2,22 +2,25 @@
 
 from __future__ import annotations
 
-import json
+import abc
 import os
 import secrets
+import threading
 import time
-import urllib.error
 import urllib.parse
-import urllib.request
 from typing import Optional
 
-BNET_AUTH_URL = "https://oauth.battle.net/authorize"
-BNET_TOKEN_URL = "https://oauth.battle.net/token"
-BNET_USERINFO_URL = "https://oauth.battle.net/userinfo"
+import httpx
+from sqlalchemy import delete, insert
+from sqlalchemy.engine import Engine
 
-# In-memory CSRF state store: token -> {expiry, next_url}
-_states: dict[str, dict] = {}
-_STATE_TTL = 300  # seconds
+import lib.blizzard as blizzard
+
+BNET_AUTH_URL = f"{blizzard.OAUTH_BASE}/authorize"
+BNET_TOKEN_URL = f"{blizzard.OAUTH_BASE}/token"
+BNET_USERINFO_URL = f"{blizzard.OAUTH_BASE}/userinfo"
+
+_STATE_TTL = int(os.getenv("OAUTH_STATE_TTL", "300"))  # seconds
 
 
 # ---------------------------------------------------------------------------
@@ -56,19 +59,130 @@ def _locale() -> str:
 # State / CSRF
 # ---------------------------------------------------------------------------
 
+class StateStore(abc.ABC):
+    """Where CSRF state tokens wait between /auth/bnet/login and the callback.
+
+    ``pop`` must be atomic: a state is handed out at most once, even when two
+    callbacks race on different workers.
+    """
+
+    name = "base"
+
+    @abc.abstractmethod
+    def put(self, state: str, next_url: Optional[str], ttl: float) -> None:
+        ...
+
+    @abc.abstractmethod
+    def pop(self, state: str) -> Optional[dict]:
+        """Remove ``state``; return ``{"next": ...}`` if it existed and is unexpired."""
+
+
+class MemoryStateStore(StateStore):
+    """Per-process store. Only correct with a single worker."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._states: dict[str, tuple[float, Optional[str]]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, state: str, next_url: Optional[str], ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (expiry, _) in self._states.items() if expiry <= now]:
+                del self._states[key]
+            self._states[state] = (now + ttl, next_url)
+
+    def pop(self, state: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._states.pop(state, None)
+        if entry is None or time.time() > entry[0]:
+            return None
+        return {"next": entry[1]}
+
+
+class DatabaseStateStore(StateStore):
+    """States in the ``oauthstate`` table, visible to every worker.
+
+    Consuming is a single ``DELETE ... RETURNING``, so exactly one caller gets
+    the row. Expired rows are purged whenever a new state is stored.
+    """
+
+    name = "database"
+
+    def __init__(self, engine: Optional[Engine] = None):
+        self._engine = engine
+
+    @property
+    def engine(self) -> Engine:
+        if self._engine is None:
+            import lib.db as db
+
+            self._engine = db.engine
+        return self._engine
+
+    @property
+    def table(self):
+        import lib.db as db
+
+        return db.OAuthState.__table__
+
+    def put(self, state: str, next_url: Optional[str], ttl: float) -> None:
+        t = self.table
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(delete(t).where(t.c.expires_at <= now))
+            conn.execute(insert(t).values(state=state, next_url=next_url, expires_at=now + ttl))
+
+    def pop(self, state: str) -> Optional[dict]:
+        t = self.table
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                delete(t).where(t.c.state == state).returning(t.c.next_url, t.c.expires_at)
+            ).first()
+        if row is None or time.time() > row.expires_at:
+            return None
+        return {"next": row.next_url}
+
+
+_STORES = {store.name: store for store in (MemoryStateStore, DatabaseStateStore)}
+_store: Optional[StateStore] = None
+_store_lock = threading.Lock()
+
+
+def get_state_store() -> StateStore:
+    """Return the process-wide store, created from ``OAUTH_STATE_STORE`` on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                name = os.getenv("OAUTH_STATE_STORE", "database").lower()
+                if name not in _STORES:
+                    raise RuntimeError(
+                        f"Unknown OAUTH_STATE_STORE '{name}' (expected one of: "
+                        f"{', '.join(sorted(_STORES))})"
+                    )
+                _store = _STORES[name]()
+    return _store
+
+
+def set_state_store(store: Optional[StateStore]) -> None:
+    """Swap the store (tests, or a custom shared store); None re-reads the env."""
+    global _store
+    with _store_lock:
+        _store = store
+
+
 def generate_state(next_url: Optional[str] = None) -> str:
     """Generate a CSRF state token and stash the optional redirect destination."""
     state = secrets.token_urlsafe(32)
-    _states[state] = {"expiry": time.time() + _STATE_TTL, "next": next_url}
+    get_state_store().put(state, next_url, _STATE_TTL)
     return state
 
 
 def consume_state(state: str) -> Optional[dict]:
     """Validate and remove a state token. Returns payload or None if invalid/expired."""
-    data = _states.pop(state, None)
-    if data is None or time.time() > data["expiry"]:
-        return None
-    return data
+    return get_state_store().pop(state)
 
 
 # ---------------------------------------------------------------------------
@@ -88,32 +202,20 @@ def get_authorization_url(state: str) -> str:
 
 def exchange_code(code: str) -> dict:
     """Exchange authorization code for a user access token."""
-    import base64
-
-    credentials = base64.b64encode(
-        f"{_client_id()}:{_client_secret()}".encode()
-    ).decode()
-    data = urllib.parse.urlencode(
-        {
+    resp = blizzard.request(
+        "POST",
+        BNET_TOKEN_URL,
+        data={
             "grant_type": "authorization_code",
             "code": code,
             "redirect_uri": _redirect_uri(),
-        }
-    ).encode()
-    req = urllib.request.Request(
-        BNET_TOKEN_URL,
-        data=data,
-        headers={
-            "Authorization": f"Basic {credentials}",
-            "Content-Type": "application/x-www-form-urlencoded",
         },
-        method="POST",
+        auth=(_client_id(), _client_secret()),
+        retry=blizzard.NO_RETRY,  # authorization codes are single-use
     )
-    try:
-        with urllib.request.urlopen(req) as resp:
-            return json.loads(resp.read())
-    except urllib.error.HTTPError as e:
-        raise RuntimeError(f"BNet token exchange failed ({e.code}): {e.read().decode()}")
+    if resp.is_error:
+        raise RuntimeError(f"BNet token exchange failed ({resp.status_code}): {resp.text}")
+    return resp.json()
 
 
 # ---------------------------------------------------------------------------
@@ -122,30 +224,29 @@ def exchange_code(code: str) -> dict:
 
 def get_user_info(access_token: str) -> dict:
     """GET /userinfo — returns sub (BNet account ID) and battletag."""
-    req = urllib.request.Request(
+    resp = blizzard.request(
+        "GET",
         BNET_USERINFO_URL,
         headers={"Authorization": f"Bearer {access_token}"},
     )
-    with urllib.request.urlopen(req) as resp:
-        return json.loads(resp.read())
+    resp.raise_for_status()
+    return resp.json()
 
 
 def get_wow_profile(access_token: str) -> list[dict]:
     """Return all WoW characters on this BNet account (all sub-accounts flattened)."""
     region = _region()
-    locale = _locale()
-    url = (
-        f"https://{region}.api.blizzard.com/profile/user/wow?"
-        + urllib.parse.urlencode({"namespace": f"profile-{region}", "locale": locale})
-    )
-    req = urllib.request.Request(
-        url, headers={"Authorization": f"Bearer {access_token}"}
-    )
     try:
-        with urllib.request.urlopen(req) as resp:
-            data = json.loads(resp.read())
-    except urllib.error.HTTPError:
+        resp = blizzard.request(
+            "GET",
+            f"https://{region}.api.blizzard.com/profile/user/wow",
+            params={"namespace": f"profile-{region}", "locale": _locale()},
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+        resp.raise_for_status()
+    except httpx.HTTPStatusError:
         return []
+    data = resp.json()
 
     characters: list[dict] = []
     for account in data.get("wow_accounts", []):
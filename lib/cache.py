@@ -1,49 +1,766 @@
-"""Simple in-memory TTL cache for expensive external API calls."""
+"""TTL cache for expensive external API calls.
 
+Entries are keyed on a namespace plus the decorated function's arguments.
+Storage is pluggable:
+
+* ``memory`` (default) — an in-process LRU bounded by an entry count and an
+  optional byte budget. Fastest, but every worker keeps its own copy.
+* ``database`` — a shared ``cacheentry`` table, so all uvicorn workers see the
+  same values and ``invalidate()`` is global. Values must be JSON-serialisable.
+
+Both backends offer atomic get-or-compute: only one caller (one thread, or one
+worker for the shared backend) runs the upstream call for a cold key while the
+others wait for its result. Expired entries are swept by a background daemon
+thread so a long-running worker does not accumulate dead keys.
+
+Entries may also carry a stale window: once the soft TTL passes the old value
+is still served while a background worker refreshes it, and callers only block
+on the upstream call after the hard TTL.
+
+With ``fallback_ttl`` the decorator also keeps a long-lived last-good copy of
+every value. If the upstream call fails (e.g. Blizzard's circuit is open) that
+copy is served instead of the error, marked stale so callers can say so.
+"""
+
+from __future__ import annotations
+
+import abc
+import functools
+import json
+import logging
+import os
+import sys
 import threading
 import time
-from typing import Any, Callable
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Hashable, Optional
+
+from sqlalchemy import Engine, and_, delete, func, select, update
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+DEFAULT_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", "0"))  # 0 = no byte budget
+PURGE_INTERVAL_SECONDS = float(os.getenv("CACHE_PURGE_INTERVAL", "60"))
+REFRESH_WORKERS = int(os.getenv("CACHE_REFRESH_WORKERS", "4"))
+LEASE_SECONDS = float(os.getenv("CACHE_LEASE_SECONDS", "30"))
+# After a failed background refresh, stale hits wait this long before retrying
+REFRESH_BACKOFF_SECONDS = float(os.getenv("CACHE_REFRESH_BACKOFF", "30"))
+# A None result (nothing found upstream) is kept at most this long, never stale
+NEGATIVE_TTL_SECONDS = float(os.getenv("CACHE_NEGATIVE_TTL", "60"))
+
+# A plain string keeps keys identical across processes (needed by the shared backend)
+_KWARGS_MARK = "__kwargs__"
+_ALL = object()
+
+
+def make_key(args: tuple, kwargs: dict) -> Hashable:
+    """Build a hashable cache key from call arguments (same idea as functools)."""
+    if not kwargs:
+        return args
+    return args + (_KWARGS_MARK,) + tuple(sorted(kwargs.items()))
+
+
+def _approx_size(value: Any, _seen: Optional[set] = None) -> int:
+    """Rough deep size of a JSON-like value, used for the byte budget."""
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_approx_size(k, _seen) + _approx_size(v, _seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_approx_size(v, _seen) for v in value)
+    return size
 
-_store: dict[str, tuple[Any, float]] = {}
-_locks: dict[str, threading.Lock] = {}
-_meta_lock = threading.Lock()
 
+@dataclass
+class _Entry:
+    value: Any
+    fresh_until: float  # soft TTL: after this the value is stale
+    expires_at: float   # hard TTL: after this the value is gone
+    size: int = 0
 
-def _get_lock(key: str) -> threading.Lock:
-    with _meta_lock:
-        if key not in _locks:
-            _locks[key] = threading.Lock()
-        return _locks[key]
 
+@dataclass
+class NamespaceStats:
+    hits: int = 0
+    misses: int = 0
+    stale_hits: int = 0
+    refreshes: int = 0
+    refresh_errors: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    fallbacks: int = 0
+    entries: int = 0
+    bytes: int = 0
 
-def ttl_cache(ttl_seconds: int, key: str):
-    """Decorator: cache the result in memory for ttl_seconds.
 
-    Uses a per-key lock to prevent cache stampedes — only one thread
-    will call the underlying function on a cold cache; others wait for it.
+class CacheBackend(abc.ABC):
+    """Storage behind ``ttl_cache``.
+
+    Subclasses implement ``_lookup`` (read a live entry), ``_compute``
+    (single-flight compute-and-store for one key), ``set``, ``invalidate``,
+    ``purge_expired`` and ``clear``. Hit/miss accounting,
+    stale-while-revalidate and the background sweeper are shared here.
     """
 
-    def decorator(func: Callable) -> Callable:
-        def wrapper(*args, **kwargs):
-            now = time.time()
-            cached = _store.get(key)
-            if cached and now < cached[1]:
-                return cached[0]
+    name = "base"
+
+    def __init__(self, purge_interval: float = PURGE_INTERVAL_SECONDS):
+        self.purge_interval = purge_interval
+        self._lock = threading.Lock()
+        self._stats: dict[str, NamespaceStats] = {}
+        self._purger: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._refresher: Optional[ThreadPoolExecutor] = None
+        self._refreshing: set[tuple[str, Hashable]] = set()
+        self._retry_after: dict[tuple[str, Hashable], float] = {}  # failed refreshes
+
+    # -- backend-specific --------------------------------------------------------
+
+    @abc.abstractmethod
+    def _lookup(self, namespace: str, key: Hashable) -> Optional[_Entry]:
+        ...
+
+    @abc.abstractmethod
+    def _compute(
+        self,
+        namespace: str,
+        key: Hashable,
+        compute: Callable[[], Any],
+        ttl_seconds: float,
+        stale_ttl: float,
+    ) -> Any:
+        ...
+
+    @abc.abstractmethod
+    def set(
+        self,
+        namespace: str,
+        key: Hashable,
+        value: Any,
+        ttl_seconds: float,
+        stale_ttl: float = 0,
+    ) -> None:
+        ...
+
+    @abc.abstractmethod
+    def invalidate(self, namespace: str, key: Any = _ALL) -> int:
+        """Drop one key, or every key in ``namespace`` when no key is given."""
+
+    @abc.abstractmethod
+    def purge_expired(self) -> int:
+        """Remove every expired entry. Returns how many were dropped."""
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        ...
+
+    # -- shared ------------------------------------------------------------------
+
+    def _ns(self, namespace: str) -> NamespaceStats:
+        """Counters for ``namespace``. Call with ``self._lock`` held."""
+        stats = self._stats.get(namespace)
+        if stats is None:
+            stats = self._stats[namespace] = NamespaceStats()
+        return stats
+
+    @staticmethod
+    def _ttls(value: Any, ttl_seconds: float, stale_ttl: float) -> tuple[float, float]:
+        """TTLs to store ``value`` with: a None result is short-lived and never stale."""
+        if value is None:
+            return min(ttl_seconds, NEGATIVE_TTL_SECONDS), 0
+        return ttl_seconds, stale_ttl
 
-            with _get_lock(key):
+    def _count(self, namespace: str, field: str) -> None:
+        with self._lock:
+            stats = self._ns(namespace)
+            setattr(stats, field, getattr(stats, field) + 1)
+
+    def get(self, namespace: str, key: Hashable = ()) -> tuple[bool, Any]:
+        """Return ``(hit, value)`` for a fresh entry. Stale or expired entries are a miss."""
+        entry = self._lookup(namespace, key)
+        if entry is None or time.time() >= entry.fresh_until:
+            self._count(namespace, "misses")
+            return False, None
+        self._count(namespace, "hits")
+        return True, entry.value
+
+    def get_or_compute(
+        self,
+        namespace: str,
+        key: Hashable,
+        compute: Callable[[], Any],
+        ttl_seconds: float,
+        stale_ttl: float = 0,
+    ) -> Any:
+        """Return the cached value, computing it at most once per key concurrently.
+
+        Only one caller runs ``compute`` on a cold key; others wait for it and
+        reuse its result. With ``stale_ttl`` a value past its soft TTL is
+        returned immediately and refreshed in the background until the hard
+        TTL runs out.
+        """
+        entry = self._lookup(namespace, key)
+        if entry is not None:
+            if time.time() < entry.fresh_until:
+                self._count(namespace, "hits")
+                return entry.value
+            self._count(namespace, "stale_hits")
+            self._schedule_refresh(namespace, key, compute, ttl_seconds, stale_ttl)
+            return entry.value
+
+        self._count(namespace, "misses")
+        return self._compute(namespace, key, compute, ttl_seconds, stale_ttl)
+
+    def _schedule_refresh(
+        self,
+        namespace: str,
+        key: Hashable,
+        compute: Callable[[], Any],
+        ttl_seconds: float,
+        stale_ttl: float,
+    ) -> None:
+        full_key = (namespace, key)
+        with self._lock:
+            if full_key in self._refreshing or time.time() < self._retry_after.get(full_key, 0):
+                return
+            self._retry_after.pop(full_key, None)
+            self._refreshing.add(full_key)
+            if self._refresher is None:
+                self._refresher = ThreadPoolExecutor(
+                    max_workers=REFRESH_WORKERS, thread_name_prefix="cache-refresh"
+                )
+            refresher = self._refresher
+
+        def _run() -> None:
+            try:
+                self._compute(namespace, key, compute, ttl_seconds, stale_ttl)
+                self._count(namespace, "refreshes")
+            except Exception as e:
+                # Keep serving the stale value until its hard TTL runs out,
+                # without retrying on every hit in the meantime
+                logger.warning("Background refresh of %s failed: %s", namespace, e)
+                self._count(namespace, "refresh_errors")
+                with self._lock:
+                    self._retry_after[full_key] = time.time() + REFRESH_BACKOFF_SECONDS
+            finally:
+                with self._lock:
+                    self._refreshing.discard(full_key)
+
+        refresher.submit(_run)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "namespaces": {ns: asdict(s) for ns, s in sorted(self._stats.items())},
+            }
+
+    def _ensure_purger(self) -> None:
+        if self._purger is not None or self.purge_interval <= 0:
+            return
+        with self._lock:
+            if self._purger is not None:
+                return
+            self._purger = threading.Thread(
+                target=self._purge_loop, name="cache-purger", daemon=True
+            )
+            self._purger.start()
+
+    def _purge_loop(self) -> None:
+        while not self._stop.wait(self.purge_interval):
+            try:
+                dropped = self.purge_expired()
+                if dropped:
+                    logger.debug("Cache purge dropped %d expired entries.", dropped)
+            except Exception:  # pragma: no cover - never let the sweeper die
+                logger.exception("Cache purge failed")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._refresher is not None:
+            self._refresher.shutdown(wait=False)
+
+
+# ---------------------------------------------------------------------------
+# In-process backend
+# ---------------------------------------------------------------------------
+
+class TTLCache(CacheBackend):
+    """Thread-safe in-process LRU cache with per-entry expiry.
+
+    Keys are ``(namespace, key)`` pairs. When either ``max_entries`` or
+    ``max_bytes`` (if non-zero) is exceeded the least recently used entries are
+    evicted, regardless of namespace.
+    """
+
+    name = "memory"
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        purge_interval: float = PURGE_INTERVAL_SECONDS,
+    ):
+        super().__init__(purge_interval)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: OrderedDict[tuple[str, Hashable], _Entry] = OrderedDict()
+        self._bytes = 0
+        # Per-key locks only live while a computation is in flight: [lock, waiters]
+        self._key_locks: dict[tuple[str, Hashable], list] = {}
+
+    # -- internal helpers (call with self._lock held) -------------------------
+
+    def _remove(self, full_key: tuple[str, Hashable]) -> _Entry:
+        entry = self._data.pop(full_key)
+        self._bytes -= entry.size
+        stats = self._ns(full_key[0])
+        stats.entries -= 1
+        stats.bytes -= entry.size
+        return entry
+
+    def _evict_overflow(self) -> None:
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            full_key = next(iter(self._data))
+            self._remove(full_key)
+            self._ns(full_key[0]).evictions += 1
+
+    # -- CacheBackend ------------------------------------------------------------
+
+    def _lookup(self, namespace: str, key: Hashable) -> Optional[_Entry]:
+        """Return the live (possibly stale) entry, dropping it if hard-expired."""
+        full_key = (namespace, key)
+        with self._lock:
+            entry = self._data.get(full_key)
+            if entry is None:
+                return None
+            if time.time() >= entry.expires_at:
+                self._remove(full_key)
+                self._ns(namespace).expirations += 1
+                return None
+            self._data.move_to_end(full_key)
+            return entry
+
+    def set(
+        self,
+        namespace: str,
+        key: Hashable,
+        value: Any,
+        ttl_seconds: float,
+        stale_ttl: float = 0,
+    ) -> None:
+        full_key = (namespace, key)
+        size = _approx_size(value)
+        fresh_until = time.time() + ttl_seconds
+        with self._lock:
+            if full_key in self._data:
+                self._remove(full_key)
+            self._data[full_key] = _Entry(value, fresh_until, fresh_until + stale_ttl, size)
+            self._bytes += size
+            stats = self._ns(namespace)
+            stats.entries += 1
+            stats.bytes += size
+            self._evict_overflow()
+        self._ensure_purger()
+
+    def _compute(
+        self,
+        namespace: str,
+        key: Hashable,
+        compute: Callable[[], Any],
+        ttl_seconds: float,
+        stale_ttl: float,
+    ) -> Any:
+        full_key = (namespace, key)
+        with self._lock:
+            slot = self._key_locks.setdefault(full_key, [threading.Lock(), 0])
+            slot[1] += 1
+        try:
+            with slot[0]:
                 # Re-check inside the lock — another thread may have just populated it
-                cached = _store.get(key)
-                if cached and now < cached[1]:
-                    return cached[0]
-                result = func(*args, **kwargs)
-                _store[key] = (result, time.time() + ttl_seconds)
-                return result
+                with self._lock:
+                    entry = self._data.get(full_key)
+                    if entry is not None and time.time() < entry.fresh_until:
+                        self._data.move_to_end(full_key)
+                        return entry.value
+                value = compute()
+                self.set(namespace, key, value, *self._ttls(value, ttl_seconds, stale_ttl))
+                return value
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                if slot[1] == 0:
+                    self._key_locks.pop(full_key, None)
+
+    def invalidate(self, namespace: str, key: Any = _ALL) -> int:
+        with self._lock:
+            if key is not _ALL:
+                targets = [(namespace, key)] if (namespace, key) in self._data else []
+            else:
+                targets = [k for k in self._data if k[0] == namespace]
+            for full_key in targets:
+                self._remove(full_key)
+            return len(targets)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self._stats.clear()
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [k for k, e in self._data.items() if now >= e.expires_at]
+            for full_key in expired:
+                self._remove(full_key)
+                self._ns(full_key[0]).expirations += 1
+        return len(expired)
 
+    def stats(self) -> dict:
+        result = super().stats()
+        with self._lock:
+            result.update(
+                entries=len(self._data),
+                bytes=self._bytes,
+                max_entries=self.max_entries,
+                max_bytes=self.max_bytes,
+            )
+        return result
+
+
+# ---------------------------------------------------------------------------
+# Shared (database) backend
+# ---------------------------------------------------------------------------
+
+class DatabaseCache(CacheBackend):
+    """Cache stored in the ``cacheentry`` table, shared by every worker.
+
+    Get-or-compute is made atomic across processes with a lease column: the
+    caller that claims the lease (by inserting the row or by bumping an expired
+    lease with a conditional UPDATE) runs ``compute``; everyone else polls the
+    row until the value lands or the lease lapses.
+    """
+
+    name = "database"
+
+    def __init__(
+        self,
+        engine: Optional[Engine] = None,
+        purge_interval: float = PURGE_INTERVAL_SECONDS,
+        lease_seconds: float = LEASE_SECONDS,
+        poll_interval: float = 0.05,
+    ):
+        super().__init__(purge_interval)
+        self._engine = engine
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+
+    @property
+    def engine(self) -> Engine:
+        if self._engine is None:
+            import lib.db as db
+
+            self._engine = db.engine
+        return self._engine
+
+    @property
+    def table(self):
+        import lib.db as db
+
+        return db.CacheEntry.__table__
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return repr(key)
+
+    def _where(self, namespace: str, key: Hashable):
+        t = self.table
+        return and_(t.c.namespace == namespace, t.c.key == self._key(key))
+
+    def _lookup(self, namespace: str, key: Hashable) -> Optional[_Entry]:
+        t = self.table
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(t.c.value, t.c.fresh_until, t.c.expires_at).where(
+                    self._where(namespace, key)
+                )
+            ).first()
+        if row is None or row.value is None or time.time() >= row.expires_at:
+            return None
+        return _Entry(json.loads(row.value), row.fresh_until, row.expires_at)
+
+    def _try_lease(self, namespace: str, key: Hashable) -> bool:
+        import lib.db as db
+
+        t = self.table
+        now = time.time()
+        lease_until = now + self.lease_seconds
+        with self.engine.begin() as conn:
+            inserted = conn.execute(
+                db.dialect_insert(t, conn)
+                .values(
+                    namespace=namespace,
+                    key=self._key(key),
+                    value=None,
+                    fresh_until=0,
+                    expires_at=0,
+                    lease_until=lease_until,
+                )
+                .on_conflict_do_nothing(index_elements=["namespace", "key"])
+            )
+            if inserted.rowcount == 1:
+                return True
+            claimed = conn.execute(
+                update(t)
+                .where(self._where(namespace, key))
+                .where(t.c.lease_until < now)
+                .where(t.c.fresh_until <= now)
+                .values(lease_until=lease_until)
+            )
+            return claimed.rowcount == 1
+
+    def _release_lease(self, namespace: str, key: Hashable) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(
+                update(self.table).where(self._where(namespace, key)).values(lease_until=0)
+            )
+
+    def _renew_lease(self, namespace: str, key: Hashable, stop: threading.Event) -> None:
+        """Keep extending a held lease until ``stop`` is set, so a compute
+        slower than ``lease_seconds`` is not joined by a second worker."""
+        while not stop.wait(self.lease_seconds / 3):
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(
+                        update(self.table)
+                        .where(self._where(namespace, key))
+                        .values(lease_until=time.time() + self.lease_seconds)
+                    )
+            except Exception:
+                logger.exception("Could not renew cache lease for %s %r", namespace, key)
+
+    def _compute(
+        self,
+        namespace: str,
+        key: Hashable,
+        compute: Callable[[], Any],
+        ttl_seconds: float,
+        stale_ttl: float,
+    ) -> Any:
+        while True:
+            entry = self._lookup(namespace, key)
+            if entry is not None and time.time() < entry.fresh_until:
+                return entry.value
+            if self._try_lease(namespace, key):
+                stop = threading.Event()
+                renewer = threading.Thread(
+                    target=self._renew_lease, args=(namespace, key, stop),
+                    name="cache-lease", daemon=True,
+                )
+                renewer.start()
+                try:
+                    value = compute()
+                except BaseException:
+                    self._release_lease(namespace, key)
+                    raise
+                finally:
+                    stop.set()
+                    renewer.join()
+                self.set(namespace, key, value, *self._ttls(value, ttl_seconds, stale_ttl))
+                return value
+            # Another worker holds the lease: wait for its value to land
+            time.sleep(self.poll_interval)
+
+    def set(
+        self,
+        namespace: str,
+        key: Hashable,
+        value: Any,
+        ttl_seconds: float,
+        stale_ttl: float = 0,
+    ) -> None:
+        import lib.db as db
+
+        fresh_until = time.time() + ttl_seconds
+        values = {
+            "value": json.dumps(value),
+            "fresh_until": fresh_until,
+            "expires_at": fresh_until + stale_ttl,
+            "lease_until": 0,
+        }
+        with self.engine.begin() as conn:
+            conn.execute(
+                db.dialect_insert(self.table, conn)
+                .values(namespace=namespace, key=self._key(key), **values)
+                .on_conflict_do_update(index_elements=["namespace", "key"], set_=values)
+            )
+        self._ensure_purger()
+
+    def invalidate(self, namespace: str, key: Any = _ALL) -> int:
+        t = self.table
+        stmt = delete(t).where(t.c.namespace == namespace)
+        if key is not _ALL:
+            stmt = stmt.where(t.c.key == self._key(key))
+        with self.engine.begin() as conn:
+            return conn.execute(stmt).rowcount
+
+    def clear(self) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table))
+        with self._lock:
+            self._stats.clear()
+
+    def purge_expired(self) -> int:
+        t = self.table
+        now = time.time()
+        with self.engine.begin() as conn:
+            return conn.execute(
+                delete(t).where(t.c.expires_at <= now).where(t.c.lease_until < now)
+            ).rowcount
+
+    def stats(self) -> dict:
+        result = super().stats()
+        t = self.table
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(t.c.namespace, func.count()).group_by(t.c.namespace)
+            ).all()
+        result["entries"] = sum(n for _, n in rows)
+        for ns, n in rows:
+            result["namespaces"].setdefault(ns, asdict(NamespaceStats()))["entries"] = n
+        return result
+
+
+@dataclass
+class CachedValue:
+    """A decorated function's result plus whether it is a last-good fallback."""
+
+    value: Any
+    stale: bool = False
+    stored_at: Optional[float] = None  # when the fallback value was fetched
+
+
+# ---------------------------------------------------------------------------
+# Backend selection & decorator
+# ---------------------------------------------------------------------------
+
+_BACKENDS: dict[str, Callable[[], CacheBackend]] = {
+    "memory": TTLCache,
+    "database": DatabaseCache,
+}
+
+_backend: Optional[CacheBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> CacheBackend:
+    """Return the process-wide backend, creating it from ``CACHE_BACKEND`` on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = os.getenv("CACHE_BACKEND", "memory").lower()
+                if name not in _BACKENDS:
+                    raise RuntimeError(
+                        f"Unknown CACHE_BACKEND '{name}' (expected one of: "
+                        f"{', '.join(sorted(_BACKENDS))})"
+                    )
+                _backend = _BACKENDS[name]()
+    return _backend
+
+
+def set_backend(backend: CacheBackend) -> None:
+    """Swap the backend (tests, or wiring a custom shared store)."""
+    global _backend
+    with _backend_lock:
+        if _backend is not None:
+            _backend.stop()
+        _backend = backend
+
+
+def _fallback_namespace(key: str) -> str:
+    return f"{key}:last_good"
+
+
+def ttl_cache(ttl_seconds: int, key: str, stale_ttl: int = 0, fallback_ttl: int = 0):
+    """Decorator: cache results for ttl_seconds in the configured backend.
+
+    ``key`` is the namespace; each distinct set of call arguments gets its own
+    entry within it, so parameterised lookups can be cached safely.
+
+    ``stale_ttl`` enables stale-while-revalidate: for that many seconds past
+    ``ttl_seconds`` callers get the previous value at once while a background
+    worker fetches a new one.
+
+    ``fallback_ttl`` keeps the last good value that long; when computing fails
+    it is returned instead of raising. ``wrapper.lookup(...)`` returns a
+    ``CachedValue`` telling whether that happened.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        def lookup(*args, **kwargs) -> CachedValue:
+            backend = get_backend()
+            cache_key = make_key(args, kwargs)
+
+            def compute() -> Any:
+                value = func(*args, **kwargs)
+                if fallback_ttl and value is not None:
+                    backend.set(
+                        _fallback_namespace(key),
+                        cache_key,
+                        {"value": value, "stored_at": time.time()},
+                        fallback_ttl,
+                    )
+                return value
+
+            try:
+                return CachedValue(
+                    backend.get_or_compute(key, cache_key, compute, ttl_seconds, stale_ttl)
+                )
+            except Exception as e:
+                if not fallback_ttl:
+                    raise
+                hit, saved = backend.get(_fallback_namespace(key), cache_key)
+                if not hit:
+                    raise
+                logger.warning("Serving last good %s value: %s", key, e)
+                backend._count(key, "fallbacks")
+                return CachedValue(saved["value"], stale=True, stored_at=saved["stored_at"])
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return lookup(*args, **kwargs).value
+
+        wrapper.lookup = lookup
         return wrapper
 
     return decorator
 
 
-def invalidate(key: str) -> None:
-    """Remove a cached entry (e.g. after a roster update)."""
-    _store.pop(key, None)
+def invalidate(key: str, *args, **kwargs) -> None:
+    """Remove cached entries (e.g. after a roster update).
+
+    With only a namespace, every entry in it is dropped; with call arguments,
+    just the matching entry is. With the database backend this applies to
+    every worker.
+    """
+    if args or kwargs:
+        get_backend().invalidate(key, make_key(args, kwargs))
+    else:
+        get_backend().invalidate(key)
+
+
+def stats() -> dict:
+    """Size and hit/miss counters for every cache namespace."""
+    return get_backend().stats()
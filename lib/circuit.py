@@ -0,0 +1,82 @@
+"""Circuit breaker for an upstream dependency.
+
+After ``failure_threshold`` consecutive failures the circuit *opens* and calls
+fail immediately with ``CircuitOpenError`` instead of tying up a worker on a
+degraded upstream. Once ``recovery_timeout`` seconds have passed a single probe
+is let through (*half-open*): success closes the circuit, failure re-opens it.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_in:.0f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started: Optional[float] = None
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> None:
+        """Raise ``CircuitOpenError`` unless a call may go through now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN:
+                retry_in = self.opened_at + self.recovery_timeout - now
+                if retry_in > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, retry_in)
+                self.state = HALF_OPEN
+                self.probe_started = now
+                return
+            # Half-open: one probe at a time; a probe that never reported back
+            # (e.g. cancelled) is replaced after another recovery_timeout
+            if self.probe_started is not None and now - self.probe_started < self.recovery_timeout:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, self.recovery_timeout)
+            self.probe_started = now
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.probe_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "rejected": self.rejected,
+            }
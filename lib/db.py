@@ -1,15 +1,20 @@
 from __future__ import annotations
+import logging
 import os
 from datetime import datetime
 from enum import Enum
 from typing import Generator, Optional
 
 import dotenv
-from sqlalchemy import Column, ForeignKey, Integer, String, inspect
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String, inspect, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlmodel import Field, Session, SQLModel, create_engine
 
 dotenv.load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 def _build_database_url() -> str:
     """Return the database URL from the environment.
@@ -48,6 +53,21 @@ def _engine_kwargs() -> dict:
 engine = create_engine(DATABASE_URL, echo=False, **_engine_kwargs())
 
 
+def dialect_insert(table, bind=None):
+    """Return an INSERT for ``table`` that supports ``on_conflict_do_*``.
+
+    Postgres and SQLite both implement ON CONFLICT but SQLAlchemy exposes it
+    through dialect-specific constructs, so pick the one matching ``bind``
+    (an engine, connection or session; defaults to the module engine).
+    """
+    bind = bind if bind is not None else engine
+    if hasattr(bind, "get_bind"):
+        bind = bind.get_bind()
+    if bind.dialect.name == "postgresql":
+        return postgresql_insert(table)
+    return sqlite_insert(table)
+
+
 class GuildMember(SQLModel, table=True):
     character_id: int = Field(primary_key=True)
     name: str
@@ -76,6 +96,7 @@ class User(SQLModel, table=True):
         ),
     )
     role: str
+    token_version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})  # bumped to revoke tokens
     created_at: datetime = Field(default_factory=lambda: datetime.now().astimezone())
 
 
@@ -85,6 +106,85 @@ class OAuthToken(SQLModel, table=True):
     expires_at: float
 
 
+class OAuthState(SQLModel, table=True):
+    """Pending BNet login CSRF state (lib/bnet_oauth.DatabaseStateStore)."""
+    state: str = Field(primary_key=True)
+    next_url: Optional[str] = None
+    expires_at: float = Field(index=True)  # epoch seconds
+
+
+class CacheEntry(SQLModel, table=True):
+    """Shared cache row used by lib/cache.DatabaseCache."""
+    namespace: str = Field(primary_key=True)
+    key: str = Field(primary_key=True)
+    value: Optional[str] = None       # JSON-encoded; NULL while the first compute is in flight
+    fresh_until: float = 0            # soft TTL (epoch seconds)
+    expires_at: float = Field(default=0, index=True)  # hard TTL (epoch seconds)
+    lease_until: float = 0            # a worker is computing this key until then
+
+
+class BlizzardResponse(SQLModel, table=True):
+    """Last Blizzard response per resource, for conditional (304) requests."""
+    url: str = Field(primary_key=True)        # full URL including extra query params
+    namespace: str = Field(primary_key=True)
+    locale: str = Field(primary_key=True)
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    body: str                                 # JSON document as received
+    fetched_at: float = 0                     # last 200 or 304 (epoch seconds)
+
+
+class JournalFingerprint(SQLModel, table=True):
+    """Content hash of a journal document as of the last seed (lib/blizzard_journal.py)."""
+    path: str = Field(primary_key=True)       # e.g. /data/wow/journal-instance/1273
+    fingerprint: str                          # sha256 of the document minus its links
+    updated_at: float = 0                     # epoch seconds
+
+
+class PlayableClass(SQLModel, table=True):
+    """Static reference data mirrored from the Game Data API (see lib/static_data.py)."""
+    id: int = Field(primary_key=True)   # Blizzard playable-class id
+    name: str
+    icon: Optional[str] = None
+    fetched_at: float = 0               # epoch seconds
+
+
+class PlayableRace(SQLModel, table=True):
+    id: int = Field(primary_key=True)   # Blizzard playable-race id
+    name: str
+    fetched_at: float = 0
+
+
+class Job(SQLModel, table=True):
+    """A long-running admin operation run by lib/jobs.py's worker pool."""
+    # At most one queued/running job per kind; lib/jobs.enqueue relies on it
+    __table_args__ = (
+        Index(
+            "ux_job_active_kind", "kind", unique=True,
+            sqlite_where=text("status IN ('queued', 'running')"),
+            postgresql_where=text("status IN ('queued', 'running')"),
+        ),
+    )
+
+    id: str = Field(primary_key=True)               # uuid4 hex
+    kind: str = Field(index=True)                   # e.g. "instances.seed"
+    status: str = Field(default="queued", index=True)  # queued | running | succeeded | failed
+    params: Optional[str] = None                    # JSON
+    result: Optional[str] = None                    # JSON
+    error: Optional[str] = None
+    progress_done: int = 0
+    progress_total: Optional[int] = None
+    message: Optional[str] = None
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now().astimezone(), sa_type=DateTime(timezone=True)
+    )
+    started_at: Optional[datetime] = Field(default=None, sa_type=DateTime(timezone=True))
+    finished_at: Optional[datetime] = Field(default=None, sa_type=DateTime(timezone=True))
+    updated_at: datetime = Field(
+        default_factory=lambda: datetime.now().astimezone(), sa_type=DateTime(timezone=True)
+    )
+
+
 class GuildSettings(SQLModel, table=True):
     id: int = Field(default=1, primary_key=True)
     raid_start: str = Field(default="20:00")  # HH:MM
@@ -152,6 +252,11 @@ class Instance(SQLModel, table=True):
 
 
 class Encounter(SQLModel, table=True):
+    # Seeding upserts on (instance_id, blizzard_id)
+    __table_args__ = (
+        Index("ix_encounter_instance_blizzard", "instance_id", "blizzard_id", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     blizzard_id: int
     instance_id: int = Field(foreign_key="instance.id")
@@ -196,6 +301,92 @@ def dispose_db():
     engine.dispose()
 
 
+class AdvisoryLock:
+    """Cross-process lock backed by a Postgres session advisory lock.
+
+    The lock lives on a dedicated autocommit connection until ``release``.
+    Other databases have no cross-process equivalent, so there it is always
+    granted (the SQLite setup runs a single process).
+    """
+
+    def __init__(self, key: int, sub: int = 0):
+        self.key = key
+        self.sub = sub
+        self.held = False
+        self._conn = None
+
+    def acquire(self) -> bool:
+        """Try to take the lock without waiting. Returns whether it is held.
+
+        A lock already held is re-verified first: if its session dropped, the
+        server released the lock (and another worker may have it now).
+        """
+        if self.held:
+            if self._conn is None or self._still_held():
+                return True
+            logger.warning("Advisory lock (%s, %s) was lost with its connection.", self.key, self.sub)
+            self._discard()
+        if engine.dialect.name != "postgresql":
+            self.held = True
+            return True
+        conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            got = conn.execute(
+                text("SELECT pg_try_advisory_lock(:key, :sub)"),
+                {"key": self.key, "sub": self.sub},
+            ).scalar()
+        except Exception:
+            conn.close()
+            raise
+        if got:
+            self._conn = conn
+            self.held = True
+        else:
+            conn.close()
+        return self.held
+
+    def _still_held(self) -> bool:
+        try:
+            return bool(self._conn.execute(
+                text(
+                    "SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND granted"
+                    " AND pid = pg_backend_pid() AND classid = :key AND objid = :sub"
+                    " AND objsubid = 2"
+                ),
+                {"key": self.key, "sub": self.sub},
+            ).first())
+        except Exception:
+            return False
+
+    def _discard(self) -> None:
+        """Forget a lost lock without trying to unlock it."""
+        conn, self._conn = self._conn, None
+        self.held = False
+        try:
+            conn.invalidate()
+        except Exception:
+            pass
+
+    def release(self) -> None:
+        conn, self._conn = self._conn, None
+        self.held = False
+        if conn is None:
+            return
+        try:
+            conn.execute(
+                text("SELECT pg_advisory_unlock(:key, :sub)"),
+                {"key": self.key, "sub": self.sub},
+            )
+        finally:
+            conn.close()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
 def get_session() -> Generator[Session, None, None]:
     """Yield a database session for FastAPI dependencies."""
 
@@ -1,32 +1,24 @@
+import asyncio
 import logging
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import dotenv
-import requests
 
-import lib.wow as wow
-
-from .auth import get_access_token
+import lib.blizzard as blizzard
+import lib.static_data as static_data
+from lib.singleflight import SingleFlight
 
 dotenv.load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-WOW_API_URL_BASE = f"https://{os.getenv('REGION')}.api.blizzard.com/data/wow"
+
+def _guild_path() -> str:
+    return f"/data/wow/guild/{os.getenv('GUILD_SLUG')}/{os.getenv('GUILD_NAME')}"
 
 
 def get_guild_info() -> dict:
-    bearer = get_access_token()
-    resp = requests.get(
-        (
-            f"{WOW_API_URL_BASE}/guild/{os.getenv('GUILD_SLUG')}/{os.getenv('GUILD_NAME')}"
-            f"?namespace=profile-{os.getenv('REGION')}&locale={os.getenv('LOCALE')}"
-        ),
-        headers={"Authorization": f"Bearer {bearer}"},
-    )
-    resp.raise_for_status()
-    data = resp.json()
+    data = blizzard.api_get_json(_guild_path(), blizzard.profile_namespace())
     return {
         "name": data["name"],
         "realm": data["realm"]["name"],
@@ -34,26 +26,42 @@ def get_guild_info() -> dict:
     }
 
 
-def get_guild_roster() -> dict:
-    # Build lookup maps concurrently
-    with ThreadPoolExecutor(max_workers=2) as ex:
-        classes_fut = ex.submit(wow.get_classes_index)
-        races_fut = ex.submit(wow.get_races_index)
-        classes = {c["id"]: c["name"] for c in classes_fut.result()}
-        races = {r["id"]: r["name"] for r in races_fut.result()}
-
-    bearer = get_access_token()
-    resp = requests.get(
-        f"{WOW_API_URL_BASE}/guild/{os.getenv('GUILD_SLUG')}"
-        f"/{os.getenv('GUILD_NAME')}/roster",
-        params={
-            "namespace": f"profile-{os.getenv('REGION')}",
-            "locale": os.getenv("LOCALE"),
-        },
-        headers={"Authorization": f"Bearer {bearer}"},
+_roster_flight = SingleFlight()
+
+
+async def get_guild_roster() -> dict:
+    """Fetch the guild roster with class and race names resolved.
+
+    The roster itself must load (errors propagate). Class and race names come
+    from the long-lived reference data in lib/static_data.py, so a refresh is
+    normally a single upstream call. If that data is unavailable, the names
+    are None and a message is added to "warnings" so the caller can keep the
+    stored values instead.
+
+    Concurrent callers (e.g. a roster update and a DB populate) share one fetch.
+    """
+    return await _roster_flight.ado("roster", _fetch_guild_roster)
+
+
+async def _fetch_guild_roster() -> dict:
+    reference, roster_data = await asyncio.gather(
+        static_data.get(),
+        blizzard.aapi_get_json(f"{_guild_path()}/roster", blizzard.profile_namespace()),
+        return_exceptions=True,
     )
-    resp.raise_for_status()
-    members = resp.json().get("members", [])
+    if isinstance(roster_data, BaseException):
+        raise roster_data
+
+    warnings: list[str] = []
+    classes: dict | None = None
+    races: dict | None = None
+    if isinstance(reference, BaseException):
+        logger.warning("Playable class/race lookup failed: %s", reference)
+        warnings.append(f"class/race lookup failed: {reference}")
+    else:
+        classes = {cid: c["name"] for cid, c in reference.classes.items()}
+        races = {rid: r["name"] for rid, r in reference.races.items()}
+    members = roster_data.get("members", [])
 
     roster = []
     for m in members:
@@ -72,11 +80,11 @@ def get_guild_roster() -> dict:
                 "name": char.get("name"),
                 "realm": char.get("realm", {}).get("slug"),
                 "level": char.get("level", 0),
-                "class": classes.get(cls_id, "Unknown"),
-                "race": races.get(race_id, "Unknown"),
+                "class": classes.get(cls_id, "Unknown") if classes is not None else None,
+                "race": races.get(race_id, "Unknown") if races is not None else None,
                 "faction": char.get("faction", {}).get("type"),
                 "rank": m.get("rank"),
             }
         )
 
-    return {"roster": roster}
+    return {"roster": roster, "warnings": warnings}
@@ -2,19 +2,24 @@ from __future__ import annotations
 
 import logging
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Optional
 
 import yaml
-from sqlalchemy import delete
+from sqlalchemy import delete, exists, insert, update
 from sqlmodel import Session, select
 
-from lib.db import Encounter, Expansion, Instance
+from lib.db import Encounter, Event, Expansion, Instance, dialect_insert
 
 logger = logging.getLogger(__name__)
 
 DATA_DIR = Path("data/instances")
 CURRENT_SEASON_DIR = DATA_DIR / "Current Season"
 
+_INSTANCE_FIELDS = (
+    "expansion_id", "name", "description", "img", "instance_type", "is_current_season", "sort_order",
+)
+_ENCOUNTER_FIELDS = ("name", "description", "creature_display_id", "img", "sort_order")
+
 
 # ---------------------------------------------------------------------------
 # Internal helpers
@@ -58,6 +63,73 @@ def _row_to_dict(inst: Instance, exp_name: str, encounters: list[Encounter]) ->
     }
 
 
+def _raid_record(inst: Instance, encounters: list[Encounter]) -> dict:
+    """Stored rows in the shape ``generate_raids`` produces."""
+    return {
+        "blizzard-id": inst.blizzard_id,
+        "name": inst.name,
+        "description": inst.description,
+        "img": inst.img,
+        "encounters": [
+            {
+                "blizzard-id": e.blizzard_id,
+                "name": e.name,
+                "description": e.description,
+                "creature_display_id": e.creature_display_id,
+                "img": e.img,
+            }
+            for e in sorted(encounters, key=lambda x: x.sort_order)
+        ],
+    }
+
+
+def _carry_over_failed(session: Session, raids: dict, failures: list[dict]) -> list[int]:
+    """Copy stored raids covered by ``failures`` into ``raids`` (in place).
+
+    Lets a partial journal fetch keep what the DB already has for expansions
+    or instances that could not be refetched. Returns the kept blizzard_ids.
+    """
+    failed_expansions = {f["name"] for f in failures if f["kind"] == "expansion" and f.get("name")}
+    failed_instances = {f["id"] for f in failures if f["kind"] == "instance"}
+    if not failed_expansions and not failed_instances:
+        return []
+
+    rows = session.exec(
+        select(Instance, Expansion)
+        .join(Expansion)
+        .where(
+            Expansion.name.in_(failed_expansions)
+            | Instance.blizzard_id.in_(failed_instances)
+        )
+        .order_by(Instance.sort_order)
+    ).all()
+
+    kept: list[int] = []
+    for inst, exp in rows:
+        bucket = raids.setdefault(exp.name, {})
+        if inst.blizzard_id in bucket:
+            continue
+        encs = session.exec(
+            select(Encounter)
+            .where(Encounter.instance_id == inst.id)
+            .order_by(Encounter.sort_order)
+        ).all()
+        bucket[inst.blizzard_id] = _raid_record(inst, list(encs))
+        kept.append(inst.blizzard_id)
+    return kept
+
+
+def stored_raids(session: Session) -> dict[int, tuple[str, dict]]:
+    """All stored raids as blizzard_id -> (expansion name, raid record)."""
+    encounters: dict[int, list[Encounter]] = {}
+    for enc in session.exec(select(Encounter)):
+        encounters.setdefault(enc.instance_id, []).append(enc)
+    return {
+        inst.blizzard_id: (exp.name, _raid_record(inst, encounters.get(inst.id, [])))
+        for inst, exp in session.exec(select(Instance, Expansion).join(Expansion))
+    }
+
+
 # ---------------------------------------------------------------------------
 # Public API
 # ---------------------------------------------------------------------------
@@ -77,17 +149,21 @@ def get_instances(
     if current_season:
         query = query.where(Instance.is_current_season == True)  # noqa: E712
     query = query.order_by(Expansion.name, Instance.sort_order)
+    rows = session.exec(query).all()
+
+    # One query for the encounters of the whole result set, grouped in memory
+    encounters: dict[int, list[Encounter]] = {}
+    if include_encounters and rows:
+        for enc in session.exec(
+            select(Encounter)
+            .where(Encounter.instance_id.in_([inst.id for inst, _ in rows]))
+            .order_by(Encounter.instance_id, Encounter.sort_order)
+        ):
+            encounters.setdefault(enc.instance_id, []).append(enc)
 
     results = []
-    for inst, exp in session.exec(query):
-        encs = []
-        if include_encounters:
-            encs = list(session.exec(
-                select(Encounter)
-                .where(Encounter.instance_id == inst.id)
-                .order_by(Encounter.sort_order)
-            ).all())
-        d = _row_to_dict(inst, exp.name, encs)
+    for inst, exp in rows:
+        d = _row_to_dict(inst, exp.name, encounters.get(inst.id, []))
         if not include_encounters:
             d.pop("encounters")
         results.append(d)
@@ -119,20 +195,31 @@ def seed_from_data(
     session: Session,
     raids: dict,  # exp_name -> {inst_id -> raid_rec}
     current_season_raid_ids: set[int],
+    failures: Optional[list[dict]] = None,
+    scope: Optional[Iterable[str]] = None,
 ) -> dict:
-    """Wipe instance tables and reload from in-memory raid data.
+    """Sync the instance tables with in-memory raid data, in one transaction.
+
+    Rows are matched by blizzard_id (encounters by instance and blizzard_id):
+    new and changed rows are upserted, unchanged ones are not written and keep
+    their ids, and stored raids missing from ``raids`` are deleted. Readers see
+    the old catalogue until the commit, and events keep pointing at their raid.
+
+    Deletion is limited to ``scope``, the expansion names ``raids`` covers in
+    full (default: its buckets), so seeding one expansion leaves the others
+    alone. An expansion in scope is deleted once it owns no instances.
 
     Processes real expansions first, then season buckets. Duplicate blizzard_ids
     (e.g. current-season raids appearing under both their expansion and a localised
     'Current Season' / 'Temporada actual' bucket) are silently skipped.
+
+    ``failures`` (as returned by ``generate_raids``) marks expansions/instances
+    that could not be fetched; their stored rows are carried over into ``raids``
+    so they are not deleted, and the result reports them under "failed" and "kept".
     """
-    session.execute(delete(Encounter))
-    session.execute(delete(Instance))
-    session.execute(delete(Expansion))
-    session.commit()
+    kept = _carry_over_failed(session, raids, failures) if failures else []
+    scope = set(raids) if scope is None else set(scope)
 
-    total_instances = 0
-    total_encounters = 0
     seen_blizzard_ids: set[int] = set()
 
     def _is_season_bucket(bucket_ids: set[int]) -> bool:
@@ -144,6 +231,7 @@ def seed_from_data(
         _, instances_map = item
         return 1 if _is_season_bucket(set(instances_map.keys())) else 0
 
+    plan: list[tuple[str, list[dict]]] = []
     for exp_name, instances_map in sorted(raids.items(), key=_sort_key):
         if not instances_map:
             continue
@@ -152,50 +240,130 @@ def seed_from_data(
         if not new_raids:
             logger.debug("Skipping bucket '%s' — all raids already inserted.", exp_name)
             continue
+        seen_blizzard_ids.update(r["blizzard-id"] for r in new_raids)
+        plan.append((exp_name, new_raids))
+
+    # Expansions: keep the ids of existing names, insert the new ones
+    expansion_ids = {e.name: e.id for e in session.exec(select(Expansion))}
+    new_names = [exp_name for exp_name, _ in plan if exp_name not in expansion_ids]
+    if new_names:
+        expansion_ids.update(session.execute(
+            insert(Expansion).returning(Expansion.name, Expansion.id),
+            [{"name": exp_name} for exp_name in new_names],
+        ).all())
+
+    # Instances: upsert new and changed rows by blizzard_id, delete the rest
+    current = {i.blizzard_id: i for i in session.exec(select(Instance))}
+    instance_rows = {
+        raid_rec["blizzard-id"]: {
+            "blizzard_id": raid_rec["blizzard-id"],
+            "expansion_id": expansion_ids[exp_name],
+            "name": raid_rec.get("name", ""),
+            "description": raid_rec.get("description"),
+            "img": raid_rec.get("img"),
+            "instance_type": "raid",
+            "is_current_season": raid_rec["blizzard-id"] in current_season_raid_ids,
+            "sort_order": sort_idx,
+        }
+        for exp_name, new_raids in plan
+        for sort_idx, raid_rec in enumerate(new_raids)
+    }
+    instance_ids = {bid: inst.id for bid, inst in current.items()}
+    changed = [
+        row for bid, row in instance_rows.items()
+        if bid not in current or any(getattr(current[bid], f) != row[f] for f in _INSTANCE_FIELDS)
+    ]
+    if changed:
+        stmt = dialect_insert(Instance, session).values(changed)
+        instance_ids.update(session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["blizzard_id"],
+                set_={f: stmt.excluded[f] for f in _INSTANCE_FIELDS},
+            ).returning(Instance.blizzard_id, Instance.id)
+        ).all())
+
+    scoped_ids = {exp_id for name, exp_id in expansion_ids.items() if name in scope}
+    stale = {
+        bid for bid, inst in current.items()
+        if bid not in instance_rows and inst.instance_type == "raid" and inst.expansion_id in scoped_ids
+    }
+    stale_ids = [instance_ids[bid] for bid in stale]
 
-        expansion = Expansion(name=exp_name)
-        session.add(expansion)
-        session.commit()
-        session.refresh(expansion)
-
-        for sort_idx, raid_rec in enumerate(new_raids):
-            blizzard_id = raid_rec["blizzard-id"]
-            seen_blizzard_ids.add(blizzard_id)
-
-            inst = Instance(
-                blizzard_id=blizzard_id,
-                expansion_id=expansion.id,
-                name=raid_rec.get("name", ""),
-                description=raid_rec.get("description"),
-                img=raid_rec.get("img"),
-                instance_type="raid",
-                is_current_season=blizzard_id in current_season_raid_ids,
-                sort_order=sort_idx,
+    # Encounters: same, keyed by (instance, blizzard_id), for the raids in the plan
+    planned_ids = [instance_ids[bid] for bid in instance_rows]
+    current_encs = {
+        (e.instance_id, e.blizzard_id): e
+        for e in session.exec(select(Encounter).where(Encounter.instance_id.in_(planned_ids)))
+    }
+    encounter_rows = {
+        (instance_ids[raid_rec["blizzard-id"]], enc.get("blizzard-id")): {
+            "blizzard_id": enc.get("blizzard-id"),
+            "instance_id": instance_ids[raid_rec["blizzard-id"]],
+            "name": enc.get("name", ""),
+            "description": enc.get("description"),
+            "creature_display_id": enc.get("creature_display_id"),
+            "img": enc.get("img"),
+            "sort_order": enc_idx,
+        }
+        for _, new_raids in plan
+        for raid_rec in new_raids
+        for enc_idx, enc in enumerate(raid_rec.get("encounters", []))
+    }
+    changed_encs = [
+        row for key, row in encounter_rows.items()
+        if key not in current_encs
+        or any(getattr(current_encs[key], f) != row[f] for f in _ENCOUNTER_FIELDS)
+    ]
+    if changed_encs:
+        stmt = dialect_insert(Encounter, session).values(changed_encs)
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=["instance_id", "blizzard_id"],
+            set_={f: stmt.excluded[f] for f in _ENCOUNTER_FIELDS},
+        ))
+    stale_encs = [current_encs[key].id for key in current_encs.keys() - encounter_rows.keys()]
+    if stale_encs or stale_ids:
+        session.execute(
+            delete(Encounter).where(
+                Encounter.id.in_(stale_encs) | Encounter.instance_id.in_(stale_ids)
             )
-            session.add(inst)
-            session.commit()
-            session.refresh(inst)
-            total_instances += 1
-
-            for enc_idx, enc in enumerate(raid_rec.get("encounters", [])):
-                session.add(Encounter(
-                    blizzard_id=enc.get("blizzard-id"),
-                    instance_id=inst.id,
-                    name=enc.get("name", ""),
-                    description=enc.get("description"),
-                    creature_display_id=enc.get("creature_display_id"),
-                    img=enc.get("img"),
-                    sort_order=enc_idx,
-                ))
-                total_encounters += 1
-            session.commit()
-
-    logger.info("Seeded %d instances and %d encounters.", total_instances, total_encounters)
-    return {"instances": total_instances, "encounters": total_encounters}
+        )
+    if stale:
+        # Events lose their raid (SQLite does not enforce ON DELETE SET NULL)
+        session.execute(
+            update(Event)
+            .where(Event.instance_blizzard_id.in_(stale))
+            .values(instance_blizzard_id=None)
+        )
+        session.execute(delete(Instance).where(Instance.blizzard_id.in_(stale)))
+    session.execute(
+        delete(Expansion).where(
+            Expansion.name.in_(scope),
+            ~exists().where(Instance.expansion_id == Expansion.id),
+        )
+    )
+    session.commit()
+    session.expire_all()
+
+    total_instances = len(instance_rows)
+    total_encounters = len(encounter_rows)
+    logger.info(
+        "Seeded %d instances and %d encounters (%d instance and %d encounter rows written, %d removed).",
+        total_instances, total_encounters, len(changed), len(changed_encs), len(stale),
+    )
+    result = {
+        "instances": total_instances,
+        "encounters": total_encounters,
+        "unchanged": total_instances - len(changed),
+    }
+    if failures:
+        logger.warning("%d journal fetches failed; kept %d stored instances.", len(failures), len(kept))
+        result["failed"] = failures
+        result["kept"] = kept
+    return result
 
 
 def seed_from_yaml(session: Session) -> dict:
-    """Wipe instance tables and reload from YAML archive files.
+    """Sync instance tables with the YAML archive files.
 
     Returns empty result silently if the data directory doesn't exist yet
     (fresh install before POST /admin/instances/seed has run).
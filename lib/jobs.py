@@ -0,0 +1,275 @@
+"""Background jobs for long-running admin operations.
+
+Endpoints enqueue a job and return its id at once; a small thread pool runs it
+and records status, progress and the result in the ``job`` table, so a seed or
+roster update neither occupies a request thread nor dies with the client
+connection. Poll ``GET /api/admin/jobs/{id}`` for the outcome.
+
+Handlers are registered per kind and receive a ``JobContext`` plus the job's
+params::
+
+    @jobs.handler("instances.seed")
+    def _seed(ctx: jobs.JobContext, params: dict) -> dict:
+        ctx.progress(0, 10, "fetching")
+        ...
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+import lib.db as db
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Queued/running jobs not updated for this long belonged to a dead process
+STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "900"))
+# How often a process touches the jobs it owns, so live ones never look stale
+HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+ACTIVE = (QUEUED, RUNNING)
+
+Handler = Callable[["JobContext", dict], Any]
+_handlers: dict[str, Handler] = {}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_pending: dict[str, Future] = {}  # submitted by this process and not finished yet
+_heartbeat_stop: Optional[threading.Event] = None  # set to end the current heartbeat thread
+
+
+def handler(kind: str) -> Callable[[Handler], Handler]:
+    """Register ``fn`` as the runner for jobs of ``kind``."""
+
+    def decorator(fn: Handler) -> Handler:
+        _handlers[kind] = fn
+        return fn
+
+    return decorator
+
+
+def _now() -> datetime:
+    return datetime.now().astimezone()
+
+
+def _update(job_id: str, **values: Any) -> None:
+    with Session(db.engine) as session:
+        session.execute(
+            update(db.Job).where(db.Job.id == job_id).values(updated_at=_now(), **values)
+        )
+        session.commit()
+
+
+class JobContext:
+    """Handed to a running handler for progress reporting."""
+
+    # Progress writes are throttled to one per interval (the last one always lands)
+    PROGRESS_INTERVAL = 0.5
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self._last_write = 0.0
+
+    def progress(self, done: int, total: Optional[int] = None, message: Optional[str] = None) -> None:
+        now = time.monotonic()
+        if now - self._last_write < self.PROGRESS_INTERVAL and (total is None or done < total):
+            return
+        self._last_write = now
+        values: dict[str, Any] = {"progress_done": done}
+        if total is not None:
+            values["progress_total"] = total
+        if message is not None:
+            values["message"] = message
+        _update(self.job_id, **values)
+
+    def note(self, message: str) -> None:
+        """Change the status message without touching the counters."""
+        _update(self.job_id, message=message)
+
+
+def _heartbeat(stop: threading.Event) -> None:
+    """Keep ``updated_at`` of this process's jobs fresh while they are pending."""
+    while not stop.wait(HEARTBEAT_SECONDS):
+        with _executor_lock:
+            job_ids = list(_pending)
+        if not job_ids:
+            continue
+        try:
+            with Session(db.engine) as session:
+                session.execute(
+                    update(db.Job)
+                    .where(db.Job.id.in_(job_ids))
+                    .where(db.Job.status.in_(ACTIVE))
+                    .values(updated_at=_now())
+                )
+                session.commit()
+        except Exception:
+            logger.exception("Job heartbeat failed")
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor, _heartbeat_stop
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="job")
+                _heartbeat_stop = threading.Event()
+                threading.Thread(
+                    target=_heartbeat, args=(_heartbeat_stop,), name="job-heartbeat", daemon=True
+                ).start()
+    return _executor
+
+
+def _run(job_id: str, kind: str, params: dict) -> None:
+    try:
+        _update(job_id, status=RUNNING, started_at=_now())
+        try:
+            result = _handlers[kind](JobContext(job_id), params)
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job_id, kind)
+            _update(job_id, status=FAILED, error=str(e), finished_at=_now())
+            return
+        _update(
+            job_id,
+            status=SUCCEEDED,
+            result=json.dumps(result, default=str) if result is not None else None,
+            finished_at=_now(),
+        )
+        logger.info("Job %s (%s) finished.", job_id, kind)
+    finally:
+        with _executor_lock:
+            _pending.pop(job_id, None)
+
+
+def enqueue(kind: str, params: Optional[dict] = None) -> tuple[db.Job, bool]:
+    """Queue a job. Returns ``(job, created)``.
+
+    If a job of the same kind is already queued or running, that job is
+    returned instead (``created`` is False) rather than starting a duplicate.
+    The check is atomic across workers: the ``job`` table allows one active
+    row per kind, so of two racing inserts one fails and joins the other.
+    Active rows not updated for STALE_SECONDS are failed as abandoned first.
+    """
+    if kind not in _handlers:
+        raise KeyError(f"Unknown job kind '{kind}'")
+    fail_abandoned(kind)
+    for _ in range(3):
+        with Session(db.engine) as session:
+            active = session.exec(
+                select(db.Job).where(db.Job.kind == kind).where(db.Job.status.in_(ACTIVE))
+            ).first()
+            if active is not None:
+                return active, False
+            job = db.Job(
+                id=uuid.uuid4().hex,
+                kind=kind,
+                params=json.dumps(params or {}),
+            )
+            session.add(job)
+            try:
+                session.commit()
+            except IntegrityError:
+                continue  # another worker queued one in between; join it
+            session.refresh(job)
+            break
+    else:
+        raise RuntimeError(f"Could not queue or join a '{kind}' job")
+    executor = _get_executor()
+    with _executor_lock:
+        _pending[job.id] = executor.submit(_run, job.id, kind, params or {})
+    return job, True
+
+
+def get(job_id: str) -> Optional[db.Job]:
+    with Session(db.engine) as session:
+        return session.get(db.Job, job_id)
+
+
+def wait(job_id: str, timeout: Optional[float] = None, poll: float = 0.2) -> Optional[db.Job]:
+    """Block until the job has finished (or ``timeout`` passed) and return its row.
+
+    Jobs run by this process are awaited directly; others are polled.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _executor_lock:
+        future = _pending.get(job_id)
+    if future is not None:
+        try:
+            future.result(timeout=timeout)
+        except (FutureTimeout, CancelledError):
+            pass
+    while True:
+        job = get(job_id)
+        if job is None or job.status not in ACTIVE:
+            return job
+        if deadline is not None and time.monotonic() >= deadline:
+            return job
+        time.sleep(poll)
+
+
+def recent(limit: int = 20) -> list[db.Job]:
+    with Session(db.engine) as session:
+        return list(
+            session.exec(select(db.Job).order_by(db.Job.created_at.desc()).limit(limit)).all()
+        )
+
+
+def to_dict(job: db.Job) -> dict:
+    data = job.model_dump(exclude={"params", "updated_at"})
+    data["result"] = json.loads(job.result) if job.result else None
+    return data
+
+
+def fail_abandoned(kind: Optional[str] = None) -> int:
+    """Mark jobs left queued/running by a process that has since died as failed.
+
+    Live jobs are kept fresh by their process's heartbeat, so only jobs whose
+    owner stopped beating for STALE_SECONDS qualify.
+    """
+    cutoff = _now() - timedelta(seconds=STALE_SECONDS)
+    stmt = (
+        update(db.Job)
+        .where(db.Job.status.in_(ACTIVE))
+        .where(db.Job.updated_at < cutoff)
+        .values(status=FAILED, error="interrupted (server restarted)", finished_at=_now())
+    )
+    if kind is not None:
+        stmt = stmt.where(db.Job.kind == kind)
+    with Session(db.engine) as session:
+        dropped = session.execute(stmt).rowcount
+        session.commit()
+    return dropped
+
+
+def shutdown(wait: bool = False) -> None:
+    """Stop the pool. Jobs still queued here are cancelled and marked failed;
+    running ones are left to finish."""
+    global _executor, _heartbeat_stop
+    with _executor_lock:
+        executor, _executor = _executor, None
+        stop, _heartbeat_stop = _heartbeat_stop, None
+        cancelled = [job_id for job_id, f in _pending.items() if f.cancel()]
+    if stop is not None:
+        stop.set()
+    if executor is not None:
+        executor.shutdown(wait=wait, cancel_futures=True)
+    for job_id in cancelled:
+        _update(job_id, status=FAILED, error="cancelled (server shutting down)", finished_at=_now())
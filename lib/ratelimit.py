@@ -0,0 +1,93 @@
+"""Token-bucket rate limiting usable from both threads and asyncio.
+
+Callers *reserve* a token under a short lock and get back how long they must
+wait; the wait itself happens outside the lock (``time.sleep`` for threads,
+``asyncio.sleep`` for coroutines), so a throttled caller never blocks others
+from reserving their own slot. Reservations may run a bucket into debt, which
+queues callers fairly in arrival order.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """``capacity`` tokens, refilled continuously at ``rate`` tokens per second."""
+
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0 or capacity <= 0:
+            raise ValueError("rate and capacity must be positive")
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """Take one token; return the seconds until it is actually available."""
+        self._refill(now)
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def remaining(self, now: float) -> float:
+        self._refill(now)
+        return self.tokens
+
+
+class RateLimiter:
+    """Every call must get a token from each bucket (e.g. per-second and per-hour)."""
+
+    def __init__(self, buckets: dict[str, TokenBucket]):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.throttled = 0
+        self.waited_seconds = 0.0
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            delay = max(bucket.reserve(now) for bucket in self.buckets.values())
+            self.acquired += 1
+            if delay > 0:
+                self.throttled += 1
+                self.waited_seconds += delay
+            return delay
+
+    def acquire(self) -> None:
+        """Block the calling thread until a request may be sent."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def aacquire(self) -> None:
+        """Wait (without blocking the event loop) until a request may be sent."""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def snapshot(self, now: Optional[float] = None) -> dict:
+        """Remaining budget per bucket plus lifetime counters."""
+        with self._lock:
+            now = time.monotonic() if now is None else now
+            return {
+                "buckets": {
+                    name: {
+                        "rate_per_second": bucket.rate,
+                        "capacity": bucket.capacity,
+                        "remaining": max(0, int(bucket.remaining(now))),
+                        "queued": max(0, -int(bucket.remaining(now))),
+                    }
+                    for name, bucket in self.buckets.items()
+                },
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "waited_seconds": round(self.waited_seconds, 3),
+            }
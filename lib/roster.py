@@ -0,0 +1,116 @@
+"""Guild roster sync: fetch from Blizzard and apply the changes to GuildMember.
+
+Used by the roster endpoints and by ``refresher``, the background job started
+from the app lifespan that keeps the table warm on its own schedule
+(ROSTER_REFRESH_INTERVAL seconds plus up to ROSTER_REFRESH_JITTER).
+"""
+
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import delete, update
+from sqlmodel import Session, select
+
+import lib.blizzard as blizzard
+import lib.db as db
+import lib.guild as guild
+import lib.security as security
+from lib.scheduler import PeriodicJob
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = float(os.getenv("ROSTER_REFRESH_INTERVAL", "3600"))  # 0 = only on demand
+REFRESH_JITTER = float(os.getenv("ROSTER_REFRESH_JITTER", "300"))
+# Postgres advisory lock key shared by every worker ("WGRS")
+LOCK_KEY = 0x57475253
+
+_FIELDS = ("name", "realm", "level", "race", "clazz", "faction", "rank")
+
+
+def store_roster(session: Session, roster: list[dict]) -> dict:
+    """Sync GuildMember with ``roster``, writing only what changed.
+
+    New and changed members go in one bulk upsert, departed members in one
+    bulk delete, all in a single transaction so readers never see a partial
+    or empty roster. Untouched rows keep their ``fetched_at`` and ``user_id``.
+    """
+    current = {gm.character_id: gm for gm in session.exec(select(db.GuildMember)).all()}
+    now = datetime.now().astimezone()
+
+    incoming: dict[int, dict] = {}
+    inserted = updated = 0
+    for m in roster:
+        old = current.get(m["id"])
+        row = {
+            "name": m["name"],
+            "realm": m["realm"],
+            "level": m["level"],
+            # Class/race are None when their lookup failed; keep what we already have
+            "race": m["race"] or (old.race if old else "Unknown"),
+            "clazz": m["class"] or (old.clazz if old else "Unknown"),
+            "faction": m["faction"],
+            "rank": m["rank"],
+        }
+        if old is None:
+            inserted += 1
+        elif any(getattr(old, f) != row[f] for f in _FIELDS):
+            updated += 1
+        else:
+            continue
+        incoming[m["id"]] = {"character_id": m["id"], **row, "fetched_at": now}
+
+    removed_ids = current.keys() - {m["id"] for m in roster}
+    orphaned: list[str] = []
+    if removed_ids:
+        # Users whose main left the guild lose it (SQLite does not enforce ON DELETE SET NULL)
+        orphaned = list(session.scalars(
+            update(db.User)
+            .where(db.User.primary_character_id.in_(removed_ids))
+            .values(primary_character_id=None)
+            .returning(db.User.username)
+        ))
+        session.execute(delete(db.GuildMember).where(db.GuildMember.character_id.in_(removed_ids)))
+    if incoming:
+        stmt = db.dialect_insert(db.GuildMember, session).values(list(incoming.values()))
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["character_id"],
+                set_={f: stmt.excluded[f] for f in (*_FIELDS, "fetched_at")},
+            )
+        )
+    session.commit()
+    session.expire_all()
+    for username in orphaned:
+        security.invalidate_principal(username)
+
+    logger.info(
+        "Roster updated: %d members (%d new, %d changed, %d removed).",
+        len(roster), inserted, updated, len(removed_ids),
+    )
+    return {
+        "count": len(roster),
+        "inserted": inserted,
+        "changed": updated,
+        "removed": len(removed_ids),
+        "updated": now,
+    }
+
+
+def refresh() -> dict:
+    """Fetch the roster and store it (runs on the refresher's thread)."""
+    result = blizzard.run(guild.get_guild_roster)
+    with Session(db.engine) as session:
+        stored = store_roster(session, result["roster"])
+    if result.get("warnings"):
+        stored["warnings"] = result["warnings"]
+    return stored
+
+
+refresher = PeriodicJob(
+    "roster",
+    refresh,
+    interval=REFRESH_INTERVAL,
+    jitter=REFRESH_JITTER,
+    lock_key=LOCK_KEY,
+)
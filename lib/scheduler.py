@@ -0,0 +1,169 @@
+"""In-process periodic jobs for background refreshes.
+
+A ``PeriodicJob`` runs a sync function on a daemon thread every ``interval``
+seconds plus a random ``jitter`` (so workers started together do not fire
+together), and can also be run on demand with ``run_now()`` from the caller's
+thread (e.g. a background job).
+
+In a multi-worker deployment two Postgres advisory locks keep this to one
+worker: the *leader* lock decides which worker runs the schedule, and the
+*run* lock makes sure an on-demand run never overlaps a scheduled one.
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+import lib.db as db
+
+logger = logging.getLogger(__name__)
+
+_LEADER = 0
+_RUN = 1
+
+
+class AlreadyRunning(RuntimeError):
+    pass
+
+
+class PeriodicJob:
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[], Any],
+        interval: float,
+        jitter: float = 0,
+        lock_key: int = 0,
+    ):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.jitter = jitter
+        self._leader = db.AdvisoryLock(lock_key, _LEADER)
+        self._run_lock_key = lock_key
+        self._local_run = threading.Lock()  # advisory locks are no-ops on SQLite
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._next_run: Optional[float] = None
+        self.running = False
+        self.last_started: Optional[datetime] = None
+        self.last_finished: Optional[datetime] = None
+        self.last_result: Any = None
+        self.last_error: Optional[str] = None
+        self._finished_runs = 0
+
+    # -- lifecycle ---------------------------------------------------------------
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._schedule_next()
+        self._thread = threading.Thread(target=self._loop, name=f"job-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._leader.release()
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "running": self.running,
+            "leader": self._leader.held,
+            "interval_seconds": self.interval,
+            "next_run_in": (
+                round(max(0.0, self._next_run - time.monotonic()))
+                if self._next_run is not None
+                else None
+            ),
+            "last_started": self.last_started,
+            "last_finished": self.last_finished,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+    # -- internals ---------------------------------------------------------------
+
+    def _schedule_next(self) -> None:
+        if self.interval <= 0:
+            self._next_run = None  # on demand only
+        else:
+            self._next_run = time.monotonic() + self.interval + random.uniform(0, self.jitter)
+
+    def _loop(self) -> None:
+        while True:
+            timeout = None if self._next_run is None else max(0.0, self._next_run - time.monotonic())
+            if self._stop.wait(timeout):
+                break
+            if not self._is_leader():
+                self._schedule_next()
+                continue
+            self._run_once()
+            self._schedule_next()
+
+    def _is_leader(self) -> bool:
+        try:
+            return self._leader.acquire()
+        except Exception as e:
+            logger.warning("Job %s could not check leadership: %s", self.name, e)
+            return False
+
+    def run_now(self, wait: bool = False, poll: float = 1.0) -> Any:
+        """Run in the calling thread (e.g. from a background job) and return the result.
+
+        Raises ``AlreadyRunning`` if a run is already in progress here or in
+        another worker; the function's own errors propagate. With ``wait`` the
+        caller joins the run in progress instead: in this worker it gets that
+        run's result, otherwise it waits for the other worker to finish (polling
+        every ``poll`` seconds) and then runs.
+        """
+        finished = self._finished_runs
+        if not self._local_run.acquire(blocking=wait):
+            raise AlreadyRunning(f"{self.name} is already running")
+        try:
+            if self._finished_runs != finished:
+                # A run finished while we waited for it: share its outcome
+                if self.last_error is not None:
+                    raise RuntimeError(f"{self.name} failed: {self.last_error}")
+                return self.last_result
+            while True:
+                with db.AdvisoryLock(self._run_lock_key, _RUN) as acquired:
+                    if acquired:
+                        return self._execute()
+                if not wait:
+                    raise AlreadyRunning(f"{self.name} is already running")
+                time.sleep(poll)
+        finally:
+            self._local_run.release()
+
+    def _execute(self) -> Any:
+        self.running = True
+        self.last_started = datetime.now().astimezone()
+        try:
+            self.last_result = self.fn()
+            self.last_error = None
+            return self.last_result
+        except Exception as e:
+            self.last_error = str(e)
+            raise
+        finally:
+            self.running = False
+            self.last_finished = datetime.now().astimezone()
+            self._finished_runs += 1
+
+    def _run_once(self) -> None:
+        try:
+            self.run_now()
+        except AlreadyRunning:
+            logger.info("Job %s skipped: a run is already in progress.", self.name)
+        except Exception:
+            logger.exception("Job %s failed", self.name)
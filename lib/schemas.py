@@ -154,3 +154,17 @@ class UpdateCheckResponse(BaseModel):
 class UpdateApplyResponse(BaseModel):
     updated_to: str
     restarting: bool
+
+
+class JobRead(BaseModel):
+    id: str
+    kind: str
+    status: str
+    progress_done: int = 0
+    progress_total: Optional[int] = None
+    message: Optional[str] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -2,18 +2,23 @@
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Callable, Iterable, Optional
 
 import bcrypt as _bcrypt
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlmodel import Session, select
 
-from . import db
+from . import cache, db
 
 logger = logging.getLogger(__name__)
 
@@ -22,25 +27,144 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
 optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token", auto_error=False)
 
 # Password hashing
+#
+# bcrypt is deliberately slow, so it runs on its own small pool: a burst of
+# logins queues there instead of blocking the event loop or filling the
+# request threadpool. The async variants are for async endpoints.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+
+def _checkpw(plain_password: str, hashed_password: str) -> bool:
     return _bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
 
 
+def _hashpw(password: str) -> str:
+    return _bcrypt.hashpw(password.encode(), _bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return _hash_executor.submit(_checkpw, plain_password, hashed_password).result()
+
+
 def get_password_hash(password: str) -> str:
-    return _bcrypt.hashpw(password.encode(), _bcrypt.gensalt()).decode()
+    return _hash_executor.submit(_hashpw, password).result()
+
+
+async def averify_password(plain_password: str, hashed_password: str) -> bool:
+    return await asyncio.wrap_future(_hash_executor.submit(_checkpw, plain_password, hashed_password))
+
+
+async def aget_password_hash(password: str) -> str:
+    return await asyncio.wrap_future(_hash_executor.submit(_hashpw, password))
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """True if the hash was made with a different BCRYPT_ROUNDS than the current one."""
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
 
 
 # JWT helpers
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "change-me")
+#
+# Tokens carry the user's id, role and token version next to ``sub``, so
+# role-gated endpoints authorise without loading the user. Keys live in a
+# ring: the first key signs, every key verifies, and each token names its
+# key in the ``kid`` header. To rotate, make the new key current and move
+# the old one to the "previous" setting for one token lifetime.
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "change-me")
+PREVIOUS_SECRET_KEYS = [k.strip() for k in os.getenv("JWT_PREVIOUS_SECRET_KEYS", "").split(",") if k.strip()]
+PRIVATE_KEY_FILE = os.getenv("JWT_PRIVATE_KEY_FILE")
+PUBLIC_KEY_FILES = [f.strip() for f in os.getenv("JWT_PUBLIC_KEY_FILES", "").split(",") if f.strip()]
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", "60"))
 
 _INSECURE_DEFAULTS = {"change-me", "super-secret-key", ""}
 
 
+def _is_symmetric(algorithm: str) -> bool:
+    return algorithm.upper().startswith("HS")
+
+
+def _kid(material: str) -> str:
+    return hashlib.sha256(material.encode()).hexdigest()[:16]
+
+
+class KeyRing:
+    """Signs tokens with the current key and verifies them with any known key."""
+
+    def __init__(self, algorithm: str, signing_key: str, verifying_keys: list[str]):
+        self.algorithm = algorithm
+        self.signing_key = signing_key
+        # kid -> key; the current key's kid is derived from its verifying half
+        self.keys = {_kid(k): k for k in verifying_keys}
+        self.current_kid = _kid(verifying_keys[0])
+
+    def encode(self, claims: dict) -> str:
+        return jwt.encode(
+            claims, self.signing_key, algorithm=self.algorithm, headers={"kid": self.current_kid}
+        )
+
+    def decode(self, token: str) -> dict:
+        """Verified claims of ``token``; raises JWTError."""
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:  # issued before keys had ids
+            candidates = list(self.keys.values())
+        elif kid in self.keys:
+            candidates = [self.keys[kid]]
+        else:
+            raise JWTError("Unknown signing key")
+        error: JWTError = JWTError("No verification key")
+        for key in candidates:
+            try:
+                # Only the ring's algorithm is accepted, whatever the header claims
+                return jwt.decode(token, key, algorithms=[self.algorithm])
+            except JWTError as e:
+                error = e
+        raise error
+
+
+def _read_key_file(path: str) -> str:
+    with open(path, encoding="utf-8") as fh:
+        return fh.read()
+
+
+def _build_keyring() -> KeyRing:
+    if _is_symmetric(ALGORITHM):
+        return KeyRing(ALGORITHM, SECRET_KEY, [SECRET_KEY, *PREVIOUS_SECRET_KEYS])
+    if not PRIVATE_KEY_FILE or not PUBLIC_KEY_FILES:
+        raise RuntimeError(
+            f"JWT_ALGORITHM={ALGORITHM} needs JWT_PRIVATE_KEY_FILE and JWT_PUBLIC_KEY_FILES "
+            "(the matching public key first, then any previous ones)."
+        )
+    return KeyRing(
+        ALGORITHM, _read_key_file(PRIVATE_KEY_FILE), [_read_key_file(f) for f in PUBLIC_KEY_FILES]
+    )
+
+
+_keyring: Optional[KeyRing] = None
+
+
+def get_keyring() -> KeyRing:
+    global _keyring
+    if _keyring is None:
+        _keyring = _build_keyring()
+    return _keyring
+
+
 def check_config() -> None:
-    """Raise RuntimeError if the JWT secret is missing or insecure."""
+    """Raise RuntimeError if the JWT signing keys are missing or insecure."""
+    if not _is_symmetric(ALGORITHM):
+        try:
+            get_keyring()
+        except OSError as e:
+            raise RuntimeError(f"Could not read JWT key file: {e}") from e
+        logger.info("Security config validated (%s).", ALGORITHM)
+        return
     if not SECRET_KEY or SECRET_KEY in _INSECURE_DEFAULTS or len(SECRET_KEY) < 32:
         raise RuntimeError(
             "JWT_SECRET_KEY is not set or uses an insecure default. "
@@ -49,24 +173,57 @@ def check_config() -> None:
     logger.info("Security config validated.")
 
 
-def create_access_token(*, subject: str, expires_delta: Optional[timedelta] = None) -> str:
-    expire = datetime.now(timezone.utc) + (
-        expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+def create_access_token(
+    *, subject: str, expires_delta: Optional[timedelta] = None, claims: Optional[dict] = None
+) -> str:
+    now = datetime.now(timezone.utc)
+    expire = now + (expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    to_encode = {**(claims or {}), "sub": subject, "iat": now, "exp": expire}
+    return get_keyring().encode(to_encode)
+
+
+def create_user_token(user: db.User, expires_delta: Optional[timedelta] = None) -> str:
+    """Access token for ``user`` carrying its id, role and token version."""
+    return create_access_token(
+        subject=user.username,
+        expires_delta=expires_delta,
+        claims={"uid": user.id, "role": user.role, "ver": user.token_version},
     )
-    to_encode = {"sub": subject, "exp": expire}
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
 # User retrieval
 
-def authenticate_user(username: str, password: str, session: Session) -> Optional[db.User]:
+def _find_password_user(session: Session, username: str) -> Optional[db.User]:
     user = session.exec(select(db.User).where(db.User.username == username)).first()
-    if not user:
+    if user is None or user.password is None:  # BNet-only account — cannot log in with password
         return None
-    if user.password is None:  # BNet-only account — cannot log in with password
+    return user
+
+
+def _store_password_hash(session: Session, user: db.User, hashed: str) -> None:
+    user.password = hashed
+    session.add(user)
+    session.commit()
+    logger.info("Re-hashed password for '%s' with %d rounds.", user.username, BCRYPT_ROUNDS)
+
+
+def authenticate_user(username: str, password: str, session: Session) -> Optional[db.User]:
+    user = _find_password_user(session, username)
+    if not user or not verify_password(password, user.password):
         return None
-    if not verify_password(password, user.password):
+    if needs_rehash(user.password):
+        _store_password_hash(session, user, get_password_hash(password))
+    return user
+
+
+async def aauthenticate_user(username: str, password: str, session: Session) -> Optional[db.User]:
+    """``authenticate_user`` for async callers; neither DB nor bcrypt work blocks the loop."""
+    user = await run_in_threadpool(_find_password_user, session, username)
+    if not user or not await averify_password(password, user.password):
         return None
+    if needs_rehash(user.password):
+        hashed = await aget_password_hash(password)
+        await run_in_threadpool(_store_password_hash, session, user, hashed)
     return user
 
 
@@ -77,18 +234,113 @@ CREDENTIALS_EXCEPTION = HTTPException(
 )
 
 
+# Authenticated principals are cached briefly so hot read endpoints skip the
+# User SELECT. Entries are dropped when a user's role or primary character
+# changes (see invalidate_principal); other workers catch up within the TTL.
+# The cache is always in-process and separate from lib/cache's backend: a
+# shared-table lookup would cost more than the query it saves, and principals
+# should not compete with Blizzard payloads for LRU slots.
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "4096"))
+_auth_cache = cache.TTLCache(max_entries=PRINCIPAL_CACHE_MAX_ENTRIES)
+_PRINCIPAL_NAMESPACE = "principal"
+_PRINCIPAL_FIELDS = (
+    "id", "username", "role", "bnet_id", "bnet_battletag", "primary_character_id", "token_version",
+)
+
+
+class _UnknownPrincipal(LookupError):
+    pass
+
+
+# Forced logout bumps a user's token_version; tokens carrying an older "ver"
+# are rejected. Only users that were ever revoked appear in the list, so it
+# stays tiny and is cached with the principals (same TTL, per process).
+_REVOCATION_NAMESPACE = "token_revocations"
+
+
+def _revocations(session: Session) -> dict[int, int]:
+    def _load() -> dict[int, int]:
+        rows = session.exec(
+            select(db.User.id, db.User.token_version).where(db.User.token_version > 0)
+        ).all()
+        return {uid: ver for uid, ver in rows}
+
+    if PRINCIPAL_CACHE_TTL <= 0:
+        return _load()
+    return _auth_cache.get_or_compute(_REVOCATION_NAMESPACE, (), _load, PRINCIPAL_CACHE_TTL)
+
+
+def _token_claims(session: Session, token: str) -> Optional[dict]:
+    """Verified, unrevoked claims of ``token``, or None."""
+    try:
+        claims = get_keyring().decode(token)
+    except JWTError:
+        return None
+    if claims.get("sub") is None:
+        return None
+    uid = claims.get("uid")
+    if uid is not None and claims.get("ver", 0) < _revocations(session).get(uid, 0):
+        return None
+    return claims
+
+
+def revoke_tokens(session: Session, user: db.User) -> int:
+    """Invalidate every token issued to ``user`` so far. Returns the new version."""
+    user.token_version += 1
+    session.add(user)
+    session.commit()
+    invalidate_principal(user.username)
+    invalidate_revocations()
+    logger.info("Revoked tokens of '%s' (token version %d).", user.username, user.token_version)
+    return user.token_version
+
+
+def invalidate_revocations() -> None:
+    _auth_cache.invalidate(_REVOCATION_NAMESPACE)
+
+
+def _principal(session: Session, username: str) -> Optional[db.User]:
+    """The user named in a token, from the principal cache when possible.
+
+    A cached principal is a detached ``db.User`` without its password hash;
+    load the row from the session before modifying it.
+    """
+
+    def _load() -> dict:
+        user = session.exec(select(db.User).where(db.User.username == username)).first()
+        if user is None:
+            raise _UnknownPrincipal(username)  # not cached
+        return {f: getattr(user, f) for f in _PRINCIPAL_FIELDS}
+
+    try:
+        if PRINCIPAL_CACHE_TTL <= 0:
+            values = _load()
+        else:
+            values = _auth_cache.get_or_compute(
+                _PRINCIPAL_NAMESPACE, username, _load, PRINCIPAL_CACHE_TTL
+            )
+    except _UnknownPrincipal:
+        return None
+    return db.User(**values)
+
+
+def invalidate_principal(username: Optional[str] = None) -> None:
+    """Drop the cached principal for ``username`` (or all of them)."""
+    if username is None:
+        _auth_cache.invalidate(_PRINCIPAL_NAMESPACE)
+    else:
+        _auth_cache.invalidate(_PRINCIPAL_NAMESPACE, username)
+
+
 def get_current_user(
     session: Session = Depends(db.get_session), token: str = Depends(oauth2_scheme)
 ) -> db.User:
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: Optional[str] = payload.get("sub")
-        if username is None:
-            raise CREDENTIALS_EXCEPTION
-    except JWTError as exc:
-        raise CREDENTIALS_EXCEPTION from exc
+    claims = _token_claims(session, token)
+    if claims is None:
+        raise CREDENTIALS_EXCEPTION
 
-    user = session.exec(select(db.User).where(db.User.username == username)).first()
+    user = _principal(session, claims["sub"])
     if user is None:
         raise CREDENTIALS_EXCEPTION
     return user
@@ -100,15 +352,10 @@ def get_optional_user(
 ) -> Optional[db.User]:
     if not token:
         return None
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: Optional[str] = payload.get("sub")
-        if username is None:
-            return None
-    except JWTError:
+    claims = _token_claims(session, token)
+    if claims is None:
         return None
-
-    return session.exec(select(db.User).where(db.User.username == username)).first()
+    return _principal(session, claims["sub"])
 
 
 def require_authenticated_user(
@@ -130,15 +377,56 @@ def require_roles(*roles: str) -> Callable[[db.User], db.User]:
     if not roles:
         raise ValueError("At least one role must be provided")
 
-    def dependency(current_user: db.User = Depends(get_current_user)) -> db.User:
+    def dependency(
+        session: Session = Depends(db.get_session), token: str = Depends(oauth2_scheme)
+    ) -> db.User:
+        """Authorise from the token's claims alone.
+
+        The returned user is detached and carries only id, username and role;
+        depend on get_current_user as well when more is needed.
+        """
+        claims = _token_claims(session, token)
+        if claims is None:
+            raise CREDENTIALS_EXCEPTION
+        if "uid" in claims and "role" in claims:
+            current_user = db.User(id=claims["uid"], username=claims["sub"], role=claims["role"])
+        else:  # token predates embedded claims
+            current_user = _principal(session, claims["sub"])
+            if current_user is None:
+                raise CREDENTIALS_EXCEPTION
         ensure_roles(current_user, roles)
         return current_user
 
     return dependency
 
 
+# Bootstrap mode ends once the first user exists, so a positive answer is
+# latched per process for BOOTSTRAP_RECHECK_SECONDS: within that window no
+# request pays for the query. A negative answer is re-checked on every call,
+# which is how every worker notices a user created by another; the expiry is
+# how they notice a /admin/db/reset done by another.
+BOOTSTRAP_RECHECK_SECONDS = float(os.getenv("BOOTSTRAP_RECHECK_SECONDS", "60"))
+_users_exist_until = 0.0  # monotonic deadline of the latched "users exist"
+
+
 def users_exist(session: Session) -> bool:
-    return session.exec(select(db.User)).first() is not None
+    global _users_exist_until
+    if time.monotonic() < _users_exist_until:
+        return True
+    if session.exec(select(db.User)).first() is None:
+        return False
+    _users_exist_until = time.monotonic() + BOOTSTRAP_RECHECK_SECONDS
+    return True
+
+
+def reset_bootstrap_state() -> None:
+    """Forget the latched users_exist() answer (after the user table was emptied).
+
+    Only this worker is reset right away; the others re-check within
+    ``BOOTSTRAP_RECHECK_SECONDS``.
+    """
+    global _users_exist_until
+    _users_exist_until = 0.0
 
 
 def ensure_authenticated_or_bootstrap(
@@ -0,0 +1,69 @@
+"""Request coalescing: concurrent calls with the same key share one execution.
+
+The first caller for a key (the leader) runs the work; callers arriving while
+it is in flight wait for the leader's result instead of repeating the work.
+Nothing is cached afterwards, the next call after completion runs again.
+
+The in-flight result is a ``concurrent.futures.Future`` so callers may be
+threads (``do``) or coroutines on any event loop (``ado``).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def _join(self, key: Hashable) -> tuple[Future, bool]:
+        """Return the in-flight future for ``key`` and whether we lead it."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _finish(self, key: Hashable, future: Future) -> None:
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._finish(key, future)
+        future.set_result(result)
+        return result
+
+    async def ado(
+        self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any
+    ) -> Any:
+        future, leader = self._join(key)
+        if not leader:
+            # Shield so a cancelled follower does not cancel the shared future
+            return await asyncio.shield(asyncio.wrap_future(future))
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._finish(key, future)
+        future.set_result(result)
+        return result
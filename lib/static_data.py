@@ -0,0 +1,139 @@
+"""Playable classes and races, kept in the DB and in memory.
+
+This reference data only changes with game patches, so the roster pipeline
+reads it from memory instead of fetching the class index, one media document
+per class and the race index on every refresh. Each worker loads the tables at
+startup; once the data is older than STATIC_DATA_MAX_AGE_DAYS the next caller
+refreshes it (picking up another worker's refresh from the DB if there is one).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import delete
+from sqlmodel import Session, select
+
+import lib.db as db
+import lib.wow as wow
+from lib.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+MAX_AGE_SECONDS = float(os.getenv("STATIC_DATA_MAX_AGE_DAYS", "7")) * 86400
+# A class stored without its icon (media fetch failed) is retried this soon
+MISSING_ICON_RETRY_SECONDS = float(os.getenv("STATIC_DATA_MISSING_ICON_RETRY", "3600"))
+# After a failed refresh, keep serving the older data this long before retrying
+RETRY_BACKOFF_SECONDS = float(os.getenv("STATIC_DATA_RETRY_BACKOFF", "300"))
+
+
+@dataclass
+class Snapshot:
+    classes: dict[int, dict]  # id -> {"id", "name", "icon"}
+    races: dict[int, dict]    # id -> {"id", "name"}
+    fetched_at: float         # oldest row, epoch seconds
+
+
+_snapshot: Optional[Snapshot] = None
+_flight = SingleFlight()
+_retry_after = 0.0  # epoch seconds; no refresh attempts before then
+
+
+def load() -> bool:
+    """Read the tables into memory. Returns False if they are still empty."""
+    global _snapshot
+    with Session(db.engine) as session:
+        classes = session.exec(select(db.PlayableClass)).all()
+        races = session.exec(select(db.PlayableRace)).all()
+    if not classes or not races:
+        _snapshot = None
+        return False
+    _snapshot = Snapshot(
+        classes={c.id: {"id": c.id, "name": c.name, "icon": c.icon} for c in classes},
+        races={r.id: {"id": r.id, "name": r.name} for r in races},
+        fetched_at=min(row.fetched_at for row in (*classes, *races)),
+    )
+    return True
+
+
+def clear() -> None:
+    """Forget the in-memory copy (tests, or after the tables were reset)."""
+    global _snapshot, _retry_after
+    _snapshot = None
+    _retry_after = 0.0
+
+
+def _store(classes: list[dict], races: list[dict]) -> None:
+    now = time.time()
+    with Session(db.engine) as session:
+        old_icons = {c.id: c.icon for c in session.exec(select(db.PlayableClass))}
+        session.execute(
+            delete(db.PlayableClass).where(db.PlayableClass.id.not_in([c["id"] for c in classes]))
+        )
+        session.execute(
+            delete(db.PlayableRace).where(db.PlayableRace.id.not_in([r["id"] for r in races]))
+        )
+        for c in classes:
+            icon = c["icon"] or old_icons.get(c["id"])
+            # Without an icon the row is not fresh: it ages out after the retry delay
+            fetched_at = now if icon else now - MAX_AGE_SECONDS + MISSING_ICON_RETRY_SECONDS
+            session.merge(db.PlayableClass(id=c["id"], name=c["name"], icon=icon, fetched_at=fetched_at))
+        for r in races:
+            session.merge(db.PlayableRace(id=r["id"], name=r["name"], fetched_at=now))
+        session.commit()
+
+
+async def _refresh() -> dict:
+    classes, races = await asyncio.gather(wow.get_classes_index(), wow.get_races_index())
+    await asyncio.to_thread(_store, classes, races)
+    await asyncio.to_thread(load)
+    logger.info("Refreshed %d playable classes and %d races.", len(classes), len(races))
+    return {"classes": len(classes), "races": len(races)}
+
+
+async def refresh() -> dict:
+    """Fetch classes and races from Blizzard and replace the stored copy."""
+    return await _flight.ado("refresh", _refresh)
+
+
+def _is_fresh() -> bool:
+    return _snapshot is not None and time.time() - _snapshot.fetched_at < MAX_AGE_SECONDS
+
+
+async def get() -> Snapshot:
+    """Current reference data, refreshing it first if missing or too old.
+
+    A failed refresh is only raised when there is nothing to fall back on;
+    otherwise the older data keeps being served.
+    """
+    global _retry_after
+    if _is_fresh():
+        return _snapshot  # type: ignore[return-value]
+    await asyncio.to_thread(load)
+    if _is_fresh() or (_snapshot is not None and time.time() < _retry_after):
+        return _snapshot  # type: ignore[return-value]
+    try:
+        await refresh()
+    except Exception as e:
+        if _snapshot is None:
+            raise
+        _retry_after = time.time() + RETRY_BACKOFF_SECONDS
+        logger.warning("Playable class/race refresh failed, keeping stored data: %s", e)
+    return _snapshot  # type: ignore[return-value]
+
+
+def status() -> dict:
+    if _snapshot is None:
+        return {"loaded": False}
+    return {
+        "loaded": True,
+        "classes": len(_snapshot.classes),
+        "races": len(_snapshot.races),
+        "age_seconds": round(time.time() - _snapshot.fetched_at),
+        "max_age_seconds": MAX_AGE_SECONDS,
+    }
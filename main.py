@@ -1,3 +1,4 @@
+import json
 import logging
 import logging.config
 import os
@@ -7,28 +8,33 @@ from typing import List, Optional, cast
 
 import urllib.parse
 
-from fastapi import Depends, FastAPI, HTTPException, Query, Request, status
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, status
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from slowapi.middleware import SlowAPIMiddleware
 from slowapi.util import get_remote_address
-from sqlalchemy import delete
 from sqlmodel import Session, select
 
+import lib.blizzard as blizzard
 import lib.bnet_oauth as bnet_oauth
 import lib.db as db
 import lib.events as events
 import lib.guild as guild
 import lib.instances as instances
+import lib.jobs as jobs
+import lib.roster as roster
 import lib.schemas as schema
 import lib.security as security
+import lib.static_data as static_data
 import lib.updater as updater
 import lib.wow as wow
 from lib.admin import setup_admin
+import lib.cache as cache
 from lib.cache import ttl_cache
 
 # ---------------------------------------------------------------------------
@@ -48,16 +54,26 @@ limiter = Limiter(key_func=get_remote_address)
 # ---------------------------------------------------------------------------
 # Cached Blizzard helpers (avoid hitting the API on every request)
 # ---------------------------------------------------------------------------
-@ttl_cache(ttl_seconds=300, key="wow_token")
+# Past the soft TTL the last value is served while a background worker
+# refreshes it; callers only block once stale_ttl has also run out. If Blizzard
+# is down (or its circuit is open) the last good value is served, marked stale.
+@ttl_cache(ttl_seconds=300, key="wow_token", stale_ttl=900, fallback_ttl=24 * 3600)
 def _get_wow_token_cached() -> str:
     return wow.get_wow_token()
 
 
-@ttl_cache(ttl_seconds=3600, key="guild_info")
+@ttl_cache(ttl_seconds=3600, key="guild_info", stale_ttl=3 * 3600, fallback_ttl=7 * 24 * 3600)
 def _get_guild_info_cached() -> dict:
     return guild.get_guild_info()
 
 
+def _mark_staleness(body: dict, cached: cache.CachedValue) -> dict:
+    body["stale"] = cached.stale
+    if cached.stale and cached.stored_at is not None:
+        body["as_of"] = datetime.fromtimestamp(cached.stored_at).astimezone()
+    return body
+
+
 # ---------------------------------------------------------------------------
 # App lifecycle
 # ---------------------------------------------------------------------------
@@ -83,7 +99,19 @@ async def lifespan(app: FastAPI):
                 instances.seed_from_yaml(session)
             else:
                 logger.info("Instance DB empty and no YAML archive found — run POST /admin/instances/seed after setup.")
+    if not static_data.load():
+        logger.info("No playable class/race data stored yet — fetched on the first roster update.")
+    try:
+        if abandoned := jobs.fail_abandoned():
+            logger.warning("Marked %d job(s) from a previous run as failed.", abandoned)
+    except Exception as e:
+        logger.warning("Could not check for abandoned jobs: %s", e)
+    roster.refresher.start()
     yield
+    roster.refresher.stop()
+    jobs.shutdown()
+    blizzard.close()
+    await blizzard.aclose()
     db.dispose_db()
     logger.info("Application shut down.")
 
@@ -140,18 +168,18 @@ def validate_password(passwd: str) -> Optional[str]:
     tags=["Auth"],
 )
 @limiter.limit(lambda: os.getenv("RATE_LIMIT_LOGIN", "10/minute"))
-def login_for_access_token(
+async def login_for_access_token(
     request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
     session: Session = Depends(db.get_session),
 ):
-    user = security.authenticate_user(form_data.username, form_data.password, session)
+    user = await security.aauthenticate_user(form_data.username, form_data.password, session)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
         )
-    access_token = security.create_access_token(subject=user.username)
+    access_token = security.create_user_token(user)
     return schema.Token(access_token=access_token, token_type="bearer")
 
 
@@ -195,16 +223,18 @@ def set_primary_character(
         raise HTTPException(404, "Character not found")
     if member.user_id != current_user.id:
         raise HTTPException(403, "That character does not belong to you")
-    current_user.primary_character_id = payload.character_id
-    session.add(current_user)
+    user = session.get(db.User, current_user.id)
+    user.primary_character_id = payload.character_id
+    session.add(user)
     session.commit()
-    session.refresh(current_user)
+    session.refresh(user)
+    security.invalidate_principal(user.username)
     return schema.UserRead(
-        id=cast(int, current_user.id),
-        username=current_user.username,
-        role=current_user.role,
-        battletag=current_user.bnet_battletag,
-        primary_character_id=current_user.primary_character_id,
+        id=cast(int, user.id),
+        username=user.username,
+        role=user.role,
+        battletag=user.bnet_battletag,
+        primary_character_id=user.primary_character_id,
     )
 
 
@@ -379,8 +409,9 @@ def bnet_callback(
             session.add(user)
 
         session.commit()
+        security.invalidate_principal(user.username)
 
-        jwt_token = security.create_access_token(subject=user.username)
+        jwt_token = security.create_user_token(user)
 
         if next_url:
             qs = urllib.parse.urlencode({"token": jwt_token, "battletag": battletag})
@@ -415,9 +446,9 @@ def read_token(
 ):
     security.ensure_authenticated_or_bootstrap(session, current_user)
     try:
-        price_copper = int(_get_wow_token_cached())
-        price_gold = price_copper // 10000
-        return {"price": f"{price_gold:,}"}
+        cached = _get_wow_token_cached.lookup()
+        price_gold = int(cached.value) // 10000
+        return _mark_staleness({"price": f"{price_gold:,}"}, cached)
     except Exception as e:
         raise HTTPException(502, str(e))
 
@@ -431,7 +462,8 @@ def read_guild(
 ):
     security.ensure_authenticated_or_bootstrap(session, current_user)
     try:
-        return _get_guild_info_cached()
+        cached = _get_guild_info_cached.lookup()
+        return _mark_staleness(dict(cached.value), cached)
     except Exception as e:
         raise HTTPException(502, str(e))
 
@@ -455,60 +487,44 @@ def read_roster(
     }
 
 
-def _do_update_roster(session: Session) -> dict:
-    result = guild.get_guild_roster()
-    roster = result["roster"]
-    incoming_ids = {m["id"] for m in roster}
-
-    # Null out primary_character_id for users whose main is leaving the guild
-    leaving = session.exec(
-        select(db.GuildMember).where(db.GuildMember.character_id.not_in(incoming_ids))
-    ).all()
-    leaving_ids = {gm.character_id for gm in leaving}
-    if leaving_ids:
-        affected_users = session.exec(
-            select(db.User).where(db.User.primary_character_id.in_(leaving_ids))
-        ).all()
-        for user in affected_users:
-            user.primary_character_id = None
-            session.add(user)
-        session.commit()
-
-    session.execute(delete(db.GuildMember))
-    session.commit()
-
-    for m in roster:
-        session.add(
-            db.GuildMember(
-                character_id=m["id"],
-                name=m["name"],
-                realm=m["realm"],
-                level=m["level"],
-                race=m["race"],
-                clazz=m["class"],
-                faction=m["faction"],
-                rank=m["rank"],
-                fetched_at=datetime.now().astimezone(),
-            )
-        )
-    session.commit()
-    logger.info("Roster updated: %d members.", len(roster))
-    return {"count": len(roster), "updated": datetime.now().astimezone()}
-
-
 @api_app.post(
     "/guild/roster/update",
-    summary="Fetch from Blizzard and upsert into Postgres",
+    summary="Queue a roster refresh from Blizzard as a background job",
     tags=["Guild"],
 )
-def update_roster(
+async def update_roster(
+    response: Response,
+    wait: bool = Query(False, description="Wait for the refresh and return its result"),
     session: Session = Depends(db.get_session),
     current_user: Optional[db.User] = Depends(security.get_optional_user),
 ):
-    security.ensure_authenticated_or_bootstrap(
-        session, current_user, required_roles={"owner", "administrator"}
+    """Returns the queued job (202); poll GET /admin/jobs/{id}. With ``wait=true``
+    the request blocks until that job (or the one already active) finishes and
+    returns its result instead."""
+    await run_in_threadpool(
+        security.ensure_authenticated_or_bootstrap,
+        session,
+        current_user,
+        required_roles={"owner", "administrator"},
     )
-    return _do_update_roster(session)
+    if wait:
+        job, _ = await run_in_threadpool(jobs.enqueue, "roster.update")
+        job = await run_in_threadpool(jobs.wait, job.id)
+        if job.status != jobs.SUCCEEDED:
+            raise HTTPException(502, job.error or "Roster refresh did not finish")
+        return json.loads(job.result)
+    response.status_code = status.HTTP_202_ACCEPTED
+    return await run_in_threadpool(_enqueue, "roster.update")
+
+
+@api_app.get(
+    "/guild/roster/update/status",
+    dependencies=[Depends(security.require_roles("owner", "administrator"))],
+    summary="State of the background roster refresher",
+    tags=["Guild"],
+)
+def roster_refresh_status():
+    return roster.refresher.status()
 
 
 @api_app.get("/guild/roster/{character_id}", summary="Get a single character by ID", tags=["Guild"])
@@ -527,7 +543,7 @@ def get_roster_id(
 # ---------------------------------------------------------------------------
 # User management endpoints
 # ---------------------------------------------------------------------------
-def _create_user_record(payload: schema.UserCreate, session: Session) -> db.User:
+def _check_new_user(payload: schema.UserCreate, session: Session) -> db.GuildMember:
     gm = session.get(db.GuildMember, payload.character_id)
     if not gm:
         raise HTTPException(404, "Character not found")
@@ -544,11 +560,15 @@ def _create_user_record(payload: schema.UserCreate, session: Session) -> db.User
     err = validate_password(payload.password)
     if err:
         raise HTTPException(400, err)
+    return gm
+
 
+def _store_new_user(
+    payload: schema.UserCreate, gm: db.GuildMember, hashed: str, session: Session
+) -> db.User:
     # First user ever always becomes owner regardless of requested role.
     role = "owner" if not security.users_exist(session) else payload.role
 
-    hashed = security.get_password_hash(payload.password)
     user = db.User(username=payload.username, password=hashed, role=role)
     session.add(user)
     session.commit()
@@ -569,15 +589,18 @@ def _create_user_record(payload: schema.UserCreate, session: Session) -> db.User
     summary="Create a user and link to a guild character",
     tags=["Users"],
 )
-def create_user(
+async def create_user(
     payload: schema.UserCreate,
     session: Session = Depends(db.get_session),
     current_user: Optional[db.User] = Depends(security.get_optional_user),
 ):
-    security.ensure_authenticated_or_bootstrap(
-        session, current_user, required_roles={"owner", "administrator"}
+    await run_in_threadpool(
+        security.ensure_authenticated_or_bootstrap,
+        session, current_user, required_roles={"owner", "administrator"},
     )
-    user = _create_user_record(payload, session)
+    gm = await run_in_threadpool(_check_new_user, payload, session)
+    hashed = await security.aget_password_hash(payload.password)
+    user = await run_in_threadpool(_store_new_user, payload, gm, hashed, session)
     assert user.id is not None, "New user must have an ID"
     return schema.UserRead(id=user.id, username=user.username, role=user.role)
 
@@ -617,20 +640,28 @@ def list_users(
     ]
 
 
-# ---------------------------------------------------------------------------
-# Admin endpoints
-# ---------------------------------------------------------------------------
 @api_app.post(
-    "/admin/db/create-maintainer",
-    response_model=schema.UserRead,
-    summary="Bootstrap-only: create a maintainer account with username/password (no BNet required)",
-    tags=["Admin"],
+    "/users/{user_id}/revoke-tokens",
+    summary="Log a user out everywhere by revoking all of their tokens (admin/owner only)",
+    tags=["Users"],
 )
-def create_maintainer(
-    payload: schema.MaintainerCreate,
+def revoke_user_tokens(
+    user_id: int,
     session: Session = Depends(db.get_session),
+    current_user: db.User = Depends(security.require_roles("owner", "administrator")),
 ):
-    """Creates an owner account with username/password login. Only works when no users exist."""
+    user = session.get(db.User, user_id)
+    if not user:
+        raise HTTPException(404, "User not found")
+    if user.role == "owner":
+        security.ensure_roles(current_user, {"owner"})
+    return {"status": "ok", "token_version": security.revoke_tokens(session, user)}
+
+
+# ---------------------------------------------------------------------------
+# Admin endpoints
+# ---------------------------------------------------------------------------
+def _check_new_maintainer(payload: schema.MaintainerCreate, session: Session) -> None:
     if security.users_exist(session):
         raise HTTPException(
             403, "Maintainer can only be created during bootstrap (before any users exist)"
@@ -645,12 +676,30 @@ def create_maintainer(
     if err:
         raise HTTPException(400, err)
 
-    hashed = security.get_password_hash(payload.password)
+
+def _store_maintainer(payload: schema.MaintainerCreate, hashed: str, session: Session) -> db.User:
     user = db.User(username=payload.username, password=hashed, role="owner")
     session.add(user)
     session.commit()
     session.refresh(user)
     logger.info("Maintainer account '%s' created.", user.username)
+    return user
+
+
+@api_app.post(
+    "/admin/db/create-maintainer",
+    response_model=schema.UserRead,
+    summary="Bootstrap-only: create a maintainer account with username/password (no BNet required)",
+    tags=["Admin"],
+)
+async def create_maintainer(
+    payload: schema.MaintainerCreate,
+    session: Session = Depends(db.get_session),
+):
+    """Creates an owner account with username/password login. Only works when no users exist."""
+    await run_in_threadpool(_check_new_maintainer, payload, session)
+    hashed = await security.aget_password_hash(payload.password)
+    user = await run_in_threadpool(_store_maintainer, payload, hashed, session)
     return schema.UserRead(id=cast(int, user.id), username=user.username, role=user.role)
 
 
@@ -673,26 +722,102 @@ def init_database():
 def reset_database():
     """WARNING: drops and recreates ALL tables."""
     db.reset_db()
+    security.invalidate_principal()
+    security.invalidate_revocations()
+    security.reset_bootstrap_state()
     logger.warning("Database reset by owner.")
     return {"status": "ok"}
 
 
 @api_app.post(
     "/admin/db/populate",
-    summary="Fetch roster and guild info from Blizzard and update the database",
+    response_model=schema.JobRead,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Queue a job that fetches roster and guild info from Blizzard into the database",
     tags=["Admin"],
 )
-def populate_database(
+async def populate_database(
+    session: Session = Depends(db.get_session),
+    current_user: Optional[db.User] = Depends(security.get_optional_user),
+):
+    await run_in_threadpool(
+        security.ensure_authenticated_or_bootstrap,
+        session,
+        current_user,
+        required_roles={"owner", "administrator"},
+    )
+    return await run_in_threadpool(_enqueue, "db.populate")
+
+
+@api_app.get(
+    "/admin/jobs",
+    response_model=list[schema.JobRead],
+    summary="List the most recent background jobs",
+    tags=["Admin"],
+)
+def list_jobs(
+    limit: int = Query(20, ge=1, le=100),
     session: Session = Depends(db.get_session),
     current_user: Optional[db.User] = Depends(security.get_optional_user),
 ):
     security.ensure_authenticated_or_bootstrap(
         session, current_user, required_roles={"owner", "administrator"}
     )
-    roster_result = _do_update_roster(session)
-    _get_guild_info_cached()
-    return {"status": "ok", "roster": roster_result}
+    return [jobs.to_dict(job) for job in jobs.recent(limit)]
+
+
+@api_app.get(
+    "/admin/jobs/{job_id}",
+    response_model=schema.JobRead,
+    summary="Status, progress and result of a background job",
+    tags=["Admin"],
+)
+def get_job(
+    job_id: str,
+    session: Session = Depends(db.get_session),
+    current_user: Optional[db.User] = Depends(security.get_optional_user),
+):
+    security.ensure_authenticated_or_bootstrap(
+        session, current_user, required_roles={"owner", "administrator"}
+    )
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return jobs.to_dict(job)
+
+
+@api_app.get(
+    "/admin/cache/stats",
+    dependencies=[Depends(security.require_roles("owner", "administrator"))],
+    summary="In-memory cache size and hit/miss counters per namespace",
+    tags=["Admin"],
+)
+def cache_stats():
+    return cache.stats()
+
 
+@api_app.get(
+    "/admin/blizzard/status",
+    dependencies=[Depends(security.require_roles("owner", "administrator"))],
+    summary="Blizzard API request budget, retries, circuits and conditional-request counters",
+    tags=["Admin"],
+)
+def blizzard_status():
+    return blizzard.status()
+
+
+@api_app.post(
+    "/admin/static-data/refresh",
+    dependencies=[Depends(security.require_roles("owner", "administrator"))],
+    summary="Re-fetch playable classes and races from Blizzard",
+    tags=["Admin"],
+)
+async def refresh_static_data():
+    try:
+        await static_data.refresh()
+    except Exception as e:
+        raise HTTPException(502, str(e))
+    return static_data.status()
 
 
 # ---------------------------------------------------------------------------
@@ -700,7 +825,8 @@ def populate_database(
 # ---------------------------------------------------------------------------
 @api_app.get(
     "/instances",
-    response_model=list[schema.InstanceRead],
+    response_model=list[schema.InstanceDetailRead],
+    response_model_exclude_unset=True,
     summary="List instances filtered by expansion, type, or current season",
     tags=["Instances"],
 )
@@ -708,11 +834,12 @@ def list_instances(
     expansion: Optional[str] = Query(None, description="Expansion name, e.g. 'The War Within'"),
     type: Optional[str] = Query(None, pattern="^(raid|dungeon)$"),
     current_season: bool = Query(False),
+    include_encounters: bool = Query(False, description="Embed each instance's boss encounters"),
     session: Session = Depends(db.get_session),
     current_user: Optional[db.User] = Depends(security.get_optional_user),
 ):
     security.ensure_authenticated_or_bootstrap(session, current_user)
-    return instances.get_instances(session, expansion, type, current_season)
+    return instances.get_instances(session, expansion, type, current_season, include_encounters)
 
 
 @api_app.get(
@@ -735,22 +862,85 @@ def get_instance(
 
 @api_app.post(
     "/admin/instances/seed",
+    response_model=schema.JobRead,
+    status_code=status.HTTP_202_ACCEPTED,
     dependencies=[Depends(security.require_roles("owner", "administrator"))],
-    summary="Fetch raids from Blizzard, archive to YAML, and seed the instance DB",
+    summary="Queue a job that fetches raids from Blizzard, archives to YAML, and seeds the instance DB",
     tags=["Admin"],
 )
 def seed_instances(
-    session: Session = Depends(db.get_session),
     expansion_id: Optional[int] = Query(None, description="Only fetch this journal-expansion ID"),
     current_season: bool = Query(True, description="Include current season raids"),
+    incremental: bool = Query(
+        True, description="Only refetch expansions and instances changed since the last seed"
+    ),
 ):
+    return _enqueue(
+        "instances.seed",
+        {"expansion_id": expansion_id, "current_season": current_season, "incremental": incremental},
+    )
+
+
+# ---------------------------------------------------------------------------
+# Background jobs
+# ---------------------------------------------------------------------------
+def _enqueue(kind: str, params: Optional[dict] = None) -> dict:
+    job, created = jobs.enqueue(kind, params)
+    if not created:
+        logger.info("Job %s already active as %s, not starting another.", kind, job.id)
+    return jobs.to_dict(job)
+
+
+@jobs.handler("roster.update")
+def _roster_update_job(ctx: jobs.JobContext, params: dict) -> dict:
+    ctx.progress(0, 1, "Fetching roster from Blizzard")
+    result = roster.refresher.run_now(wait=True)
+    ctx.progress(1, 1, "Done")
+    return result
+
+
+@jobs.handler("db.populate")
+def _populate_job(ctx: jobs.JobContext, params: dict) -> dict:
+    ctx.progress(0, 2, "Fetching roster from Blizzard")
+    roster_result = roster.refresher.run_now(wait=True)
+    ctx.progress(1, 2, "Fetching guild info")
+    _get_guild_info_cached()
+    ctx.progress(2, 2, "Done")
+    return {"status": "ok", "roster": roster_result}
+
+
+@jobs.handler("instances.seed")
+def _seed_job(ctx: jobs.JobContext, params: dict) -> dict:
     import lib.blizzard_journal as journal
-    raids = journal.generate_raids(
-        expansion_id=expansion_id,
-        include_current_season=current_season,
+
+    def _fetched(done: int, total: int) -> None:
+        ctx.progress(done, total, "Fetching raid instances")
+
+    ctx.note("Fetching journal index")
+    changes: dict = {}
+    raids, failures = blizzard.run(
+        journal.generate_raids,
+        expansion_id=params.get("expansion_id"),
+        include_current_season=params.get("current_season", True),
+        on_progress=_fetched,
+        incremental=params.get("incremental", True),
+        changes=changes,
     )
+    if not any(raids.values()):
+        # Seeding an empty plan would wipe the stored catalogue
+        errors = "; ".join(f"{f['kind']} {f['id']}: {f['error']}" for f in failures)
+        raise RuntimeError(f"No raid instances fetched, catalogue left unchanged. {errors}".strip())
+    ctx.note("Seeding instance DB")
+    with Session(db.engine) as session:
+        # Seed first: it carries stored rows for failed fetches into `raids`
+        result = instances.seed_from_data(
+            session, raids, journal.CURRENT_SEASON_RAID_IDS,
+            failures=failures, scope=changes.get("expansions"),
+        )
+    journal.save_fingerprints(changes.pop("fingerprints", {}))
     journal.write_raids_yaml(raids)
-    return instances.seed_from_data(session, raids, journal.CURRENT_SEASON_RAID_IDS)
+    result["changes"] = changes
+    return result
 
 
 # ---------------------------------------------------------------------------
@@ -71,6 +71,23 @@ def _get(base: str, path: str, token: str | None = None) -> dict:
     return _request("GET", base + path, token=token)
 
 
+def _wait_for_job(base: str, job: dict, token: str | None = None, interval: float = 2.0) -> dict:
+    """Poll a background job until it finishes; returns its result."""
+    last_message = None
+    while job["status"] in ("queued", "running"):
+        time.sleep(interval)
+        job = _get(base, f"/admin/jobs/{job['id']}", token=token)
+        message = job.get("message")
+        if message and message != last_message:
+            total = job.get("progress_total")
+            progress = f" ({job['progress_done']}/{total})" if total else ""
+            print(f"      {message}{progress}")
+            last_message = message
+    if job["status"] != "succeeded":
+        raise RuntimeError(f"Job {job['kind']} failed: {job.get('error')}")
+    return job.get("result") or {}
+
+
 def _login(base: str, username: str, password: str) -> str:
     body = urllib.parse.urlencode({"username": username, "password": password}).encode()
     req = urllib.request.Request(
@@ -259,7 +276,7 @@ def step_init_db(base: str) -> None:
 
 def step_populate(base: str) -> None:
     print("\n[2/4] Fetching guild roster from Blizzard...")
-    result = _post(base, "/admin/db/populate")
+    result = _wait_for_job(base, _post(base, "/admin/db/populate"))
     count = result.get("roster", {}).get("count", "?")
     print(f"      {count} members loaded.")
 
@@ -289,7 +306,9 @@ def step_create_maintainer(base: str) -> tuple[str, str]:
 def step_seed_instances(base: str, token: str) -> None:
     print("\n[4/4] Seeding raid instance data from Blizzard...")
     print("      This may take a moment...")
-    _post(base, "/admin/instances/seed", token=token)
+    result = _wait_for_job(base, _post(base, "/admin/instances/seed", token=token), token=token)
+    if result.get("failed"):
+        print(f"      {len(result['failed'])} fetch(es) failed; kept previous data for those.")
     print("      Done.")
 
 
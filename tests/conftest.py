@@ -8,11 +8,11 @@ import os
 
 os.environ.setdefault("JWT_SECRET_KEY", "test-secret-key-for-testing-only-32ch")
 os.environ["RATE_LIMIT_LOGIN"] = "10000/minute"  # disable effective rate limiting in tests
+os.environ.setdefault("BCRYPT_ROUNDS", "4")  # minimum cost; hashing speed is not under test
 
 import pytest
 from fastapi.testclient import TestClient
 from sqlmodel import Session, SQLModel, create_engine
-from sqlmodel.pool import StaticPool
 
 import lib.db as db
 from main import app, api_app
@@ -23,15 +23,17 @@ from main import app, api_app
 # ---------------------------------------------------------------------------
 
 @pytest.fixture(name="engine")
-def engine_fixture():
+def engine_fixture(tmp_path):
+    # A file DB with a real pool, so code running on worker threads (jobs,
+    # the roster refresher) gets its own connections, as in production
     _engine = create_engine(
-        "sqlite://",
+        f"sqlite:///{tmp_path / 'test.db'}",
         connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
     )
     SQLModel.metadata.create_all(_engine)
     yield _engine
     SQLModel.metadata.drop_all(_engine)
+    _engine.dispose()
 
 
 @pytest.fixture(name="session")
@@ -51,6 +53,18 @@ def client_fixture(session):
     api_app.dependency_overrides.clear()
 
 
+@pytest.fixture(autouse=True)
+def _fresh_auth_state():
+    """Every test starts in bootstrap mode with an empty principal cache
+    (each test has its own empty DB, and usernames repeat across tests)."""
+    from lib import security
+
+    security.invalidate_principal()
+    security.invalidate_revocations()
+    security.reset_bootstrap_state()
+    yield
+
+
 # ---------------------------------------------------------------------------
 # Helper factories
 # ---------------------------------------------------------------------------
@@ -18,6 +18,25 @@ def test_login_wrong_password(client, session):
     assert resp.status_code == 401
 
 
+def test_login_upgrades_outdated_password_hash(client, session):
+    import bcrypt
+
+    import lib.security as security
+
+    user = make_user(session)
+    cost = 5 if security.BCRYPT_ROUNDS != 5 else 6
+    user.password = bcrypt.hashpw(b"Test1234!", bcrypt.gensalt(rounds=cost)).decode()
+    session.add(user)
+    session.commit()
+    assert security.needs_rehash(user.password)
+
+    resp = client.post("/api/auth/token", data={"username": "testuser", "password": "Test1234!"})
+    assert resp.status_code == 200
+    session.refresh(user)
+    assert not security.needs_rehash(user.password)
+    assert security.verify_password("Test1234!", user.password)
+
+
 def test_login_unknown_user(client, session):
     make_user(session)
     resp = client.post("/api/auth/token", data={"username": "nobody", "password": "Test1234!"})
@@ -55,3 +74,213 @@ def test_admin_role(client, session):
     make_user(session, rank=1, username="officer")
     resp = client.get("/api/auth/me", headers=auth_headers(client, "officer"))
     assert resp.json()["role"] == "administrator"
+
+
+def test_principal_cached_between_requests(client, session, engine):
+    from sqlalchemy import event
+
+    make_user(session)
+    headers = auth_headers(client)
+    user_selects = []
+
+    def listener(conn, cursor, statement, *args):
+        if statement.startswith("SELECT") and "FROM user" in statement:
+            user_selects.append(statement)
+
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert client.get("/api/auth/me", headers=headers).status_code == 200
+        first = len(user_selects)
+        assert client.get("/api/auth/me", headers=headers).status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert first == 2  # the principal and the token revocation list
+    assert len(user_selects) == first
+
+
+def test_primary_character_change_refreshes_principal(client, session):
+    from tests.conftest import make_guild_member
+
+    user = make_user(session)
+    alt = make_guild_member(session, character_id=2, name="Alt")
+    alt.user_id = user.id
+    session.add(alt)
+    session.commit()
+    headers = auth_headers(client)
+    assert client.get("/api/auth/me", headers=headers).json()["primary_character_id"] is None
+
+    resp = client.patch("/api/auth/me/primary-character", json={"character_id": 2}, headers=headers)
+    assert resp.status_code == 200
+    assert client.get("/api/auth/me", headers=headers).json()["primary_character_id"] == 2
+
+
+def test_main_leaving_the_guild_refreshes_principal(client, session):
+    import lib.db as db
+    from lib.roster import store_roster
+    from tests.conftest import make_guild_member
+
+    user = make_user(session)
+    alt = make_guild_member(session, character_id=2, name="Alt")
+    alt.user_id = user.id
+    session.add(alt)
+    session.commit()
+    headers = auth_headers(client)
+    client.patch("/api/auth/me/primary-character", json={"character_id": 2}, headers=headers)
+    assert client.get("/api/auth/me", headers=headers).json()["primary_character_id"] == 2
+
+    member = session.get(db.GuildMember, 1)
+    store_roster(session, [{
+        "id": 1, "name": member.name, "realm": member.realm, "level": member.level,
+        "race": member.race, "class": member.clazz, "faction": member.faction, "rank": member.rank,
+    }])  # the alt left the guild
+    assert client.get("/api/auth/me", headers=headers).json()["primary_character_id"] is None
+
+
+def test_principal_cache_is_process_local(client, session):
+    import lib.cache as cache
+    import lib.security as security
+
+    def hits() -> int:
+        return security._auth_cache.stats()["namespaces"].get("principal", {}).get("hits", 0)
+
+    make_user(session)
+    headers = auth_headers(client)
+    before = hits()
+    assert client.get("/api/auth/me", headers=headers).status_code == 200
+    assert client.get("/api/auth/me", headers=headers).status_code == 200
+    assert hits() == before + 1
+    assert not {"principal", "token_revocations"} & cache.get_backend().stats()["namespaces"].keys()
+
+
+def test_token_embeds_claims_and_kid(client, session):
+    from jose import jwt
+
+    import lib.security as security
+
+    user = make_user(session, rank=1, username="officer")
+    token = auth_headers(client, "officer")["Authorization"].split()[1]
+    assert jwt.get_unverified_header(token)["kid"] == security.get_keyring().current_kid
+    claims = jwt.get_unverified_claims(token)
+    assert (claims["sub"], claims["uid"], claims["role"], claims["ver"]) == ("officer", user.id, "administrator", 0)
+
+
+def test_require_roles_authorises_without_db(client, session, engine):
+    from sqlalchemy import event
+
+    make_user(session, rank=0, username="gm")
+    headers = auth_headers(client, "gm")
+    client.get("/api/users", headers=headers)  # warm the revocation list
+    user_selects = []
+
+    def listener(conn, cursor, statement, *args):
+        if statement.startswith("SELECT") and "FROM user" in statement and "token_version >" not in statement:
+            user_selects.append(statement)
+
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        resp = client.post(
+            "/api/events",
+            json={"title": "Raid", "start_time": "2030-01-01T20:00:00Z", "end_time": "2030-01-01T23:00:00Z"},
+            headers=headers,
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert resp.status_code == 200, resp.text
+    assert user_selects == []
+
+
+def test_revoked_tokens_are_rejected(client, session):
+    make_user(session, rank=0, username="gm")
+    target = make_user(session, rank=2, username="member", character_id=2)
+    gm_headers = auth_headers(client, "gm")
+    old_headers = auth_headers(client, "member")
+    assert client.get("/api/auth/me", headers=old_headers).status_code == 200
+
+    resp = client.post(f"/api/users/{target.id}/revoke-tokens", headers=gm_headers)
+    assert resp.status_code == 200
+    assert resp.json()["token_version"] == 1
+    assert client.get("/api/auth/me", headers=old_headers).status_code == 401
+    assert client.get("/api/auth/me", headers=auth_headers(client, "member")).status_code == 200
+
+
+def test_previous_key_still_verifies_after_rotation(client, session, mocker):
+    import lib.security as security
+
+    make_user(session)
+    old_ring = security.KeyRing("HS256", security.SECRET_KEY, [security.SECRET_KEY])
+    mocker.patch.object(security, "_keyring", old_ring)
+    headers = auth_headers(client)
+
+    new_key = "a-fresh-signing-key-that-is-long-enough-0123"
+    mocker.patch.object(
+        security, "_keyring", security.KeyRing("HS256", new_key, [new_key, security.SECRET_KEY])
+    )
+    assert client.get("/api/auth/me", headers=headers).status_code == 200
+    mocker.patch.object(security, "_keyring", security.KeyRing("HS256", new_key, [new_key]))
+    assert client.get("/api/auth/me", headers=headers).status_code == 401
+
+
+def test_asymmetric_key_ring(tmp_path):
+    import rsa
+
+    import lib.security as security
+
+    public, private = rsa.newkeys(1024)
+    priv_file, pub_file = tmp_path / "jwt.pem", tmp_path / "jwt.pub"
+    priv_file.write_bytes(private.save_pkcs1())
+    pub_file.write_bytes(public.save_pkcs1())
+    ring = security.KeyRing("RS256", priv_file.read_text(), [pub_file.read_text()])
+    token = ring.encode({"sub": "someone"})
+    assert ring.decode(token)["sub"] == "someone"
+
+
+def test_oauth_state_shared_across_workers_and_consumed_once(engine):
+    import lib.bnet_oauth as bnet_oauth
+
+    login_worker = bnet_oauth.DatabaseStateStore(engine)
+    callback_worker = bnet_oauth.DatabaseStateStore(engine)
+    login_worker.put("abc", "https://example.test/done", ttl=60)
+
+    assert callback_worker.pop("abc") == {"next": "https://example.test/done"}
+    assert callback_worker.pop("abc") is None
+    assert login_worker.pop("abc") is None
+
+
+def test_oauth_state_expires_and_is_purged(engine):
+    from sqlmodel import Session, select
+
+    import lib.bnet_oauth as bnet_oauth
+    import lib.db as db
+
+    store = bnet_oauth.DatabaseStateStore(engine)
+    store.put("stale", None, ttl=-1)
+    store.put("other-stale", None, ttl=-1)
+    assert store.pop("stale") is None
+
+    store.put("fresh", None, ttl=60)  # purges what has expired
+    with Session(engine) as s:
+        assert [row.state for row in s.exec(select(db.OAuthState)).all()] == ["fresh"]
+
+    memory = bnet_oauth.MemoryStateStore()
+    memory.put("stale", None, ttl=-1)
+    memory.put("fresh", "/next", ttl=60)
+    assert list(memory._states) == ["fresh"]
+    assert memory.pop("fresh") == {"next": "/next"}
+
+
+def test_bnet_callback_rejects_reused_state(client, engine, mocker, monkeypatch):
+    import urllib.parse
+
+    import lib.bnet_oauth as bnet_oauth
+
+    monkeypatch.setenv("CLIENT_ID", "client")
+    mocker.patch.object(bnet_oauth, "_store", bnet_oauth.DatabaseStateStore(engine))
+    exchange = mocker.patch.object(bnet_oauth, "exchange_code", side_effect=RuntimeError("bnet down"))
+
+    resp = client.get("/api/auth/bnet/login", follow_redirects=False)
+    state = urllib.parse.parse_qs(urllib.parse.urlparse(resp.headers["location"]).query)["state"][0]
+
+    assert client.get(f"/api/auth/bnet/callback?code=c&state={state}").status_code == 502
+    resp = client.get(f"/api/auth/bnet/callback?code=c&state={state}")
+    assert resp.status_code == 400
+    assert exchange.call_count == 1
@@ -0,0 +1,892 @@
+"""Tests for the Blizzard API plumbing (token handling, HTTP client)."""
+
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+import httpx
+import pytest
+from sqlmodel import Session, select
+
+import lib.auth as auth
+import lib.blizzard as blizzard
+import lib.db as db
+from tests.conftest import make_user
+
+
+@pytest.fixture(name="token_db")
+def token_db_fixture(engine, mocker):
+    """Point lib.auth at the in-memory test engine."""
+    mocker.patch.object(db, "engine", engine)
+    return engine
+
+
+def _token_response(token: str, expires_in: int = 3600) -> MagicMock:
+    resp = MagicMock()
+    resp.json.return_value = {"access_token": token, "expires_in": expires_in}
+    return resp
+
+
+# ---------------------------------------------------------------------------
+# Unit: _TokenHolder
+# ---------------------------------------------------------------------------
+
+def test_token_holder_serves_from_memory(token_db, mocker):
+    post = mocker.patch("lib.auth.blizzard.request", return_value=_token_response("tok-1"))
+    load = mocker.spy(auth, "_load_stored_token")
+    holder = auth._TokenHolder(refresh_margin=60)
+
+    assert holder.get() == "tok-1"
+    assert holder.get() == "tok-1"
+    assert post.call_count == 1
+    assert load.call_count == 1  # only on the initial miss
+
+
+def test_token_holder_reuses_db_row_from_other_worker(token_db, mocker):
+    with db.Session(token_db) as session:
+        session.add(db.OAuthToken(id=1, access_token="shared", expires_at=time.time() + 3600))
+        session.commit()
+    post = mocker.patch("lib.auth.blizzard.request")
+    assert auth._TokenHolder(refresh_margin=60).get() == "shared"
+    post.assert_not_called()
+
+
+def test_token_holder_refreshes_proactively(token_db, mocker):
+    mocker.patch("lib.auth.blizzard.request", return_value=_token_response("tok-new"))
+    holder = auth._TokenHolder(refresh_margin=300)
+    holder._current = ("tok-old", time.time() + 100)  # valid, but inside the margin
+    assert holder.get() == "tok-new"
+
+
+def test_token_holder_keeps_valid_token_when_refresh_fails(token_db, mocker):
+    mocker.patch("lib.auth.blizzard.request", side_effect=RuntimeError("oauth down"))
+    holder = auth._TokenHolder(refresh_margin=300)
+    holder._current = ("tok-old", time.time() + 100)
+    assert holder.get() == "tok-old"
+
+
+def test_token_holder_single_flight_on_miss(token_db, mocker):
+    def slow_post(*args, **kwargs):
+        time.sleep(0.05)
+        return _token_response("tok-1")
+
+    post = mocker.patch("lib.auth.blizzard.request", side_effect=slow_post)
+    holder = auth._TokenHolder(refresh_margin=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(holder.get())) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["tok-1"] * 5
+    assert post.call_count == 1
+
+
+def test_token_holder_invalidate_skips_rejected_db_row(token_db, mocker):
+    mocker.patch(
+        "lib.auth.blizzard.request",
+        side_effect=[_token_response("tok-1"), _token_response("tok-2")],
+    )
+    holder = auth._TokenHolder(refresh_margin=60)
+    assert holder.get() == "tok-1"
+    holder.invalidate()
+    assert holder.get() == "tok-2"
+
+
+def test_api_get_retries_once_with_a_new_token_after_401(token_db, mocker):
+    holder = auth._TokenHolder(refresh_margin=60)
+    holder._current = ("tok-revoked", time.time() + 3600)
+    mocker.patch.object(auth, "_holder", holder)
+    mocker.patch("lib.auth._fetch_new_token", return_value=("tok-new", time.time() + 3600))
+    send = mocker.patch(
+        "lib.blizzard.request",
+        side_effect=[
+            httpx.Response(401, request=httpx.Request("GET", "https://x")),
+            httpx.Response(200, json={}, request=httpx.Request("GET", "https://x")),
+        ],
+    )
+
+    assert blizzard.api_get("/data/wow/token/", "dynamic-eu").status_code == 200
+    tokens = [call.kwargs["headers"]["Authorization"] for call in send.call_args_list]
+    assert tokens == ["Bearer tok-revoked", "Bearer tok-new"]
+    holder.invalidate("tok-revoked")  # a late 401 for the old token keeps the new one
+    assert holder.peek() == "tok-new"
+
+
+# ---------------------------------------------------------------------------
+# Unit: shared client
+# ---------------------------------------------------------------------------
+
+def test_client_is_shared_and_pooled():
+    blizzard.close()
+    client = blizzard.get_client()
+    assert blizzard.get_client() is client
+    assert client.timeout.connect is not None
+    blizzard.close()
+    assert blizzard.get_client() is not client
+    blizzard.close()
+
+
+def test_http2_requires_opt_in(monkeypatch):
+    monkeypatch.delenv("BLIZZARD_HTTP2", raising=False)
+    assert blizzard._http2_enabled() is False
+
+
+def test_api_get_sends_namespace_locale_and_bearer(mocker):
+    mocker.patch("lib.auth.get_access_token", return_value="tok")
+    send = mocker.patch("lib.blizzard.request")
+    blizzard.api_get("/data/wow/token/", "dynamic-eu", params={"x": 1})
+    method, url = send.call_args[0]
+    kwargs = send.call_args[1]
+    assert (method, url) == ("GET", blizzard.API_BASE + "/data/wow/token/")
+    assert kwargs["params"] == {"namespace": "dynamic-eu", "locale": blizzard.LOCALE, "x": 1}
+    assert kwargs["headers"] == {"Authorization": "Bearer tok"}
+
+
+# ---------------------------------------------------------------------------
+# Unit: async roster pipeline
+# ---------------------------------------------------------------------------
+
+_FAKE_API = {
+    "/data/wow/playable-class/index": {"classes": [{"id": 1, "name": "Warrior"}]},
+    "/data/wow/media/playable-class/1": {"assets": [{"key": "icon", "value": "warrior.jpg"}]},
+    "/data/wow/playable-race/index": {"races": [{"id": 2, "name": "Orc"}]},
+}
+
+
+async def _fake_aapi_get_json(path, namespace, *args, **kwargs):
+    if path.endswith("/roster"):
+        return {
+            "members": [
+                {
+                    "rank": 0,
+                    "character": {
+                        "id": 10,
+                        "name": "Thrall",
+                        "realm": {"slug": "draenor"},
+                        "level": 80,
+                        "playable_class": {"id": 1},
+                        "playable_race": {"id": 2},
+                        "faction": {"type": "HORDE"},
+                    },
+                },
+                {"rank": 3, "character": {"name": "NoId"}},
+            ]
+        }
+    return _FAKE_API[path]
+
+
+@pytest.fixture(name="reference_data")
+def reference_data_fixture(token_db):
+    import lib.static_data as static_data
+
+    static_data.clear()
+    yield static_data
+    static_data.clear()
+
+
+def test_get_guild_roster_async(reference_data, mocker):
+    import lib.guild as guild
+
+    mocker.patch("lib.blizzard.aapi_get_json", side_effect=_fake_aapi_get_json)
+    roster = blizzard.run(guild.get_guild_roster)["roster"]
+    assert roster == [
+        {
+            "id": 10,
+            "name": "Thrall",
+            "realm": "draenor",
+            "level": 80,
+            "class": "Warrior",
+            "race": "Orc",
+            "faction": "HORDE",
+            "rank": 0,
+        }
+    ]
+    assert blizzard._async_clients == {}  # run() closes its loop's client
+
+
+def test_roster_refresh_reuses_stored_reference_data(reference_data, mocker):
+    import lib.guild as guild
+
+    fetch = mocker.patch("lib.blizzard.aapi_get_json", side_effect=_fake_aapi_get_json)
+    blizzard.run(guild.get_guild_roster)
+    assert fetch.call_count == 4  # roster + class index + class media + race index
+
+    # A new worker loads the stored tables instead of calling Blizzard again
+    reference_data.clear()
+    fetch.reset_mock()
+    roster = blizzard.run(guild.get_guild_roster)["roster"]
+    assert fetch.call_count == 1
+    assert roster[0]["class"] == "Warrior"
+    assert reference_data.status()["classes"] == 1
+
+
+def test_stale_reference_data_kept_when_refresh_fails(reference_data, mocker):
+    mocker.patch("lib.blizzard.aapi_get_json", side_effect=_fake_aapi_get_json)
+    blizzard.run(reference_data.get)
+
+    mocker.patch.object(reference_data, "MAX_AGE_SECONDS", 0)
+    mocker.patch("lib.blizzard.aapi_get_json", side_effect=RuntimeError("blizzard down"))
+    snapshot = blizzard.run(reference_data.get)
+    assert snapshot.classes[1]["icon"] == "warrior.jpg"
+
+    # Backing off: the next callers do not hit Blizzard again right away
+    failing = mocker.patch("lib.blizzard.aapi_get_json", side_effect=RuntimeError("blizzard down"))
+    blizzard.run(reference_data.get)
+    failing.assert_not_called()
+
+
+def test_missing_class_icon_is_not_stored_as_fresh(reference_data, mocker):
+    async def no_media(path, *args, **kwargs):
+        if path.startswith("/data/wow/media/"):
+            raise httpx.ConnectError("media down")
+        return await _fake_aapi_get_json(path, *args, **kwargs)
+
+    mocker.patch("lib.blizzard.aapi_get_json", side_effect=_fake_aapi_get_json)
+    blizzard.run(reference_data.refresh)
+    mocker.patch("lib.blizzard.aapi_get_json", side_effect=no_media)
+    blizzard.run(reference_data.refresh)
+    assert reference_data._snapshot.classes[1]["icon"] == "warrior.jpg"  # previous icon kept
+
+    reference_data.clear()
+    mocker.patch.object(reference_data, "MISSING_ICON_RETRY_SECONDS", 0)
+    with Session(db.engine) as s:
+        s.get(db.PlayableClass, 1).icon = None
+        s.commit()
+    blizzard.run(reference_data.refresh)
+    assert reference_data._snapshot.classes[1]["icon"] is None
+    assert not reference_data._is_fresh()  # due again after MISSING_ICON_RETRY_SECONDS
+
+
+# ---------------------------------------------------------------------------
+# Unit: rate limiter
+# ---------------------------------------------------------------------------
+
+def test_rate_limiter_reserves_without_holding_lock(mocker):
+    from lib.ratelimit import RateLimiter, TokenBucket
+
+    sleep = mocker.patch("lib.ratelimit.time.sleep")
+    limiter = RateLimiter({"second": TokenBucket(rate=2, capacity=2)})
+    delays = [limiter.reserve() for _ in range(4)]
+    assert delays[:2] == [0.0, 0.0]
+    # Over-budget callers queue in arrival order instead of all waking at once
+    assert delays[2] == pytest.approx(0.5, abs=0.01)
+    assert delays[3] == pytest.approx(1.0, abs=0.01)
+    assert not limiter._lock.locked()
+
+    limiter.acquire()
+    sleep.assert_called_once()
+    assert limiter.snapshot()["throttled"] == 3
+
+
+def test_rate_limiter_enforces_every_bucket():
+    from lib.ratelimit import RateLimiter, TokenBucket
+
+    limiter = RateLimiter(
+        {"second": TokenBucket(rate=100, capacity=100), "hour": TokenBucket(rate=1, capacity=1)}
+    )
+    assert limiter.reserve() == 0.0
+    assert limiter.reserve() == pytest.approx(1.0, abs=0.01)
+    buckets = limiter.snapshot()["buckets"]
+    assert buckets["hour"]["remaining"] == 0
+    assert buckets["second"]["remaining"] == 98
+
+
+def test_async_rate_limiter_does_not_block_loop(mocker):
+    import asyncio
+
+    from lib.ratelimit import RateLimiter, TokenBucket
+
+    limiter = RateLimiter({"second": TokenBucket(rate=1000, capacity=1)})
+    blocking_sleep = mocker.patch("lib.ratelimit.time.sleep")
+
+    async def main():
+        await asyncio.gather(*(limiter.aacquire() for _ in range(3)))
+
+    asyncio.run(main())
+    blocking_sleep.assert_not_called()
+    assert limiter.snapshot()["acquired"] == 3
+
+
+def test_requests_consume_shared_budget(mocker):
+    mocker.patch.object(blizzard.httpx.Client, "request", return_value=_http_response(200))
+    before = blizzard.rate_limit_status()["acquired"]
+    blizzard.request("GET", "https://example.invalid")
+    assert blizzard.rate_limit_status()["acquired"] == before + 1
+    blizzard.close()
+
+
+# ---------------------------------------------------------------------------
+# Unit: retries
+# ---------------------------------------------------------------------------
+
+def _http_response(status: int, headers: dict | None = None) -> httpx.Response:
+    return httpx.Response(status, headers=headers, request=httpx.Request("GET", "https://x"))
+
+
+def test_request_retries_transient_errors(mocker):
+    send = mocker.patch.object(
+        blizzard.httpx.Client,
+        "request",
+        side_effect=[
+            httpx.ConnectTimeout("slow"),
+            _http_response(503),
+            _http_response(200),
+        ],
+    )
+    sleep = mocker.patch("lib.blizzard.time.sleep")
+    policy = blizzard.RetryPolicy(attempts=3, base_delay=0.1, max_delay=1, budget=10)
+    resp = blizzard.request("GET", "https://x", retry=policy)
+    assert resp.status_code == 200
+    assert send.call_count == 3
+    assert sleep.call_count == 2
+    assert policy.stats() == {"retries": 2, "exhausted": 0}
+    blizzard.close()
+
+
+def test_request_honours_retry_after(mocker):
+    mocker.patch.object(
+        blizzard.httpx.Client,
+        "request",
+        side_effect=[_http_response(429, {"Retry-After": "2"}), _http_response(200)],
+    )
+    sleep = mocker.patch("lib.blizzard.time.sleep")
+    blizzard.request("GET", "https://x", retry=blizzard.RetryPolicy(attempts=1, budget=10))
+    sleep.assert_called_once_with(2.0)
+    blizzard.close()
+
+
+def test_request_gives_up_when_budget_spent(mocker):
+    send = mocker.patch.object(
+        blizzard.httpx.Client,
+        "request",
+        return_value=_http_response(429, {"Retry-After": "60"}),
+    )
+    sleep = mocker.patch("lib.blizzard.time.sleep")
+    policy = blizzard.RetryPolicy(attempts=5, budget=30)
+    resp = blizzard.request("GET", "https://x", retry=policy)
+    assert resp.status_code == 429
+    assert send.call_count == 1
+    sleep.assert_not_called()
+    assert policy.stats()["exhausted"] == 1
+    blizzard.close()
+
+
+def test_request_does_not_retry_client_errors(mocker):
+    send = mocker.patch.object(blizzard.httpx.Client, "request", return_value=_http_response(404))
+    assert blizzard.request("GET", "https://x").status_code == 404
+    assert send.call_count == 1
+    blizzard.close()
+
+
+def test_generate_raids_reports_failed_instances(mocker):
+    import lib.blizzard_journal as journal
+
+    async def fake_get(path, namespace, locale, params=None, **kwargs):
+        if path == "/data/wow/journal-expansion/index":
+            return {"tiers": [{"id": 1, "name": "Old"}, {"id": 2, "name": "Broken"}]}
+        if path == "/data/wow/journal-expansion/1":
+            return {"name": "Old", "raids": [{"id": 10}, {"id": 11}]}
+        if path == "/data/wow/journal-expansion/2":
+            raise httpx.HTTPStatusError("503", request=None, response=_http_response(503))
+        if path == "/data/wow/journal-instance/11":
+            raise httpx.ConnectTimeout("slow")
+        if path == "/data/wow/journal-instance/10":
+            return {"name": "Raid Ten", "encounters": []}
+        return {}
+
+    mocker.patch("lib.blizzard.aapi_get_json", side_effect=fake_get)
+    raids, failures = blizzard.run(journal.generate_raids, include_current_season=False)
+    assert list(raids["Old"]) == [10]
+    assert {(f["kind"], f["id"]) for f in failures} == {("expansion", 2), ("instance", 11)}
+    assert next(f for f in failures if f["kind"] == "expansion")["name"] == "Broken"
+
+
+# ---------------------------------------------------------------------------
+# Unit: instance seeding / journal
+# ---------------------------------------------------------------------------
+
+def test_fetch_raid_instance_fetches_encounters_concurrently(mocker):
+    import lib.blizzard_journal as journal
+
+    in_flight = peak = 0
+
+    async def fake_get(path, namespace, locale, params=None, **kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        # Later bosses answer first; the result must keep API order
+        eid = int(path.rsplit("/", 1)[-1])
+        await asyncio.sleep(0.01 * (5 - eid % 5))
+        in_flight -= 1
+        if path == "/data/wow/journal-instance/99":
+            return {"name": "Raid", "encounters": [{"id": i, "name": f"Boss {i}"} for i in (1, 2, 3)]}
+        if path.startswith("/data/wow/journal-encounter/"):
+            return {"creatures": [{"creature_display": {"id": 100 + eid}}]}
+        if path.startswith("/data/wow/media/creature-display/"):
+            return {"assets": [{"key": "zoom", "value": f"img-{eid}"}]}
+        return {"assets": []}
+
+    mocker.patch("lib.blizzard.aapi_get_json", side_effect=fake_get)
+    journal._media_cache.clear()
+    raid = blizzard.run(journal.fetch_raid_instance, 99)
+    assert [e["name"] for e in raid["encounters"]] == ["Boss 1", "Boss 2", "Boss 3"]
+    assert [e["img"] for e in raid["encounters"]] == ["img-101", "img-102", "img-103"]
+    assert peak >= 3
+
+
+def test_seed_keeps_stored_rows_for_failed_fetches(session):
+    import lib.instances as instances
+
+    instances.seed_from_data(
+        session,
+        {
+            "Old": {
+                10: {"blizzard-id": 10, "name": "Raid Ten", "encounters": []},
+                11: {"blizzard-id": 11, "name": "Raid Eleven",
+                     "encounters": [{"blizzard-id": 5, "name": "Boss"}]},
+            },
+            "Broken": {20: {"blizzard-id": 20, "name": "Raid Twenty", "encounters": []}},
+        },
+        set(),
+    )
+    result = instances.seed_from_data(
+        session,
+        {"Old": {10: {"blizzard-id": 10, "name": "Raid Ten v2", "encounters": []}}},
+        set(),
+        failures=[
+            {"kind": "expansion", "id": 2, "name": "Broken", "error": "503"},
+            {"kind": "instance", "id": 11, "name": None, "error": "timeout"},
+        ],
+    )
+    assert sorted(result["kept"]) == [11, 20]
+    assert result["instances"] == 3
+    assert instances.get_instance(session, 10)["name"] == "Raid Ten v2"
+    assert [e["name"] for e in instances.get_instance(session, 11)["encounters"]] == ["Boss"]
+    assert instances.get_instance(session, 20)["expansion"] == "Broken"
+
+
+def test_seed_upserts_in_bulk(engine, session):
+    from sqlalchemy import event
+
+    import lib.instances as instances
+
+    raids = {
+        f"Exp {x}": {
+            x * 10 + i: {
+                "blizzard-id": x * 10 + i,
+                "name": f"Raid {x}{i}",
+                "encounters": [{"blizzard-id": x * 100 + i * 10 + b, "name": f"Boss {b}"} for b in range(5)],
+            }
+            for i in range(4)
+        }
+        for x in range(1, 4)
+    }
+    statements = []
+
+    def _seed(data):
+        statements.clear()
+        listener = lambda *args: statements.append(args[2].split()[0])  # noqa: E731
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            return instances.seed_from_data(session, data, {11})
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+
+    result = _seed(raids)
+    assert result == {"instances": 12, "encounters": 60, "unchanged": 0}
+    # One statement per table and step, however large the catalogue
+    assert statements.count("INSERT") == 3
+    inst = instances.get_instance(session, 12)
+    assert inst["expansion"] == "Exp 1"
+    assert [e["name"] for e in inst["encounters"]] == [f"Boss {b}" for b in range(5)]
+    assert instances.get_instance(session, 11)["is_current_season"]
+
+    # Same data again: nothing to write
+    assert _seed(raids)["unchanged"] == 12
+    assert "INSERT" not in statements and "UPDATE" not in statements
+
+
+def test_reseed_keeps_row_identity(session):
+    import lib.instances as instances
+
+    def _raid(bid, name, bosses):
+        return {"blizzard-id": bid, "name": name,
+                "encounters": [{"blizzard-id": b, "name": f"Boss {b}"} for b in bosses]}
+
+    instances.seed_from_data(
+        session, {"Old": {10: _raid(10, "Ten", [1, 2]), 11: _raid(11, "Eleven", [3])}}, set()
+    )
+    ten = session.exec(select(db.Instance).where(db.Instance.blizzard_id == 10)).one()
+    boss_one = session.exec(select(db.Encounter).where(db.Encounter.blizzard_id == 1)).one()
+    creator = make_user(session, username="raidlead")
+    event_row = db.Event(
+        title="Raid night", start_time=datetime(2026, 1, 1, 20, tzinfo=timezone.utc),
+        end_time=datetime(2026, 1, 1, 23, tzinfo=timezone.utc),
+        created_by=creator.id, instance_blizzard_id=11,
+    )
+    session.add(event_row)
+    session.commit()
+
+    instances.seed_from_data(
+        session, {"Old": {10: _raid(10, "Ten v2", [2, 1]), 12: _raid(12, "Twelve", [])}}, set()
+    )
+    session.expire_all()
+    renamed = session.get(db.Instance, ten.id)
+    assert (renamed.name, renamed.blizzard_id) == ("Ten v2", 10)
+    assert session.get(db.Encounter, boss_one.id).sort_order == 1
+    assert instances.get_instance(session, 11) is None
+    assert session.get(db.Event, event_row.id).instance_blizzard_id is None
+    assert [e.name for e in session.exec(select(db.Expansion))] == ["Old"]
+
+
+def test_seeding_one_expansion_leaves_the_others_alone(session):
+    import lib.instances as instances
+
+    def _raid(bid):
+        return {"blizzard-id": bid, "name": f"Raid {bid}", "encounters": [{"blizzard-id": bid * 10, "name": "Boss"}]}
+
+    instances.seed_from_data(session, {"Old": {10: _raid(10)}, "New": {20: _raid(20)}}, set())
+    creator = make_user(session, username="raidlead")
+    event_row = db.Event(
+        title="Raid night", start_time=datetime(2026, 1, 1, 20, tzinfo=timezone.utc),
+        end_time=datetime(2026, 1, 1, 23, tzinfo=timezone.utc),
+        created_by=creator.id, instance_blizzard_id=10,
+    )
+    session.add(event_row)
+    session.commit()
+
+    instances.seed_from_data(session, {"New": {21: _raid(21)}}, set())
+    session.expire_all()
+    assert instances.get_instance(session, 10)["encounters"][0]["name"] == "Boss"
+    assert session.get(db.Event, event_row.id).instance_blizzard_id == 10
+    assert instances.get_instance(session, 20) is None
+    assert sorted(e.name for e in session.exec(select(db.Expansion))) == ["New", "Old"]
+
+    # A fetched expansion that is now empty goes, unless it still owns a dungeon
+    old = session.exec(select(db.Expansion).where(db.Expansion.name == "Old")).one()
+    session.add(db.Instance(blizzard_id=99, expansion_id=old.id, name="Dungeon", instance_type="dungeon"))
+    session.commit()
+    instances.seed_from_data(session, {"Old": {}, "New": {}}, set())
+    session.expire_all()
+    assert instances.get_instance(session, 10) is None
+    assert [e.name for e in session.exec(select(db.Expansion))] == ["Old"]
+
+
+def test_list_instances_loads_encounters_in_one_query(client, engine, session):
+    from sqlalchemy import event
+
+    import lib.instances as instances
+
+    instances.seed_from_data(session, {
+        "Old": {
+            bid: {"blizzard-id": bid, "name": f"Raid {bid}",
+                  "encounters": [{"blizzard-id": bid * 10 + b, "name": f"Boss {b}"} for b in range(3)]}
+            for bid in (1, 2, 3)
+        },
+    }, set())
+
+    selects = []
+    listener = lambda *args: selects.append(args[2]) if args[2].startswith("SELECT") else None  # noqa: E731
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        resp = client.get("/api/instances?include_encounters=true")
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert resp.status_code == 200
+    body = resp.json()
+    assert [e["name"] for e in body[1]["encounters"]] == ["Boss 0", "Boss 1", "Boss 2"]
+    assert sum("FROM encounter" in q for q in selects) == 1
+
+    assert "encounters" not in client.get("/api/instances").json()[0]
+
+
+def test_incremental_generate_skips_unchanged_documents(token_db, session, mocker):
+    import lib.blizzard_journal as journal
+    import lib.instances as instances
+
+    docs = {
+        "/data/wow/journal-expansion/index": {"tiers": [{"id": 1, "name": "Old"}]},
+        "/data/wow/journal-expansion/1": {
+            "name": "Old", "raids": [{"id": 10}],
+            "_links": {"self": {"href": "...?namespace=static-11.0.0"}},
+        },
+        "/data/wow/journal-instance/10": {"name": "Raid Ten", "encounters": [{"id": 5, "name": "Boss"}]},
+        "/data/wow/journal-instance/11": {"name": "Raid Eleven", "encounters": []},
+    }
+    calls = []
+
+    async def fake_get(path, namespace, locale, params=None, **kwargs):
+        calls.append(path)
+        return docs.get(path, {})
+
+    mocker.patch("lib.blizzard.aapi_get_json", side_effect=fake_get)
+
+    def _seed(**kwargs):
+        calls.clear()
+        changes: dict = {}
+        raids, failures = blizzard.run(
+            journal.generate_raids, include_current_season=False, changes=changes, **kwargs
+        )
+        instances.seed_from_data(session, raids, set(), failures=failures)
+        journal.save_fingerprints(changes.pop("fingerprints"))
+        return changes
+
+    assert _seed()["added"] == [10]
+
+    # Nothing changed (a patch only bumps the namespace in links): index + expansion only
+    docs["/data/wow/journal-expansion/1"]["_links"]["self"]["href"] = "...?namespace=static-11.0.5"
+    changes = _seed(incremental=True)
+    assert calls == ["/data/wow/journal-expansion/index", "/data/wow/journal-expansion/1"]
+    assert changes == {"added": [], "changed": [], "removed": [], "unchanged": 1, "expansions": ["Old"]}
+
+    # A new raid: the unchanged one is revalidated but its encounters are not refetched
+    docs["/data/wow/journal-expansion/1"]["raids"] = [{"id": 11}, {"id": 10}]
+    changes = _seed(incremental=True)
+    assert "/data/wow/journal-encounter/5" not in calls
+    assert changes["added"] == [11] and changes["unchanged"] == 1
+    assert [e["name"] for e in instances.get_instance(session, 10)["encounters"]] == ["Boss"]
+
+    docs["/data/wow/journal-expansion/1"]["raids"] = [{"id": 11}]
+    assert _seed(incremental=True)["removed"] == [10]
+
+
+def test_filtered_generate_reports_only_its_expansion(token_db, session, mocker):
+    import lib.blizzard_journal as journal
+    import lib.instances as instances
+
+    instances.seed_from_data(session, {
+        "Old": {10: {"blizzard-id": 10, "name": "Raid Ten", "encounters": []}},
+        "New": {20: {"blizzard-id": 20, "name": "Raid Twenty", "encounters": []}},
+    }, set())
+    docs = {
+        "/data/wow/journal-expansion/index": {"tiers": [{"id": 1, "name": "Old"}, {"id": 2, "name": "New"}]},
+        "/data/wow/journal-expansion/2": {"name": "New", "raids": [{"id": 21}]},
+        "/data/wow/journal-instance/21": {"name": "Raid Twenty-One", "encounters": []},
+    }
+
+    async def fake_get(path, namespace, locale, params=None, **kwargs):
+        return docs.get(path, {})
+
+    mocker.patch("lib.blizzard.aapi_get_json", side_effect=fake_get)
+    changes: dict = {}
+    blizzard.run(journal.generate_raids, expansion_id=2, include_current_season=False, changes=changes)
+    assert (changes["added"], changes["removed"], changes["expansions"]) == ([21], [20], ["New"])
+
+
+def test_seed_job_fails_without_touching_catalogue_for_unknown_expansion(token_db, session, mocker):
+    import lib.blizzard_journal as journal
+    import lib.instances as instances
+    import main
+
+    instances.seed_from_data(
+        session, {"Old": {10: {"blizzard-id": 10, "name": "Raid Ten", "encounters": []}}}, set()
+    )
+
+    async def fake_get(path, namespace, locale, params=None, **kwargs):
+        return {"tiers": [{"id": 1, "name": "Old"}]}
+
+    mocker.patch("lib.blizzard.aapi_get_json", side_effect=fake_get)
+    changes: dict = {}
+    raids, failures = blizzard.run(journal.generate_raids, expansion_id=99, changes=changes)
+    assert failures[0]["id"] == 99 and changes["fingerprints"] == {}
+
+    with pytest.raises(RuntimeError, match="No raid instances fetched"):
+        main._seed_job(MagicMock(), {"expansion_id": 99, "incremental": True})
+    assert instances.get_instance(session, 10)["name"] == "Raid Ten"
+
+
+# ---------------------------------------------------------------------------
+# Unit: circuit breaker
+# ---------------------------------------------------------------------------
+
+def test_circuit_opens_then_probes(mocker):
+    from lib.circuit import CircuitBreaker, CircuitOpenError
+
+    clock = mocker.patch("lib.circuit.time.monotonic", return_value=100.0)
+    breaker = CircuitBreaker("upstream", failure_threshold=2, recovery_timeout=30)
+    breaker.allow()
+    breaker.record_failure()
+    breaker.allow()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    clock.return_value = 131.0
+    breaker.allow()  # the probe
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()  # only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    clock.return_value = 162.0
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.snapshot() == {"state": "closed", "consecutive_failures": 0, "rejected": 2}
+
+
+def test_request_fails_fast_when_circuit_open(mocker):
+    send = mocker.patch.object(blizzard.httpx.Client, "request", return_value=_http_response(503))
+    mocker.patch("lib.blizzard.time.sleep")
+    url = "https://circuit-test.invalid/x"
+    blizzard._breakers.pop("circuit-test.invalid", None)
+    policy = blizzard.RetryPolicy(attempts=10, base_delay=0, budget=10)
+
+    with pytest.raises(blizzard.CircuitOpenError):
+        blizzard.request("GET", url, retry=policy)
+    assert send.call_count == blizzard.CIRCUIT_FAILURES
+    with pytest.raises(blizzard.CircuitOpenError):
+        blizzard.request("GET", url)
+    assert send.call_count == blizzard.CIRCUIT_FAILURES
+    assert blizzard.status()["circuits"]["circuit-test.invalid"]["state"] == "open"
+    blizzard._breakers.pop("circuit-test.invalid")
+    blizzard.close()
+
+
+# ---------------------------------------------------------------------------
+# Unit: conditional requests
+# ---------------------------------------------------------------------------
+
+def test_conditional_get_revalidates_stored_copy(token_db, mocker):
+    mocker.patch("lib.auth.get_access_token", return_value="tok")
+    send = mocker.patch(
+        "lib.blizzard.request",
+        side_effect=[
+            httpx.Response(200, json={"name": "Nerub-ar Palace"},
+                           headers={"Last-Modified": "Tue, 01 Oct 2024 00:00:00 GMT"},
+                           request=httpx.Request("GET", "https://x")),
+            httpx.Response(304, request=httpx.Request("GET", "https://x")),
+        ],
+    )
+    path = "/data/wow/journal-instance/1273"
+    first = blizzard.api_get_json(path, "static-eu", conditional=True)
+    second = blizzard.api_get_json(path, "static-eu", conditional=True)
+
+    assert first == second == {"name": "Nerub-ar Palace"}
+    assert "If-Modified-Since" not in send.call_args_list[0][1]["headers"]
+    assert send.call_args_list[1][1]["headers"]["If-Modified-Since"] == "Tue, 01 Oct 2024 00:00:00 GMT"
+
+
+def test_not_modified_touches_stored_fetched_at(token_db, mocker):
+    mocker.patch("lib.auth.get_access_token", return_value="tok")
+    mocker.patch(
+        "lib.blizzard.request",
+        side_effect=[
+            httpx.Response(200, json={"v": 1}, headers={"ETag": '"abc"'},
+                           request=httpx.Request("GET", "https://x")),
+            httpx.Response(304, request=httpx.Request("GET", "https://x")),
+        ],
+    )
+    path = "/data/wow/playable-class/index"
+    blizzard.api_get_json(path, "static-eu", conditional=True)
+    key = blizzard._store_key(path, "static-eu", None, None)
+    with Session(db.engine) as s:
+        s.get(db.BlizzardResponse, key).fetched_at = 1.0
+        s.commit()
+
+    blizzard.api_get_json(path, "static-eu", conditional=True)
+    assert blizzard._load_response(key).fetched_at > 1.0
+
+
+def test_conditional_get_async_uses_etag(token_db, mocker):
+    mocker.patch("lib.auth.aget_access_token", return_value="tok")
+    responses = iter([
+        httpx.Response(200, json={"v": 1}, headers={"ETag": '"abc"'},
+                       request=httpx.Request("GET", "https://x")),
+        httpx.Response(304, request=httpx.Request("GET", "https://x")),
+    ])
+    sent_headers = []
+
+    async def fake_arequest(method, url, **kwargs):
+        sent_headers.append(kwargs["headers"])
+        return next(responses)
+
+    mocker.patch("lib.blizzard.arequest", side_effect=fake_arequest)
+    touched_on = []
+    touch = mocker.patch(
+        "lib.blizzard._touch_response",
+        side_effect=lambda key: touched_on.append(threading.current_thread()),
+    )
+
+    async def main():
+        return [
+            await blizzard.aapi_get_json("/data/wow/playable-race/index", "static-eu", conditional=True)
+            for _ in range(2)
+        ], threading.current_thread()
+
+    docs, loop_thread = blizzard.run(main)
+    assert docs == [{"v": 1}, {"v": 1}]
+    assert sent_headers[1]["If-None-Match"] == '"abc"'
+    touch.assert_called_once()
+    assert touched_on[0] is not loop_thread  # the 304 write stays off the event loop
+
+
+# ---------------------------------------------------------------------------
+# Unit: request coalescing
+# ---------------------------------------------------------------------------
+
+def test_single_flight_shares_one_call_across_threads():
+    from lib.singleflight import SingleFlight
+
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        time.sleep(0.05)
+        return {"v": 1}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", slow)))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=lambda: results.append(flight.do("k", slow))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    for t in [leader, *followers]:
+        t.join()
+    assert calls == [1]
+    assert results == [{"v": 1}] * 4
+    assert flight.coalesced == 3
+    assert flight.do("k", lambda: "again") == "again"  # nothing cached afterwards
+
+
+def test_single_flight_propagates_errors_to_followers():
+    import asyncio
+
+    from lib.singleflight import SingleFlight
+
+    flight = SingleFlight()
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def main():
+        return await asyncio.gather(*(flight.ado("k", boom) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert flight.coalesced == 2
+
+
+def test_concurrent_identical_gets_hit_upstream_once(mocker):
+    import asyncio
+
+    async def fake_aapi_get(*args, **kwargs):
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"id": 1}, request=httpx.Request("GET", "https://x"))
+
+    send = mocker.patch("lib.blizzard.aapi_get", side_effect=fake_aapi_get)
+
+    async def main():
+        return await asyncio.gather(
+            *(blizzard.aapi_get_json("/data/wow/media/creature-display/1", "static-eu") for _ in range(5))
+        )
+
+    assert blizzard.run(main) == [{"id": 1}] * 5
+    assert send.call_count == 1
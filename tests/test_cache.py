@@ -0,0 +1,282 @@
+"""Tests for lib/cache.py."""
+
+import threading
+import time
+
+import pytest
+
+import lib.cache as cache
+from lib.cache import DatabaseCache, TTLCache
+
+
+# ---------------------------------------------------------------------------
+# Unit: TTLCache
+# ---------------------------------------------------------------------------
+
+def test_get_or_compute_caches_per_key():
+    c = TTLCache(purge_interval=0)
+    calls = []
+
+    def compute(x):
+        calls.append(x)
+        return x * 2
+
+    assert c.get_or_compute("ns", (1,), lambda: compute(1), 60) == 2
+    assert c.get_or_compute("ns", (1,), lambda: compute(1), 60) == 2
+    assert c.get_or_compute("ns", (2,), lambda: compute(2), 60) == 4
+    assert calls == [1, 2]
+
+
+def test_expired_entry_is_recomputed():
+    c = TTLCache(purge_interval=0)
+    c.set("ns", (), "old", ttl_seconds=-1)
+    assert c.get_or_compute("ns", (), lambda: "new", 60) == "new"
+    assert c.stats()["namespaces"]["ns"]["expirations"] == 1
+
+
+def test_lru_eviction_by_entry_count():
+    c = TTLCache(max_entries=2, purge_interval=0)
+    c.set("ns", "a", 1, 60)
+    c.set("ns", "b", 2, 60)
+    c.get("ns", "a")  # touch a so b becomes least recently used
+    c.set("ns", "c", 3, 60)
+    assert c.get("ns", "b") == (False, None)
+    assert c.get("ns", "a") == (True, 1)
+    assert c.stats()["namespaces"]["ns"]["evictions"] == 1
+
+
+def test_eviction_by_byte_budget():
+    c = TTLCache(max_bytes=2000, purge_interval=0)
+    c.set("ns", "a", "x" * 1000, 60)
+    c.set("ns", "b", "y" * 1000, 60)
+    stats = c.stats()
+    assert stats["entries"] == 1
+    assert stats["bytes"] <= 2000
+    assert c.get("ns", "b")[0]
+
+
+def test_purge_expired_drops_dead_entries():
+    c = TTLCache(purge_interval=0)
+    c.set("ns", "dead", 1, -1)
+    c.set("ns", "alive", 2, 60)
+    assert c.purge_expired() == 1
+    assert c.stats()["entries"] == 1
+
+
+def test_key_locks_do_not_accumulate():
+    c = TTLCache(purge_interval=0)
+    for i in range(50):
+        c.get_or_compute("ns", (i,), lambda: i, 60)
+    assert c._key_locks == {}
+
+
+def test_concurrent_callers_compute_once():
+    c = TTLCache(purge_interval=0)
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.05)
+        return "v"
+
+    threads = [
+        threading.Thread(target=c.get_or_compute, args=("ns", (), slow, 60))
+        for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+
+
+def test_invalidate_namespace_and_single_key():
+    c = TTLCache(purge_interval=0)
+    c.set("a", 1, "x", 60)
+    c.set("a", 2, "y", 60)
+    c.set("b", 1, "z", 60)
+    assert c.invalidate("a", 1) == 1
+    assert c.invalidate("a") == 1
+    assert c.get("b", 1) == (True, "z")
+
+
+# ---------------------------------------------------------------------------
+# Unit: ttl_cache decorator
+# ---------------------------------------------------------------------------
+
+def test_decorator_keys_on_arguments():
+    calls = []
+
+    @cache.ttl_cache(ttl_seconds=60, key="test_decorator_args")
+    def lookup(char_id: int, locale: str = "en_US") -> str:
+        calls.append((char_id, locale))
+        return f"{char_id}-{locale}"
+
+    assert lookup(1) == "1-en_US"
+    assert lookup(1) == "1-en_US"
+    assert lookup(2, locale="es_ES") == "2-es_ES"
+    assert calls == [(1, "en_US"), (2, "es_ES")]
+
+    cache.invalidate("test_decorator_args", 1)
+    lookup(1)
+    assert calls[-1] == (1, "en_US")
+    cache.invalidate("test_decorator_args")
+
+
+def test_decorator_serves_last_good_value_on_failure():
+    upstream = {"fail": False}
+
+    @cache.ttl_cache(ttl_seconds=-1, key="test_fallback", fallback_ttl=60)
+    def lookup() -> str:
+        if upstream["fail"]:
+            raise RuntimeError("upstream down")
+        return "good"
+
+    first = lookup.lookup()
+    assert (first.value, first.stale) == ("good", False)
+
+    upstream["fail"] = True
+    fallback = lookup.lookup()
+    assert (fallback.value, fallback.stale) == ("good", True)
+    assert fallback.stored_at is not None
+    assert lookup() == "good"
+    assert cache.stats()["namespaces"]["test_fallback"]["fallbacks"] == 2
+    cache.invalidate("test_fallback:last_good")
+
+
+def test_decorator_without_fallback_raises():
+    @cache.ttl_cache(ttl_seconds=60, key="test_no_fallback")
+    def lookup() -> str:
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(RuntimeError, match="upstream down"):
+        lookup()
+
+
+# ---------------------------------------------------------------------------
+# Unit: stale-while-revalidate
+# ---------------------------------------------------------------------------
+
+def _wait_for(predicate, timeout: float = 2.0) -> None:
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_stale_value_served_while_refreshing():
+    c = TTLCache(purge_interval=0)
+    c.set("ns", (), "old", ttl_seconds=-1, stale_ttl=60)
+    release = threading.Event()
+
+    def slow_refresh():
+        release.wait(2)
+        return "new"
+
+    assert c.get_or_compute("ns", (), slow_refresh, 60, stale_ttl=60) == "old"
+    # A second stale read does not queue another refresh
+    assert c.get_or_compute("ns", (), slow_refresh, 60, stale_ttl=60) == "old"
+    release.set()
+    _wait_for(lambda: c.stats()["namespaces"]["ns"]["refreshes"] == 1)
+    assert c.get("ns", ()) == (True, "new")
+    stats = c.stats()["namespaces"]["ns"]
+    assert stats["stale_hits"] == 2
+    assert stats["refreshes"] == 1
+
+
+def test_failed_refresh_keeps_stale_value():
+    c = TTLCache(purge_interval=0)
+    c.set("ns", (), "old", ttl_seconds=-1, stale_ttl=60)
+
+    def boom():
+        raise RuntimeError("upstream down")
+
+    assert c.get_or_compute("ns", (), boom, 60, stale_ttl=60) == "old"
+    _wait_for(lambda: c.stats()["namespaces"]["ns"]["refresh_errors"] == 1)
+    calls = []
+    # Backing off: the next stale hits do not fire another refresh
+    assert c.get_or_compute("ns", (), lambda: calls.append(1) or "new", 60, stale_ttl=60) == "old"
+    time.sleep(0.05)
+    assert calls == []
+
+
+def test_none_result_is_not_cached_as_fresh(mocker):
+    mocker.patch.object(cache, "NEGATIVE_TTL_SECONDS", 0)
+    c = TTLCache(purge_interval=0)
+    results = iter([None, "found"])
+    assert c.get_or_compute("ns", (), lambda: next(results), 3600, stale_ttl=3600) is None
+    assert c.get_or_compute("ns", (), lambda: next(results), 3600, stale_ttl=3600) == "found"
+
+
+def test_hard_expired_value_blocks_on_compute():
+    c = TTLCache(purge_interval=0)
+    c.set("ns", (), "old", ttl_seconds=-2, stale_ttl=1)
+    assert c.get_or_compute("ns", (), lambda: "new", 60, stale_ttl=1) == "new"
+
+
+# ---------------------------------------------------------------------------
+# Unit: DatabaseCache (shared backend)
+# ---------------------------------------------------------------------------
+
+def test_database_cache_round_trip(engine):
+    c = DatabaseCache(engine=engine, purge_interval=0)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"name": "Guild", "realm": "Realm"}
+
+    assert c.get_or_compute("guild_info", (), compute, 60) == {"name": "Guild", "realm": "Realm"}
+    assert c.get_or_compute("guild_info", (), compute, 60) == {"name": "Guild", "realm": "Realm"}
+    assert calls == [1]
+    assert c.stats()["entries"] == 1
+
+
+def test_database_cache_shared_between_instances(engine):
+    """Two backends on one table behave like two workers sharing the cache."""
+    worker_a = DatabaseCache(engine=engine, purge_interval=0)
+    worker_b = DatabaseCache(engine=engine, purge_interval=0)
+    worker_a.get_or_compute("wow_token", (), lambda: 123, 60)
+    assert worker_b.get_or_compute("wow_token", (), lambda: 456, 60) == 123
+
+    worker_b.invalidate("wow_token")
+    assert worker_a.get("wow_token", ()) == (False, None)
+
+
+def test_database_cache_waits_for_lease_holder(engine):
+    worker_a = DatabaseCache(engine=engine, purge_interval=0)
+    worker_b = DatabaseCache(engine=engine, purge_interval=0, poll_interval=0.01)
+    assert worker_a._try_lease("ns", ())
+    threading.Timer(0.1, lambda: worker_a.set("ns", (), "from-a", 60)).start()
+    assert worker_b.get_or_compute("ns", (), lambda: "from-b", 60) == "from-a"
+
+
+def test_database_cache_failed_compute_releases_lease(engine):
+    c = DatabaseCache(engine=engine, purge_interval=0)
+
+    def boom():
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(RuntimeError, match="upstream down"):
+        c.get_or_compute("ns", (), boom, 60)
+    assert c.get_or_compute("ns", (), lambda: "ok", 60) == "ok"
+
+
+def test_database_cache_renews_lease_during_slow_compute(engine):
+    worker_a = DatabaseCache(engine=engine, purge_interval=0, lease_seconds=0.15)
+    worker_b = DatabaseCache(engine=engine, purge_interval=0, lease_seconds=0.15)
+    claimed_by_b = []
+
+    def slow():
+        time.sleep(0.3)  # twice the lease
+        claimed_by_b.append(worker_b._try_lease("ns", ()))
+        return "from-a"
+
+    assert worker_a.get_or_compute("ns", (), slow, 60) == "from-a"
+    assert claimed_by_b == [False]
+
+
+def test_database_cache_purge(engine):
+    c = DatabaseCache(engine=engine, purge_interval=0)
+    c.set("ns", "dead", 1, -1)
+    c.set("ns", "alive", 2, 60)
+    assert c.purge_expired() == 1
@@ -0,0 +1,167 @@
+"""Tests for the background job subsystem (lib/jobs.py) and /admin/jobs."""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+
+import lib.db as db
+import lib.jobs as jobs
+from tests.conftest import auth_headers, make_user
+
+
+@pytest.fixture
+def job_db(tmp_path, mocker):
+    # A file DB with a real pool: worker threads must not share the single
+    # connection of the in-memory test engine
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}")
+    SQLModel.metadata.create_all(engine)
+    mocker.patch.object(db, "engine", engine)
+    mocker.patch.dict(jobs._handlers)
+    yield engine
+    jobs.shutdown(wait=True)
+    engine.dispose()
+
+
+def _wait(client, job, headers=None):
+    deadline = time.time() + 5
+    while job["status"] in ("queued", "running") and time.time() < deadline:
+        time.sleep(0.02)
+        job = client.get(f"/api/admin/jobs/{job['id']}", headers=headers).json()
+    return job
+
+
+def test_job_records_progress_and_result(job_db):
+    release = threading.Event()
+
+    @jobs.handler("test.work")
+    def _work(ctx, params):
+        ctx.progress(1, 2, "halfway")
+        release.wait(5)
+        return {"n": params["n"]}
+
+    job, created = jobs.enqueue("test.work", {"n": 3})
+    assert created
+    deadline = time.time() + 5
+    while jobs.get(job.id).message != "halfway" and time.time() < deadline:
+        time.sleep(0.01)
+    running = jobs.get(job.id)
+    assert (running.status, running.progress_done, running.progress_total) == ("running", 1, 2)
+
+    # A second request for the same kind joins the active job
+    again, created = jobs.enqueue("test.work", {"n": 4})
+    assert not created and again.id == job.id
+
+    release.set()
+    deadline = time.time() + 5
+    while jobs.get(job.id).status == "running" and time.time() < deadline:
+        time.sleep(0.01)
+    done = jobs.to_dict(jobs.get(job.id))
+    assert done["status"] == "succeeded"
+    assert done["result"] == {"n": 3}
+
+
+def test_job_failure_is_recorded(job_db):
+    @jobs.handler("test.fail")
+    def _fail(ctx, params):
+        raise RuntimeError("boom")
+
+    job, _ = jobs.enqueue("test.fail")
+    deadline = time.time() + 5
+    while jobs.get(job.id).status in jobs.ACTIVE and time.time() < deadline:
+        time.sleep(0.01)
+    failed = jobs.get(job.id)
+    assert failed.status == "failed"
+    assert failed.error == "boom"
+
+
+def test_abandoned_jobs_marked_failed(job_db):
+    old = datetime.now().astimezone() - timedelta(seconds=jobs.STALE_SECONDS + 60)
+    with Session(job_db) as session:
+        session.add(db.Job(id="dead", kind="test.work", status="running", updated_at=old))
+        session.add(db.Job(id="live", kind="test.other", status="running"))
+        session.commit()
+
+    assert jobs.fail_abandoned() == 1
+    assert jobs.get("dead").status == "failed"
+    assert jobs.get("live").status == "running"
+
+
+def test_heartbeat_keeps_long_silent_job_alive(job_db, mocker):
+    mocker.patch.object(jobs, "HEARTBEAT_SECONDS", 0.05)
+    mocker.patch.object(jobs, "STALE_SECONDS", 0.3)
+    release = threading.Event()
+
+    @jobs.handler("test.silent")
+    def _silent(ctx, params):
+        release.wait(5)  # no progress writes at all
+        return None
+
+    job, _ = jobs.enqueue("test.silent")
+    time.sleep(0.6)
+    assert jobs.fail_abandoned() == 0
+    again, created = jobs.enqueue("test.silent")
+    assert not created and again.id == job.id
+    release.set()
+    assert jobs.wait(job.id, timeout=5).status == "succeeded"
+
+
+def test_one_active_job_per_kind_is_enforced_by_the_db(job_db):
+    from sqlalchemy.exc import IntegrityError
+
+    with Session(job_db) as session:
+        session.add(db.Job(id="first", kind="test.work", status="queued"))
+        session.commit()
+        session.add(db.Job(id="second", kind="test.work", status="running"))
+        with pytest.raises(IntegrityError):
+            session.commit()
+        session.rollback()
+        session.add(db.Job(id="done", kind="test.work", status="succeeded"))
+        session.commit()
+
+
+def test_seed_endpoint_queues_job(client, session, job_db, mocker):
+    make_user(session, rank=0, username="gm", character_id=2)
+    headers = auth_headers(client, "gm")
+
+    async def fake_generate(on_progress=None, changes=None, **kwargs):
+        on_progress(1, 1)
+        changes.update(added=[], changed=[], removed=[], unchanged=0, fingerprints={})
+        return {"Old": {10: {"blizzard-id": 10, "name": "Raid Ten", "encounters": []}}}, []
+
+    mocker.patch("lib.blizzard_journal.generate_raids", side_effect=fake_generate)
+    mocker.patch("lib.blizzard_journal.write_raids_yaml")
+    seed = mocker.patch("lib.instances.seed_from_data", return_value={"instances": 0})
+
+    resp = client.post("/api/admin/instances/seed?current_season=false", headers=headers)
+    assert resp.status_code == 202
+    job = _wait(client, resp.json(), headers)
+    assert job["status"] == "succeeded", job["error"]
+    assert job["kind"] == "instances.seed"
+    assert job["progress_done"] == job["progress_total"] == 1
+    assert job["result"]["instances"] == 0
+    assert job["result"]["changes"]["added"] == []
+    seed.assert_called_once()
+
+
+def test_seed_job_without_params_is_incremental_like_the_endpoint(job_db, mocker):
+    async def fake_generate(changes=None, **kwargs):
+        changes.update(fingerprints={}, expansions=["Old"])
+        return {"Old": {10: {"blizzard-id": 10, "name": "Raid Ten", "encounters": []}}}, []
+
+    generate = mocker.patch("lib.blizzard_journal.generate_raids", side_effect=fake_generate)
+    mocker.patch("lib.blizzard_journal.write_raids_yaml")
+    mocker.patch("lib.instances.seed_from_data", return_value={"instances": 1})
+
+    job, _ = jobs.enqueue("instances.seed")
+    job = jobs.wait(job.id, timeout=5)
+    assert job.status == "succeeded", job.error
+    assert generate.call_args.kwargs["incremental"] is True
+
+
+def test_get_unknown_job_is_404(client, session, job_db):
+    make_user(session, rank=0, username="gm", character_id=2)
+    resp = client.get("/api/admin/jobs/nope", headers=auth_headers(client, "gm"))
+    assert resp.status_code == 404
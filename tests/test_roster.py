@@ -1,7 +1,20 @@
 """Tests for /guild/roster endpoints (DB-backed, no Blizzard API calls)."""
 
+import json
+
+import pytest
+
 from tests.conftest import auth_headers, make_guild_member, make_user
 import lib.db as db
+import lib.jobs as jobs
+
+
+@pytest.fixture
+def roster_db(engine, mocker):
+    """Refreshes run as jobs on worker threads, against ``db.engine``."""
+    mocker.patch.object(db, "engine", engine)
+    yield engine
+    jobs.shutdown(wait=True)
 
 
 def test_roster_open_when_no_users(client, session):
@@ -19,6 +32,44 @@ def test_roster_requires_auth_after_first_user(client, session):
     assert resp.status_code == 401
 
 
+def test_bootstrap_ends_when_first_user_appears_then_stays_latched(client, session, engine):
+    from sqlalchemy import event
+
+    make_guild_member(session)
+    assert client.get("/api/guild/roster").status_code == 200
+    make_user(session)  # e.g. created by another worker
+    assert client.get("/api/guild/roster").status_code == 401
+
+    headers = auth_headers(client)
+    client.get("/api/guild/roster", headers=headers)
+    user_selects = []
+
+    def listener(conn, cursor, statement, *args):
+        if statement.startswith("SELECT") and "FROM user" in statement:
+            user_selects.append(statement)
+
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert client.get("/api/guild/roster", headers=headers).status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert user_selects == []
+
+
+def test_latched_worker_notices_a_reset_done_elsewhere(client, session, mocker):
+    import lib.security as security
+
+    make_guild_member(session)
+    user = make_user(session)
+    assert client.get("/api/guild/roster").status_code == 401  # latched: users exist
+
+    session.delete(user)  # /admin/db/reset served by another worker
+    session.commit()
+    assert client.get("/api/guild/roster").status_code == 401  # still latched here
+    mocker.patch.object(security, "_users_exist_until", 0.0)  # latch window elapsed
+    assert client.get("/api/guild/roster").status_code == 200
+
+
 def test_roster_accessible_with_auth(client, session):
     make_user(session)
     resp = client.get("/api/guild/roster", headers=auth_headers(client))
@@ -64,3 +115,234 @@ def test_roster_limit_max_500(client, session):
     make_user(session)
     resp = client.get("/api/guild/roster?limit=501", headers=auth_headers(client))
     assert resp.status_code == 422
+
+
+def test_update_roster_replaces_members(client, session, roster_db, mocker):
+    make_guild_member(session, character_id=1, name="Leaving")
+    make_user(session, rank=0, username="gm", character_id=2)
+
+    async def fake_roster():
+        return {"roster": [{
+            "id": 2, "name": "Staying", "realm": "test-realm", "level": 80,
+            "race": "Human", "class": "Warrior", "faction": "ALLIANCE", "rank": 0,
+        }]}
+
+    mocker.patch("lib.guild.get_guild_roster", side_effect=fake_roster)
+    resp = client.post("/api/guild/roster/update?wait=true", headers=auth_headers(client, "gm"))
+    assert resp.status_code == 200
+    assert resp.json()["count"] == 1
+    session.expire_all()
+    assert session.get(db.GuildMember, 1) is None
+    assert session.get(db.GuildMember, 2).name == "Staying"
+
+
+def test_update_roster_keeps_class_when_lookup_failed(client, session, roster_db, mocker):
+    make_user(session, rank=0, username="gm", character_id=2)
+
+    async def fake_roster():
+        return {
+            "roster": [{
+                "id": 2, "name": "Staying", "realm": "test-realm", "level": 80,
+                "race": "Human", "class": None, "faction": "ALLIANCE", "rank": 0,
+            }],
+            "warnings": ["class lookup failed: 503"],
+        }
+
+    mocker.patch("lib.guild.get_guild_roster", side_effect=fake_roster)
+    resp = client.post("/api/guild/roster/update?wait=true", headers=auth_headers(client, "gm"))
+    assert resp.status_code == 200
+    assert resp.json()["warnings"] == ["class lookup failed: 503"]
+    session.expire_all()
+    assert session.get(db.GuildMember, 2).clazz == "Warrior"
+
+
+def test_update_roster_fetch_failure_is_502(client, session, roster_db, mocker):
+    make_guild_member(session, character_id=1, name="Kept")
+    make_user(session, rank=0, username="gm", character_id=2)
+    mocker.patch("lib.guild.get_guild_roster", side_effect=RuntimeError("blizzard down"))
+    resp = client.post("/api/guild/roster/update?wait=true", headers=auth_headers(client, "gm"))
+    assert resp.status_code == 502
+    session.expire_all()
+    assert session.get(db.GuildMember, 1) is not None
+
+
+def test_guild_info_served_stale_when_blizzard_down(client, session, mocker):
+    import lib.cache as cache
+
+    make_user(session)
+    info = mocker.patch(
+        "lib.guild.get_guild_info",
+        return_value={"name": "Guild", "realm": "Realm", "faction": "Horde"},
+    )
+    resp = client.get("/api/guild", headers=auth_headers(client))
+    assert resp.json()["stale"] is False
+
+    cache.invalidate("guild_info")
+    info.side_effect = RuntimeError("circuit open")
+    resp = client.get("/api/guild", headers=auth_headers(client))
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["name"] == "Guild"
+    assert body["stale"] is True
+    assert "as_of" in body
+    cache.invalidate("guild_info:last_good")
+
+
+def test_update_roster_writes_only_changes(client, session, roster_db, mocker):
+    unchanged = make_guild_member(session, character_id=1, name="Same")
+    make_guild_member(session, character_id=2, name="Renamed")
+    make_guild_member(session, character_id=3, name="Leaving")
+    gm = make_user(session, rank=0, username="gm", character_id=4)
+    linked = session.get(db.GuildMember, 1)
+    linked.user_id = gm.id
+    session.add(linked)
+    session.commit()
+    before = unchanged.fetched_at
+
+    def member(cid, name, rank=2):
+        return {
+            "id": cid, "name": name, "realm": "test-realm", "level": 80,
+            "race": "Human", "class": "Warrior", "faction": "ALLIANCE", "rank": rank,
+        }
+
+    async def fake_roster():
+        return {"roster": [member(1, "Same"), member(2, "NewName"), member(4, "TestChar", 0), member(5, "Joiner")]}
+
+    mocker.patch("lib.guild.get_guild_roster", side_effect=fake_roster)
+    resp = client.post("/api/guild/roster/update?wait=true", headers=auth_headers(client, "gm"))
+    assert resp.status_code == 200
+    body = resp.json()
+    assert (body["inserted"], body["changed"], body["removed"]) == (1, 1, 1)
+
+    session.expire_all()
+    same = session.get(db.GuildMember, 1)
+    assert same.user_id == gm.id
+    assert same.fetched_at == before
+    assert session.get(db.GuildMember, 2).name == "NewName"
+    assert session.get(db.GuildMember, 3) is None
+    assert session.get(db.GuildMember, 5).name == "Joiner"
+
+
+def test_update_roster_runs_as_background_job(client, session, roster_db, mocker):
+    import time
+
+    make_user(session, rank=0, username="gm", character_id=2)
+    headers = auth_headers(client, "gm")
+
+    async def fake_roster():
+        return {"roster": [{
+            "id": 7, "name": "Background", "realm": "test-realm", "level": 80,
+            "race": "Human", "class": "Mage", "faction": "ALLIANCE", "rank": 3,
+        }]}
+
+    mocker.patch("lib.guild.get_guild_roster", side_effect=fake_roster)
+    resp = client.post("/api/guild/roster/update", headers=headers)
+    assert resp.status_code == 202
+    job = resp.json()
+    assert job["kind"] == "roster.update"
+
+    deadline = time.time() + 5
+    while job["status"] in ("queued", "running") and time.time() < deadline:
+        time.sleep(0.02)
+        job = client.get(f"/api/admin/jobs/{job['id']}", headers=headers).json()
+    assert job["status"] == "succeeded", job["error"]
+    assert job["result"]["inserted"] == 1
+    session.expire_all()
+    assert session.get(db.GuildMember, 7).name == "Background"
+
+
+def test_periodic_job_runs_on_interval():
+    import threading
+
+    from lib.scheduler import PeriodicJob
+
+    ran = threading.Event()
+    job = PeriodicJob("test", lambda: ran.set() or {"ok": True}, interval=0.01, jitter=0.01)
+    job.start()
+    try:
+        assert ran.wait(2)
+    finally:
+        job.stop()
+    assert job.status()["leader"] is False  # released on stop
+    assert job.last_result == {"ok": True}
+
+
+def test_waited_update_joins_the_active_job(client, session, roster_db, mocker):
+    import threading
+
+    make_user(session, rank=0, username="gm", character_id=2)
+    headers = auth_headers(client, "gm")
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    async def slow_roster():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"roster": [{
+            "id": 2, "name": "Once", "realm": "test-realm", "level": 80,
+            "race": "Human", "class": "Mage", "faction": "ALLIANCE", "rank": 0,
+        }]}
+
+    mocker.patch("lib.guild.get_guild_roster", side_effect=slow_roster)
+    queued = client.post("/api/guild/roster/update", headers=headers).json()
+    assert started.wait(5)
+    threading.Timer(0.2, release.set).start()
+    resp = client.post("/api/guild/roster/update?wait=true", headers=headers)
+    assert resp.status_code == 200
+    assert resp.json()["count"] == 1
+    assert len(calls) == 1
+    assert jobs.get(queued["id"]).status == "succeeded"
+
+
+def test_advisory_lock_is_reverified_while_held(mocker):
+    engine = mocker.patch.object(db, "engine")
+    engine.dialect.name = "postgresql"
+    conn = engine.connect.return_value.execution_options.return_value
+    conn.execute.return_value.scalar.return_value = True  # pg_try_advisory_lock
+    lock = db.AdvisoryLock(42)
+    assert lock.acquire()
+
+    conn.execute.return_value.first.return_value = (1,)  # still in pg_locks
+    assert lock.acquire()
+    assert engine.connect.call_count == 1
+
+    conn.execute.return_value.first.return_value = None  # session dropped
+    conn.execute.return_value.scalar.return_value = False  # another worker took it
+    assert not lock.acquire()
+    conn.invalidate.assert_called_once()
+    assert lock.held is False
+
+
+def test_populate_joins_a_refresh_already_running(session, roster_db, mocker):
+    import threading
+
+    import main
+    from lib import roster
+
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    async def slow_roster():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"roster": [{
+            "id": 3, "name": "Shared", "realm": "test-realm", "level": 80,
+            "race": "Human", "class": "Mage", "faction": "ALLIANCE", "rank": 1,
+        }]}
+
+    mocker.patch("lib.guild.get_guild_roster", side_effect=slow_roster)
+    mocker.patch.object(main, "_get_guild_info_cached")
+    scheduled = threading.Thread(target=roster.refresher.run_now)  # e.g. the hourly run
+    scheduled.start()
+    assert started.wait(5)
+
+    job, _ = jobs.enqueue("db.populate")
+    threading.Timer(0.2, release.set).start()
+    job = jobs.wait(job.id, timeout=5)
+    scheduled.join(5)
+
+    assert job.status == "succeeded", job.error
+    assert json.loads(job.result)["roster"]["count"] == 1
+    assert len(calls) == 1
@@ -44,6 +44,18 @@ def test_create_first_user_always_owner(client, session):
     assert data["role"] == "owner"
 
 
+def test_create_user_hashes_without_blocking_the_request_thread(client, session, mocker):
+    import lib.security as security
+
+    blocking = mocker.spy(security, "get_password_hash")
+    make_guild_member(session)
+    resp = client.post(
+        "/api/users", json={"username": "newuser", "password": "Valid1!!", "character_id": 1}
+    )
+    assert resp.status_code == 200
+    blocking.assert_not_called()
+
+
 def test_create_user_explicit_role(client, session):
     make_user(session, rank=0, username="owner1")
     make_guild_member(session, character_id=2, name="Officer")